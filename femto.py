@@ -8,11 +8,12 @@
 import time
 import math
 import sys
-import random  # random number generator for secondary calibration
-import pdb
+import signal
+import threading
 
 import numpy
-from scipy.optimize import leastsq # for secondary calibration
+# scipy, asyncio and the generation specific locker modules are imported where
+# they are used, which keeps them off the startup path
 # from pylab import *
 # try:
 #     from psp.Pv import Pv 
@@ -33,35 +34,382 @@ from support.PVS import PVS
 from support.ErrorOutput import error_output
 from support.Degrees import degrees_s
 from support.ErrorOutput import error_output
-from support.laserlockerversions.Gen1LaserLocker import LaserLocker as Gen1LaserLocker
-from support.laserlockerversions.Gen2LaserLocker import LaserLocker as Gen2LaserLocker
 from support.Trigger import Trigger
+from support.Scheduler import Scheduler, Task
+from support.LoopTimer import LoopTimer
+from support.SecondaryCalibration import fitres, ffun
 
-def fitres(param, tin, tout):
-    """ Compute error in calibration fit.
+# pvs whose changes wake the main loop in event driven mode
+EVENT_PVS = ['time', 'enable', 'calibrate', 'fix_bucket', 'secondary_calibration_enable',
+    'deg_Sband', 'deg_offset', 'offset', 'ns_offset', 'counter']
 
-    Arguments: 
-    tin -- is input time
-    tout -- measured
-    param -- parameters for fit
+# default periods (seconds) of the main loop duties when "schedule" is set;
+# time runs at the loop_period of the unscheduled loop
+SCHEDULE = {'watchdog' : 1.0, 'status' : 1.0, 'requests' : 0.5, 'jumps' : 1.0,
+    'time' : 0.2, 'secondary' : 1.0, 'degrees' : 1.0, 'stats' : 10.0, 'state' : 10.0}
+# duties that use the locker, which the async engine runs one at a time
+LOCKER_DUTIES = ['status', 'requests', 'jumps', 'time', 'secondary', 'state']
+# pvs whose changes run a scheduled duty straight away
+TRIGGERS = {
+    'requests' : ['calibrate', 'secondary_calibration_enable'],
+    'jumps' : ['counter'],
+    'time' : ['time', 'enable', 'offset'],
+    'degrees' : ['time', 'deg_Sband', 'ns_offset', 'deg_offset'],
+}
+
+def build_locker(config_fpath, backend=None, localdebug=True, fast_start=None):
+    """ Create the PV set, watchdog, laser locker, trigger and degrees conversion
+    for an installation.
+
+    With fast_start, the watchdog initialization (which waits a second to
+    make sure no other instance is running) overlaps the construction of the
+    locker objects, which don't depend on it. A breakdown of the startup,
+    with the steps on the critical path marked, is written to the error log.
+
+    Arguments:
+    config_fpath -- path to the configuration file
+    backend -- optional pv backend (see support/backend)
+    localdebug -- print error output locally
+    fast_start -- overlap independent startup steps; if None, the
+        "fast_start" key in add_config decides (default off)
+
+    Returns (P, W, L, T, D), or None if the locker can not run.
     """
-    sa,ca = param  # sine and cosine amplitudes
-    err= tout - ffun(tin, sa, ca)
-    return err
-        
-def ffun( x, a, b):
-    """ Support function for fitres.
-    
+    t0 = time.time()
+    trace = [] # (step, start, end) of each startup step
+    P = PVS(config_fpath,epicsdebug=False,localdebug=localdebug,backend=backend)
+    trace.append(('pvs', t0, time.time()))
+    if P.OK == 0:
+        return None
+    add_config = P.config.config["add_config"]
+    if fast_start is None:
+        fast_start = add_config.get("fast_start", False)
+    def init_watchdog():
+        t = time.time()
+        watchdog_init['W'] = watchdog.watchdog(P.config.pvlist['watchdog'])
+        trace.append(('watchdog', t, time.time()))
+    watchdog_init = {}
+    if fast_start:
+        def run():
+            P.config.backend.attach_thread()
+            init_watchdog()
+        thread = threading.Thread(target=run, name='watchdog-init')
+        thread.start()
+    else:
+        init_watchdog()
+        if watchdog_init['W'].error:
+            return None
+    t = time.time()
+    if P.config.is_atca:
+        from support.laserlockerversions.Gen2LaserLocker import LaserLocker
+    else:
+        from support.laserlockerversions.Gen1LaserLocker import LaserLocker
+    L = LaserLocker(P.E,P,None) # the watchdog is filled in below
+    trace.append(('locker', t, time.time()))
+    t = time.time()
+    T = L.T # the locker owns the trigger
+    T.refresh()
+    if "deg_conversion_freq" in add_config:
+        D = degrees_s(P,add_config["deg_conversion_freq"]) # manages conversion of degrees to ns and back
+    else:
+        D = degrees_s(P,2.856)
+    trace.append(('trigger and degrees', t, time.time()))
+    # Only reads so far: nothing is written until the watchdog has confirmed
+    # that no other instance is running this locker
+    if fast_start:
+        thread.join()
+    W = watchdog_init.get('W')
+    if W is None or W.error:
+        return None
+    L.W = W
+    t = time.time()
+    L.restore_state() # warm restart, if enabled and recent enough
+    L.locker_status()  # check locking sysetm / laser status
+    P.E.write_error( {"value":L.message,"lvl":2})
+    trace.append(('locker status', t, time.time()))
+    L.start_drift_worker() # if enabled
+    P.E.write_error({'value':startup_report(trace, t0),"lvl":2})
+    return P, W, L, T, D
+
+def startup_report(trace, t0):
+    """ Return a printable breakdown of startup, marking the critical path.
+
+    The critical path is found by walking back from the last step to end,
+    each time to the latest step that ended before the current one began.
+
+    Arguments:
+    trace -- list of (step, start, end) times
+    t0 -- time startup began
+    """
+    end = max([e for step, s, e in trace])
+    critical = []
+    t = end
+    while True:
+        before = [x for x in trace if x[2] <= t + 1e-6 and x not in critical]
+        if not before:
+            break
+        step = max(before, key=lambda x: x[2])
+        critical.append(step)
+        t = step[1]
+    lines = ['startup: %.3f s (* critical path)'%(end - t0)]
+    for step in sorted(trace, key=lambda x: x[1]):
+        mark = '*' if step in critical else ' '
+        lines.append('  %s %-22s %8.3f to %8.3f s'%(mark, step[0], step[1] - t0, step[2] - t0))
+    return '\n'.join(lines)
+
+def recover(P, timeout=None):
+    """ Incremental recovery after an error in the main loop.
+
+    Waits for only the channels that have dropped to come back, leaving the
+    locker, its calibration and counter history, and the watchdog in place.
+    The time taken is recorded in the PVS statistics as 'recovery'.
+
+    Arguments:
+    P -- PVS object of the running locker
+    timeout -- seconds to wait for dropped channels; the config timeout if None
+
+    Returns True if every channel is connected again.
+    """
+    t0 = time.time()
+    failed = P.reconnect(timeout)
+    dt = time.time() - t0
+    if failed:
+        P.stats.record('recovery', 'inc', dt, 'error', ', '.join(failed))
+        return False
+    P.stats.record('recovery', 'inc', dt)
+    P.E.write_error({'value':'recovered in %.3f s'%(dt),"lvl":2})
+    return True
+
+def handle_error(config_fpath, locker, errors, exc_type):
+    """ Respond to an otherwise uncaught error in the main loop.
+
+    First tries to carry on with the objects we have, only rebuilding
+    everything if channels stay down or the errors keep coming.
+
+    Arguments:
+    config_fpath -- path to the configuration file
+    locker -- (P, W, L, T, D) of the running locker
+    errors -- number of consecutive passes ending in an error, this one included
+    exc_type -- type of the exception caught
+
+    Returns the locker to carry on with, or None if it can not run.
+    """
+    P = locker[0]
+    P.E.write_error({'value':str(exc_type),"lvl":2})
+    P.E.write_error({'value':'UNKNOWN ERROR, trying again',"lvl":2})
+    if errors <= 3 and recover(P):
+        return locker
+    t0 = time.time()
+    locker[2].stop_drift_worker()
+    P.close() # release our channels so unshared ones are recreated
+    locker = build_locker(config_fpath, P.config.backend, localdebug=False)
+    if locker is None:
+        return None
+    locker[0].stats.record('recovery', 'full', time.time() - t0)
+    return locker
+
+def check_status(P, L, timer):
+    """ Check the locking system, returning True if the laser is OK.
+
+    Arguments:
+    P -- PVS object
+    L -- laser locker
+    timer -- LoopTimer for the phases of the loop
+    """
+    P.put('busy', 0)
+    with timer.phase('status'):
+        L.locker_status()  # check if the locking sysetm is OK
+    if not L.laser_ok:  # if the laser isn't working, for now just do nothign, eventually suggest fixes
+        P.E.write_error({'value':L.message,"lvl":2})
+        P.put('ok', 0)
+        P.E.write_error({'value':'laser not ok, looping',"lvl":2})
+        return False
+    return True
+
+def run_requests(P, L):
+    """ Carry out a requested calibration, returning True if one was run.
+
+    Arguments:
+    P -- PVS object
+    L -- laser locker
+    """
+    #if beamFind_enabled:
+    # This functionality is currently disabled pending more testing for LCLS-II high rate operation
+    #    L.findBeam()
+    if P.get('calibrate'):
+        P.E.write_error({'value':'calib requested',"lvl":2})
+        P.put('ok', 0)
+        P.put('busy', 1) # sysetm busy calibrating
+        P.E.write_error({'value':'calibration requested - starting',"lvl":2})
+        with L.motor_lock: # keeps the drift worker off the motor
+            L.calibrate()
+        P.put('calibrate', 0)
+        P.E.write_error({'value':' calibration done',"lvl":2})
+        return True
+    if  P.config.use_secondary_calibration:  # run calibration against scope
+        if P.get('secondary_calibration_enable'): # not requested  
+            P.put('ok', 0)
+            P.put('busy', 1) # sysetm busy calibrating
+            P.E.write_error({'value':'secondary calibration',"lvl":2})
+            with L.motor_lock:
+                L.second_calibrate()
+            P.put('secondary_calibration_enable', 0)
+            P.E.write_error({'value':' secondary calibration done',"lvl":2})
+            return True
+        pass
+    return False
+
+def check_jumps(P, L, timer):
+    """ Look for bucket jumps, fix them if enabled, and report.
+
+    Arguments:
+    P -- PVS object
+    L -- laser locker
+    timer -- LoopTimer for the phases of the loop
+    """
+    P.E.write_error({'value':'check for jumps',"lvl":2})
+    with timer.phase('check_jump'), L.motor_lock: # reads the motor, keep the drift worker off it
+        L.check_jump()   # looks for phase jumps relative to phase control / trigger
+    if P.get('fix_bucket') and L.buckets != 0 and P.get('enable'):
+        P.E.write_error({'value':'fix buckets',"lvl":2})
+        P.put('ok', 0)
+        P.put('busy', 1)
+        with timer.phase('fix_jump'), L.motor_lock:
+            L.fix_jump()  # fixes bucket jumps - careful
+    P.put_many({'bucket_error':L.buckets, 'unfixed_error':L.bucket_error, 'ok':1})
+
+def control_time(P, L, timer):
+    """ Set the laser time, if time control is enabled.
+
+    Arguments:
+    P -- PVS object
+    L -- laser locker
+    timer -- LoopTimer for the phases of the loop
+    """
+    if P.get('enable'): # is enable time control active?
+        P.E.write_error({'value':'time ctrl enabled, set time',"lvl":2})
+        with timer.phase('set_time'), L.motor_lock:
+            L.set_time() # set time read earlier
+
+def update_secondary(L, timer):
+    """ Feed the online secondary calibration estimator, where enabled.
+
     Arguments:
-    x -- 
-    a --
-    b --
+    L -- laser locker
+    timer -- LoopTimer for the phases of the loop
     """
-    w0 = 2.600*2*numpy.pi
-    out = a*numpy.sin(x * w0) + b * numpy.cos(x*w0)
-    return out        
+    with timer.phase('secondary'):
+        L.update_secondary_calibration()
 
-def femto(config_fpath='NULL'):
+def run_degrees(D, timer):
+    """ Keep the degrees and nanosecond pvs consistent.
+
+    Arguments:
+    D -- degrees conversion
+    timer -- LoopTimer for the phases of the loop
+    """
+    with timer.phase('degrees'):
+        D.run()  # deals with degreees S band conversion    
+
+def publish_stats(P, timer):
+    """ Publish pv access and loop timing summaries, each at its own low rate.
+
+    Arguments:
+    P -- PVS object
+    timer -- LoopTimer for the phases of the loop
+    """
+    P.publish_stats()
+    timer.publish(P)
+
+def control_pass(P, L, D, timer):
+    """ One pass of the main loop, following the watchdog check.
+
+    Arguments:
+    P -- PVS object
+    L -- laser locker
+    D -- degrees conversion
+    timer -- LoopTimer for the phases of the loop
+    """
+    if not check_status(P, L, timer):
+        time.sleep(0.5)  # to keep the loop from spinning too fast
+        return            #just try again if the laser isn't ready
+    if run_requests(P, L):
+        return
+    check_jumps(P, L, timer)
+    control_time(P, L, timer)
+    update_secondary(L, timer)
+    run_degrees(D, timer)
+    publish_stats(P, timer)
+    L.save_state()
+
+def changed(state, names):
+    """ Return a trigger that fires when any of the named pvs has changed.
+
+    The names must be watched (see PVS.watch).
+
+    Arguments:
+    state -- dictionary holding the running locker under 'locker'
+    names -- list of config pv names
+    """
+    seen = {}
+    def trigger():
+        P = state['locker'][0]
+        counts = [P.changes.get(k, 0) for k in names]
+        if counts == seen.get('counts'):
+            return False
+        seen['counts'] = counts
+        return True
+    return trigger
+
+def build_scheduler(state, periods):
+    """ Build the multi-rate scheduler for the main loop duties.
+
+    Duties that follow operator requests or counter samples also run as soon
+    as their pvs change. Tasks look the locker up in state on every run, so
+    the scheduler survives a rebuild of the locker.
+
+    Arguments:
+    state -- dictionary holding the running (P, W, L, T, D) under 'locker'
+        and the LoopTimer under 'timer'
+    periods -- dictionary of duty name -> period in seconds, overriding SCHEDULE
+
+    Returns the Scheduler and the list of pv names its triggers need watched.
+    """
+    periods = dict(SCHEDULE, **periods)
+    status = {'ok' : False}
+    timer = state['timer']
+    def locker():
+        return state['locker']
+    def watchdog_check():
+        with timer.phase('watchdog'):
+            locker()[1].check()
+    def status_check():
+        P, W, L, T, D = locker()
+        P.E.write_error({'value':'main loop start',"lvl":2})
+        status['ok'] = check_status(P, L, timer)
+    def requests():
+        P, W, L, T, D = locker()
+        if run_requests(P, L):
+            status['ok'] = False # recheck the laser before anything else
+    def laser_ok():
+        return status['ok']
+    tasks = [
+        Task('watchdog', watchdog_check, periods['watchdog']),
+        Task('status', status_check, periods['status']),
+        Task('requests', requests, periods['requests'], changed(state, TRIGGERS['requests']), laser_ok),
+        Task('jumps', lambda: check_jumps(locker()[0], locker()[2], timer), periods['jumps'], changed(state, TRIGGERS['jumps']), laser_ok),
+        Task('time', lambda: control_time(locker()[0], locker()[2], timer), periods['time'], changed(state, TRIGGERS['time']), laser_ok),
+        Task('secondary', lambda: update_secondary(locker()[2], timer), periods['secondary'], when=laser_ok),
+        Task('degrees', lambda: run_degrees(locker()[4], timer), periods['degrees'], changed(state, TRIGGERS['degrees'])),
+        Task('stats', lambda: publish_stats(locker()[0], timer), periods['stats']),
+        Task('state', lambda: locker()[2].save_state(), periods['state']),
+    ]
+    watched = []
+    for names in TRIGGERS.values():
+        watched += [k for k in names if k not in watched]
+    return Scheduler(tasks), watched
+
+def femto(config_fpath='NULL', backend=None):
     """ Script-like main function for an instance of the laser locker HLA.
     
     The parent logical object for an instance of femto.py; initializes
@@ -69,98 +417,231 @@ def femto(config_fpath='NULL'):
     
     Arguments:
     config_fpath -- path to a configuration file to load that describes the PV structure an installation
+    backend -- optional pv backend (see support/backend); defaults to the
+        "pv_backend" configuration key, normally epics
     """
     config = Config()
-    P = PVS(config_fpath,epicsdebug=False,localdebug=True)
-    if P.OK == 0:
+    locker = build_locker(config_fpath, backend)
+    if locker is None:
         return
-    W = watchdog.watchdog(P.config.pvlist['watchdog'])
-    if W.error:
-        return
-    if P.config.is_atca:
-        L = Gen2LaserLocker(P.E,P,W)
-    else:
-        L = Gen1LaserLocker(P.E,P,W)
-    if "find_beam_ctl" in P.config.config["add_config"]:
+    P, W, L, T, D = locker
+    add_config = P.config.config["add_config"]
+    if "find_beam_ctl" in add_config:
         beamFind_enabled = True
     else:
         beamFind_enabled = False
-    L.locker_status()  # check locking sysetm / laser status
-    P.E.write_error( {"value":L.message,"lvl":2})
-    T = Trigger(P)
-    T.get_ns()
-    if "deg_conversion_freq" in P.config.config["add_config"]:
-        D = degrees_s(P,P.config.config["add_config"]["deg_conversion_freq"]) # manages conversion of degrees to ns and back
-    else:
-        D = degrees_s(P,2.856)
+    options = {
+        'loop_period' : add_config.get("loop_period", 0.2), # 0 runs flat out, eg. against the simulator
+        # Event driven mode: rather than polling every loop_period, wait for a
+        # control pv or the counter to change, running anyway after max_idle s
+        'event_loop' : add_config.get("event_loop", False),
+        'event_pvs' : add_config.get("event_pvs", EVENT_PVS),
+        'max_idle' : add_config.get("max_idle", 1.0),
+        'heartbeat_period' : add_config.get("heartbeat_period", 1.0),
+        'engine' : add_config.get("engine", "sync"),
+    }
+    # the running locker, replaced on a full rebuild, and the loop phase timer
+    timer = LoopTimer(add_config.get("loop_stats_window", 1000), add_config.get("loop_stats_interval", 60.0))
+    state = {'locker' : locker, 'timer' : timer}
+    # Multi-rate mode: each duty of the loop runs on its own period or when
+    # its pvs change, rather than all of them on every pass
+    S = None
+    watched = []
+    if options['event_loop']:
+        watched = list(options['event_pvs'])
+    schedule = add_config.get("schedule", False)
+    if options['engine'] == "async" and not schedule:
+        schedule = True # the async engine runs the scheduled duties as tasks
+    if schedule:
+        if schedule is True:
+            schedule = {}
+        if options['loop_period'] > 0: # set_time keeps the rate of the unscheduled loop
+            schedule = dict({'time' : options['loop_period']}, **schedule)
+        if options['engine'] == "async":
+            schedule = dict({'watchdog' : options['heartbeat_period']}, **schedule)
+        S, triggers = build_scheduler(state, schedule)
+        watched += [k for k in triggers if k not in watched]
+    options['scheduler'] = S
+    options['watched'] = watched
+    def dump_stats(signum, frame):
+        print(state['locker'][0].dump_stats()) # channel access statistics on demand: kill -USR1 <pid>
+        print(timer.dump())
+        if S is not None:
+            print(S.dump())
+        drift = getattr(state['locker'][2], 'drift', None)
+        if drift is not None and state['locker'][0].config.use_drift_correction:
+            print(drift.dump())
+        if state['locker'][2].drift_worker is not None:
+            print(state['locker'][2].drift_worker.dump())
+    try:
+        signal.signal(signal.SIGUSR1, dump_stats)
+    except (AttributeError, ValueError): # no SIGUSR1 on this platform, or not the main thread
+        pass
+    P.watch(watched)
+    if options['engine'] == "async":
+        import asyncio
+        asyncio.run(run_async(config_fpath, state, options))
+        state['locker'][2].stop_drift_worker()
+        state['locker'][2].save_state(force=True)
+        state['locker'][0].E.write_error({'value':'done, exiting',"lvl":2})
+        return
+    errors = 0 # consecutive passes ending in an error
     while W.error ==0:   # MAIN PROGRAM LOOP
-        time.sleep(0.2)
+        if S is not None:
+            P.wait_event(S.time_to_next(options['max_idle']))
+        elif options['event_loop']:
+            P.wait_event(options['max_idle'])
+        else:
+            time.sleep(options['loop_period'])
         try:   # the never give up, never surrunder loop. 
-            P.E.write_error({'value':'main loop start',"lvl":2})
-            W.check()
-            P.put('busy', 0)
-            L.locker_status()  # check if the locking sysetm is OK
-            if not L.laser_ok:  # if the laser isn't working, for now just do nothign, eventually suggest fixes
-                P.E.write_error({'value':L.message,"lvl":2})
-                P.put('ok', 0)
-                P.E.write_error({'value':'laser not ok, looping',"lvl":2})
-                time.sleep(0.5)  # to keep the loop from spinning too fast
-                continue            #just try again if the laser isn't ready
-            #if beamFind_enabled:
-            # This functionality is currently disabled pending more testing for LCLS-II high rate operation
-            #    L.findBeam()
-            if P.get('calibrate'):
-                P.E.write_error({'value':'calib requested',"lvl":2})
-                P.put('ok', 0)
-                P.put('busy', 1) # sysetm busy calibrating
-                P.E.write_error({'value':'calibration requested - starting',"lvl":2})
-                L.calibrate()
-                P.put('calibrate', 0)
-                P.E.write_error({'value':' calibration done',"lvl":2})
-                continue
-            if  P.config.use_secondary_calibration:  # run calibration against scope
-                if P.get('secondary_calibration_enable'): # not requested  
-                    P.put('ok', 0)
-                    P.put('busy', 1) # sysetm busy calibrating
-                    P.E.write_error({'value':'secondary calibration',"lvl":2})
-                    L.second_calibrate()
-                    P.put('secondary_calibration_enable', 0)
-                    P.E.write_error({'value':' secondary calibration done',"lvl":2})
-                    continue
-                pass
-            P.E.write_error({'value':'check for jumps',"lvl":2})
-            L.check_jump()   # looks for phase jumps relative to phase control / trigger
-            if P.get('fix_bucket') and L.buckets != 0 and P.get('enable'):
-                P.E.write_error({'value':'fix buckets',"lvl":2})
-                P.put('ok', 0)
-                P.put('busy', 1)
-                L.fix_jump()  # fixes bucket jumps - careful
-            P.put('bucket_error',  L.buckets)
-            P.put('unfixed_error', L.bucket_error)
-            P.put('ok', 1)
-            if P.get('enable'): # is enable time control active?
-                P.E.write_error({'value':'time ctrl enabled, set time',"lvl":2})
-                L.set_time() # set time read earlier    
-            D.run()  # deals with degreees S band conversion    
+            if S is not None:
+                S.tick()
+            else:
+                P.E.write_error({'value':'main loop start',"lvl":2})
+                with timer.phase('watchdog'):
+                    W.check()
+                with timer.phase('pass'):
+                    control_pass(P, L, D, timer)
+            errors = 0
         except:   # catch any otherwise uncaught error.
-            P.E.write_error({'value':str(sys.exc_info()[0]),"lvl":2})
-            P.E.write_error({'value':'UNKNOWN ERROR, trying again',"lvl":2})
-            P = PVS(config_fpath,epicsdebug=False,localdebug=False)
-            if P.OK == 0:
-                return
-            W = watchdog.watchdog(P.config.pvlist['watchdog'])
-            if W.error:
+            errors += 1
+            recovered = handle_error(config_fpath, state['locker'], errors, sys.exc_info()[0])
+            if recovered is None:
                 return
-            if P.config.is_atca:
-                L = Gen2LaserLocker(P.E,P,W)
-            else:
-                L = Gen1LaserLocker(P.E,P,W)
-            L.locker_status()  # check locking sysetm / laser status
-            P.E.write_error({'value':L.message,"lvl":2})
-            T = Trigger(P)
-            T.get_ns()
+            if recovered is not state['locker']:
+                state['locker'] = recovered
+                P, W, L, T, D = recovered
+                P.watch(watched)
+                errors = 0
+    L.stop_drift_worker()
+    L.save_state(force=True)
     P.E.write_error({'value':'done, exiting',"lvl":2})        
 
+async def run_async(config_fpath, state, options):
+    """ asyncio engine for the main loop.
+
+    Each duty of the scheduler (see build_scheduler) runs as its own asyncio
+    task, in a worker thread when it falls due, so duties overlap: the
+    watchdog heartbeat, the degrees conversion and the statistics keep
+    running while a motor move, a calibration or a slow IOC holds up the
+    duties that use the locker. Those (LOCKER_DUTIES) run one at a time, as
+    in the synchronous loop. While the locker is being rebuilt after an
+    error, no duty runs.
+
+    Arguments:
+    config_fpath -- path to the configuration file
+    state -- dictionary holding the running (P, W, L, T, D) under 'locker'
+    options -- main loop settings read by femto(); the async engine needs
+        the scheduler
+    """
+    import asyncio
+    backend = state['locker'][0].config.backend
+    S = options['scheduler']
+    stop = asyncio.Event()
+    wake = asyncio.Condition() # notified when a watched pv changes
+    locker_lock = asyncio.Lock()
+    gate = {'running' : 0, 'rebuilding' : False}
+    idle = asyncio.Condition() # notified when a duty finishes or a rebuild ends
+    def in_thread(func, *args):
+        def call():
+            backend.attach_thread()
+            return func(*args)
+        return asyncio.get_running_loop().run_in_executor(None, call)
+    async def notify(cond):
+        async with cond:
+            cond.notify_all()
+    async def watcher():
+        while not stop.is_set():
+            P = state['locker'][0]
+            if await in_thread(P.wait_event, options['max_idle']):
+                await notify(wake)
+    async def rebuild(errors, exc_type):
+        async with idle:
+            gate['rebuilding'] = True
+            await idle.wait_for(lambda: gate['running'] == 0)
+        try:
+            recovered = await in_thread(handle_error, config_fpath, state['locker'], errors, exc_type)
+            if recovered is None:
+                stop.set()
+                return
+            if recovered is not state['locker']:
+                state['locker'] = recovered
+                await in_thread(recovered[0].watch, options['watched'])
+        finally:
+            async with idle:
+                gate['rebuilding'] = False
+                idle.notify_all()
+    async def run(task, now, reason):
+        async with idle:
+            await idle.wait_for(lambda: not gate['rebuilding'])
+            gate['running'] += 1
+        try:
+            await in_thread(task.run, now, reason)
+        finally:
+            async with idle:
+                gate['running'] -= 1
+                idle.notify_all()
+    async def duty(task):
+        errors = 0 # consecutive runs of this duty ending in an error
+        while not stop.is_set():
+            now = time.time()
+            reason = task.due(now)
+            if reason is None:
+                wait = options['max_idle']
+                if task.period > 0:
+                    wait = min(wait, max(task.deadline - now, 0.0))
+                try:
+                    async with wake:
+                        await asyncio.wait_for(wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                if task.name in LOCKER_DUTIES:
+                    async with locker_lock:
+                        await run(task, now, reason)
+                else:
+                    await run(task, now, reason)
+                errors = 0
+            except:   # catch any otherwise uncaught error.
+                errors += 1
+                async with locker_lock:
+                    await rebuild(errors, sys.exc_info()[0])
+            if state['locker'][1].error:
+                stop.set()
+        await notify(wake)
+    tasks = [asyncio.ensure_future(duty(task)) for task in S.tasks]
+    watch = asyncio.ensure_future(watcher())
+    await stop.wait()
+    await asyncio.gather(*tasks)
+    watch.cancel()
+
+def femto_host(config_fpaths, backend=None):
+    """ Run several laser lockers in one process.
+
+    Each locker runs its own control loop in a thread, and all of them build
+    their channels through one backend, so they share a single channel access
+    context and pvs they have in common are opened once.
+
+    Arguments:
+    config_fpaths -- list of configuration file paths, one per locker
+    backend -- optional pv backend; if None, it is chosen by the first configuration
+    """
+    if backend is None:
+        config = Config()
+        config.readConfig(config_fpaths[0])
+        backend = config.getBackend()
+    def run(config_fpath):
+        backend.attach_thread()
+        femto(config_fpath, backend)
+    threads = []
+    for config_fpath in config_fpaths:
+        thread = threading.Thread(target=run, args=(config_fpath,), name=config_fpath)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
 
 if __name__ == "__main__":
     """ Run femto.py via commandline.
@@ -172,9 +653,13 @@ if __name__ == "__main__":
     backwards compatibility, this design is limited.
 
     Arguments: sys.argv[1] -- config file path relative to femto.py directory
+    sys.argv[2:] -- optional further config files; all lockers then run in this
+        process (see femto_host)
     """
     if len(sys.argv) < 2:
         femto()  # null input will prompt
+    elif len(sys.argv) > 2:
+        femto_host(sys.argv[1:])
     else:
         femto(sys.argv[1]) # major change to provide config file as command line input
     
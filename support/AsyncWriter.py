@@ -0,0 +1,117 @@
+""" A background writer for pv puts. Writes are placed on a bounded queue and
+carried out by a dedicated thread, so that a slow or unresponsive IOC does not
+stall the control loop. Writes queued under the same key collapse to the most
+recent value, and flush() provides a barrier for the places where the order of
+writes matters.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+class AsyncWriter(object):
+    """ Bounded, collapsing write queue drained by a single writer thread."""
+
+    def __init__(self, depth=64, on_error=None):
+        """ Start the writer thread.
+
+        Arguments:
+            depth : maximum number of distinct keys waiting to be written
+            on_error : called as on_error(key, args) when a write raises
+        """
+
+        self.depth = depth
+        self.on_error = on_error
+        self.pending = OrderedDict() # key -> (func, args), oldest first
+        self.current = None # (key, args) of the write in progress
+        self.cond = threading.Condition()
+        self.running = True
+        self.dropped = 0 # writes abandoned because the queue stayed full
+        self.collapsed = 0 # writes replaced by a newer value before being sent
+        self.thread = threading.Thread(target=self.run, name='pvs-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, key, func, *args, timeout=1.0):
+        """ Queue func(*args) to be run by the writer thread.
+
+        A write already waiting under the same key is replaced in place. If
+        the queue is full, wait up to timeout seconds for room, then drop the
+        write.
+
+        Arguments:
+            key : identifies the destination, typically the config pv name
+            func : callable performing the (blocking) write
+            args : arguments for func
+            timeout : seconds to wait for room in a full queue
+
+        Returns True if the write was queued.
+        """
+
+        with self.cond:
+            if key in self.pending:
+                self.pending[key] = (func, args)
+                self.collapsed += 1
+                return True
+            deadline = time.time() + timeout
+            while len(self.pending) >= self.depth:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.running:
+                    self.dropped += 1
+                    return False
+                self.cond.wait(remaining)
+            self.pending[key] = (func, args)
+            self.cond.notify_all()
+            return True
+
+    def pending_args(self, key):
+        """ Return the arguments of a queued or in-flight write for key, or None."""
+        with self.cond:
+            if key in self.pending:
+                return self.pending[key][1]
+            if self.current is not None and self.current[0] == key:
+                return self.current[1]
+        return None
+
+    def flush(self, timeout=None):
+        """ Block until every write queued so far has been carried out.
+
+        Arguments:
+            timeout : maximum seconds to wait, None to wait indefinitely
+
+        Returns True if the queue drained in time.
+        """
+
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending and self.current is None, timeout)
+
+    def run(self):
+        """ Writer thread: drain the queue in order until stopped."""
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or not self.running)
+                if not self.pending:
+                    return
+                key, (func, args) = self.pending.popitem(last=False)
+                self.current = (key, args)
+                self.cond.notify_all()
+            try:
+                func(*args)
+            except:
+                if self.on_error is not None:
+                    self.on_error(key, args)
+            with self.cond:
+                self.current = None
+                self.cond.notify_all()
+
+    def stop(self, timeout=None):
+        """ Write out what is queued, then stop the writer thread.
+
+        Arguments:
+            timeout : maximum seconds to wait for the thread to finish
+        """
+
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join(timeout)
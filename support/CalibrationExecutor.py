@@ -0,0 +1,166 @@
+""" Back to back point acquisition for calibration sweeps. The sequential
+sweep moves the phase motor, polls every 0.1 s until it stops, sleeps a
+fixed settle time and then reads the counter. Here the points are still
+taken one after another, since a point's sample must be taken at its own
+phase, but without the fixed waits: each move is issued as soon as the
+previous point's sample is accepted, the motor is polled after the time the
+move is expected to take, and a sample is accepted as soon as it is known to
+be clean.
+
+A sample is known to be clean by its IOC timestamp, compared only with
+timestamps of the counter itself, so that clock differences between hosts
+don't matter. When the move is seen complete, the counter's latest sample
+time is noted; the next sample may still have been averaged over part of
+the move, so the sample taken is the one after that, at least 1.5 counter
+sample intervals later. Only the counter timestamp is polled; the counter
+object reads the sample taken, so its history holds one reading per point.
+How long moves take and how often the counter updates are learned as the
+sweep goes.
+"""
+
+import time
+
+import numpy as np
+
+class SettleModel(object):
+    """ Move duration and counter sample interval, learned from a sweep."""
+
+    def __init__(self, interval=0.2, window=20):
+        """ Arguments:
+            interval : counter sample interval assumed until it has been observed, seconds
+            window : number of recent observations used
+        """
+
+        self.prior_interval = interval
+        self.window = window
+        self.moves = [] # (distance, seconds) of recent moves
+        self.intervals = [] # seconds between recent distinct counter samples
+        self.last_stamp = None
+
+    def observe_move(self, distance, duration):
+        """ Record that a move of distance took duration seconds to complete."""
+        self.moves = (self.moves + [(distance, duration)])[-self.window:]
+
+    def observe_sample(self, stamp):
+        """ Record the timestamp of a counter sample."""
+        if self.last_stamp is not None and stamp > self.last_stamp:
+            self.intervals = (self.intervals + [stamp - self.last_stamp])[-self.window:]
+        if self.last_stamp is None or stamp > self.last_stamp:
+            self.last_stamp = stamp
+
+    def predict(self, distance):
+        """ Return the expected seconds for a move of distance, 0 if unknown.
+
+        A fixed cost plus distance over speed, fitted to the recent moves.
+        """
+
+        if len(self.moves) < 2:
+            return 0.0
+        d, t = np.array(self.moves).T
+        if np.ptp(d) == 0:
+            return 0.8 * np.min(t)
+        slope, fixed = np.polyfit(d, t, 1)
+        return max(0.8 * (fixed + slope * distance), 0.0) # early rather than late, polling covers the rest
+
+    def interval(self):
+        """ Return the counter sample interval, seconds."""
+        if len(self.intervals) < 2:
+            return self.prior_interval
+        return float(np.median(self.intervals))
+
+class CalibrationExecutor(object):
+    """ Takes calibration points with moves issued back to back."""
+
+    def __init__(self, P, M, C, interval=0.2, timeout=10.0, poll=0.02):
+        """ Arguments:
+            P : PVS object
+            M : PhaseMotor of the locker
+            C : time interval counter of the locker
+            interval : prior for the counter sample interval, seconds
+            timeout : seconds past the expected move time before a point is
+                given up as bad
+            poll : seconds between reads while waiting
+        """
+
+        self.P = P
+        self.M = M
+        self.C = C
+        self.model = SettleModel(interval)
+        self.timeout = timeout
+        self.poll = poll
+        self.started = time.time()
+        self.points = [] # (seconds for the move, seconds for the whole point)
+
+    def stopped(self, x, t_issue):
+        """ Return True once the motor has completed its move to x."""
+        if self.P.config.is_atca: # no readback, allow what wait_for_stop would
+            return time.time() >= t_issue + 1.2
+        if not self.P.get('phase_motor_dmov'):
+            return False
+        return abs(self.P.get('phase_motor_rb') * self.M.scale - x) < self.M.tolerance
+
+    def sample_stamp(self):
+        """ Return the IOC timestamp of the counter's latest sample.
+
+        Only the counter pv is read: the counter object's get_time() adds
+        every reading to its history, so polling it would fill the history
+        with repeats of one sample.
+        """
+
+        self.P.get('counter')
+        return self.P.get_timestamp('counter')
+
+    def measure(self, x):
+        """ Move to phase x and return (time, good) from the first clean sample.
+
+        Returns (0, 0) if the move or a clean sample doesn't arrive in time.
+
+        Arguments:
+            x : phase control value
+        """
+
+        t_issue = time.time()
+        distance = abs(x - self.M.position)
+        self.P.put('phase_motor', x / self.M.scale)
+        self.M.position = x
+        expected = self.model.predict(distance)
+        time.sleep(expected)
+        deadline = t_issue + expected + self.timeout
+        stop = None # counter time of the latest sample when the move was seen complete
+        seen = None # counter time of the latest sample polled
+        while time.time() < deadline:
+            if stop is None:
+                if self.stopped(x, t_issue): # read after the check, so any newer sample was published after the move ended
+                    stop = seen = self.sample_stamp()
+                    if stop is not None:
+                        move_time = time.time() - t_issue
+                        self.model.observe_move(distance, move_time)
+                        self.model.observe_sample(stop)
+            else:
+                stamp = self.sample_stamp()
+                if stamp is not None and stamp != seen:
+                    seen = stamp
+                    self.model.observe_sample(stamp)
+                    if stamp >= stop + 1.5 * self.model.interval():
+                        t = self.C.get_time() # only now does the sample go to the counter's history
+                        if t != 0 and self.C.good:
+                            self.points.append((move_time, time.time() - t_issue))
+                            return t, 1
+            time.sleep(self.poll)
+        self.points.append((time.time() - t_issue, time.time() - t_issue))
+        return 0, 0
+
+    def report(self, settle):
+        """ Return a summary of the sweep against the sequential procedure.
+
+        The sequential time is estimated as each point's move, rounded up to
+        the 0.1 s polling of wait_for_stop, plus the fixed settle time.
+
+        Arguments:
+            settle : seconds the sequential sweep sleeps after each move
+        """
+
+        elapsed = time.time() - self.started
+        sequential = sum([np.ceil(move / 0.1) * 0.1 + settle for move, total in self.points])
+        return 'Calibration: %d points in %.1f s, sequential sweep about %.1f s, saved %.1f s'%(
+            len(self.points), elapsed, sequential, sequential - elapsed)
@@ -0,0 +1,192 @@
+""" Estimators for drift correction, which turn timetool samples into the
+drift that set_time subtracts from the phase control. An estimator is fed
+only new samples, with their timestamps, so the time between samples is
+known: a missed sample widens the gap rather than being mistaken for a
+steady one, and a sample no newer than the last one, or older than max_age,
+is counted as stale and ignored.
+
+    exponential : the original smoother, drift += (sample - drift)/smoothing
+    alpha_beta : drift and drift rate with fixed gains
+    kalman : drift and drift rate with a constant velocity Kalman filter
+
+Select one with the "drift_estimator" key of add_config, and set its
+keyword options under "drift_estimator_options".
+"""
+
+import time
+
+import numpy as np
+
+class DriftEstimator(object):
+    """ Common sample bookkeeping and output limit of drift estimators."""
+
+    name = 'base'
+
+    def __init__(self, limit=0.015, max_age=0.0):
+        """ Arguments:
+            limit : largest drift returned, either sign, ns
+            max_age : seconds after which a sample is stale, 0 for no limit
+        """
+
+        self.limit = limit
+        self.max_age = max_age
+        self.initialized = False
+        self.drift = 0.0 # ns
+        self.rate = 0.0 # ns/s
+        self.stamp = None # time of the last sample used
+        self.interval = None # typical seconds between samples
+        self.samples = 0
+        self.stale = 0
+        self.missed = 0
+
+    def reset(self, value, stamp=None):
+        """ Restart the estimate at value, returning it unclamped.
+
+        Arguments:
+            value : drift, ns
+            stamp : timestamp of the sample value came from, None if unknown
+        """
+
+        self.initialized = True
+        self.drift = value
+        self.rate = 0.0
+        self.stamp = stamp
+        return value
+
+    def accept(self, stamp):
+        """ Return the seconds since the last sample, or None if stamp is stale."""
+        now = time.time()
+        if stamp is None:
+            stamp = now
+        if self.stamp is not None and stamp <= self.stamp or (self.max_age and now - stamp > self.max_age):
+            self.stale += 1
+            return None
+        if self.stamp is None: # first sample since a reset without a time
+            self.stamp = stamp - (self.interval or 1.0)
+        dt = stamp - self.stamp
+        if self.interval is None:
+            self.interval = dt
+        elif dt > 1.5 * self.interval:
+            self.missed += int(round(dt / self.interval)) - 1
+        else:
+            self.interval += 0.1 * (dt - self.interval)
+        self.stamp = stamp
+        self.samples += 1
+        return dt
+
+    def clamp(self, value):
+        return max(-self.limit, min(self.limit, value))
+
+    def update(self, value, stamp=None, smoothing=1.0):
+        """ Take a sample and return the drift estimate, ns.
+
+        Arguments:
+            value : timetool drift sample, ns
+            stamp : sample timestamp, seconds; None for the time now
+            smoothing : the drift_correction_smoothing pv
+        """
+
+        if not self.initialized:
+            return self.reset(value, stamp)
+        dt = self.accept(stamp)
+        if dt is not None:
+            self.step(value, dt, smoothing)
+        return self.clamp(self.drift)
+
+    def step(self, value, dt, smoothing):
+        """ Advance the estimate by dt seconds and take in value."""
+        raise NotImplementedError
+
+    def state(self):
+        """ Return the filter state as a dictionary."""
+        return {'estimator' : self.name, 'drift' : self.drift, 'rate' : self.rate, 'samples' : self.samples,
+            'missed' : self.missed, 'stale' : self.stale, 'interval' : self.interval}
+
+    def dump(self):
+        """ Return a one-line summary of the filter state."""
+        return 'drift %s: %.4f ns, rate %.2e ns/s, %d samples, %d missed, %d stale'%(
+            self.name, self.drift, self.rate, self.samples, self.missed, self.stale)
+
+class ExponentialDrift(DriftEstimator):
+    """ The original exponential smoother, with the drift held within limit."""
+
+    name = 'exponential'
+
+    def step(self, value, dt, smoothing):
+        self.drift = self.clamp(self.drift + (value - self.drift) / smoothing) # smoothing
+
+class AlphaBetaDrift(DriftEstimator):
+    """ Fixed gain tracking of drift and drift rate."""
+
+    name = 'alpha_beta'
+
+    def __init__(self, alpha=None, beta=None, **kw):
+        """ Arguments:
+            alpha : drift gain, by default 1/drift_correction_smoothing
+            beta : rate gain, by default alpha^2/(2-alpha)
+        """
+
+        super().__init__(**kw)
+        self.alpha = alpha
+        self.beta = beta
+
+    def step(self, value, dt, smoothing):
+        alpha = self.alpha if self.alpha is not None else 1.0 / smoothing
+        beta = self.beta if self.beta is not None else alpha**2 / (2.0 - alpha)
+        predicted = self.drift + self.rate * dt
+        residual = value - predicted
+        self.drift = predicted + alpha * residual
+        self.rate += beta * residual / dt
+
+class KalmanDrift(DriftEstimator):
+    """ Constant velocity Kalman filter of drift and drift rate."""
+
+    name = 'kalman'
+
+    def __init__(self, noise=0.002, rate_noise=1e-5, **kw):
+        """ Arguments:
+            noise : rms error of a timetool sample, ns
+            rate_noise : random walk of the drift rate, ns/s per root second
+        """
+
+        super().__init__(**kw)
+        self.r = noise**2
+        self.q = rate_noise**2
+        self.cov = np.eye(2)
+
+    def reset(self, value, stamp=None):
+        self.cov = np.diag([self.r, 1e-6])
+        return super().reset(value, stamp)
+
+    def step(self, value, dt, smoothing):
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = self.q * np.array([[dt**3 / 3.0, dt**2 / 2.0], [dt**2 / 2.0, dt]])
+        x = F.dot([self.drift, self.rate])
+        cov = F.dot(self.cov).dot(F.T) + Q
+        gain = cov[:, 0] / (cov[0, 0] + self.r)
+        x = x + gain * (value - x[0])
+        self.cov = cov - np.outer(gain, cov[0, :])
+        self.drift, self.rate = x
+
+    def state(self):
+        state = super().state()
+        state['variance'] = self.cov[0, 0]
+        state['rate_variance'] = self.cov[1, 1]
+        return state
+
+    def dump(self):
+        return super().dump() + ', sigma %.4f ns'%(np.sqrt(self.cov[0, 0]))
+
+ESTIMATORS = {'exponential' : ExponentialDrift, 'alpha_beta' : AlphaBetaDrift, 'kalman' : KalmanDrift}
+
+def create_drift_estimator(name='exponential', options=None):
+    """ Return a drift estimator by name.
+
+    Arguments:
+        name : 'exponential', 'alpha_beta' or 'kalman'
+        options : dictionary of keyword options for the estimator
+    """
+
+    if name not in ESTIMATORS:
+        raise ValueError('unknown drift estimator: %s'%(name))
+    return ESTIMATORS[name](**(options or {}))
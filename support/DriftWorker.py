@@ -0,0 +1,138 @@
+""" A worker thread that applies drift correction as timetool samples arrive,
+rather than once per pass of the main loop. The worker subscribes to
+drift_correction_signal, feeds each new sample to the locker's drift
+estimator, and moves the phase motor toward the correction not yet applied
+in steps of at most max_step, no more often than every interval seconds.
+
+The steps are plain setpoint writes, without waiting for the motor, and are
+only taken while time control is enabled and no other motor operation of the
+locker is under way: the main loop holds the locker's motor_lock while it
+checks for or fixes a jump, sets the time or calibrates, and the worker skips
+a step rather than wait for it. A step costs one write and no reads: the
+gain is the one read with the latest sample, and enable is followed by its
+monitor. set_time folds in only the drift the worker has already
+applied, so it never jumps ahead of the steps or corrects the same drift twice.
+
+Enable with the "drift_worker" key of add_config.
+"""
+
+import threading
+import time
+
+class DriftWorker(object):
+    """ Thread taking drift samples from monitor updates and stepping the phase."""
+
+    def __init__(self, L, max_step=0.0005, interval=0.1, retry=1.0):
+        """ Arguments:
+            L : laser locker, providing drift_sample(), step_drift() and motor_lock
+            max_step : largest phase step, ns
+            interval : minimum seconds between steps
+            retry : seconds before trying again when a step was skipped
+        """
+
+        self.L = L
+        self.P = L.P
+        self.max_step = max_step
+        self.interval = interval
+        self.retry = retry
+        self.cond = threading.Condition()
+        self.pending = None # (value, timestamp) of the newest sample not yet taken
+        self.running = False
+        self.outstanding = False # correction left to apply after the last step
+        self.next_step = 0.0 # earliest time of the next step
+        self.index = None # monitor callback index
+        self.enabled = False # time control enable, kept by its monitor
+        self.enable_index = None
+        self.thread = None
+        self.samples = 0
+        self.superseded = 0 # samples replaced by a newer one before being taken
+        self.steps = 0
+        self.skipped = 0 # steps put off because the motor was in use or time control was off
+
+    def start(self):
+        """ Subscribe to drift_correction_signal and enable, and start the worker thread."""
+        self.running = True
+        self.enable_index = self.P.config.pvlist['enable'].add_callback(
+            self._on_enable, with_ctrlvars=False)
+        self.enabled = bool(self.P.get('enable'))
+        self.index = self.P.config.pvlist['drift_correction_signal'].add_callback(
+            self._on_sample, with_ctrlvars=False)
+        self.thread = threading.Thread(target=self.run, name='drift-worker')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """ Unsubscribe and stop the worker thread.
+
+        Arguments:
+            timeout : maximum seconds to wait for the thread to finish
+        """
+
+        self.P.config.pvlist['drift_correction_signal'].remove_callback(self.index)
+        self.P.config.pvlist['enable'].remove_callback(self.enable_index)
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+    def _on_enable(self, value=None, **kw):
+        """ Monitor callback: follow time control enable without a round trip per step."""
+        if value is not None:
+            self.enabled = bool(value)
+
+    def _on_sample(self, value=None, timestamp=None, **kw):
+        """ Monitor callback: hand the sample to the worker thread."""
+        with self.cond:
+            if self.pending is not None:
+                self.superseded += 1
+            self.pending = (value, timestamp)
+            self.cond.notify_all()
+
+    def run(self):
+        """ Worker thread: take samples and step the phase until stopped."""
+        self.P.config.backend.attach_thread()
+        while True:
+            with self.cond:
+                timeout = max(self.next_step - time.time(), 0.0) if self.outstanding else None
+                self.cond.wait_for(lambda: self.pending is not None or not self.running, timeout)
+                if not self.running:
+                    return
+                sample, self.pending = self.pending, None
+            try:
+                if sample is not None and sample[0] is not None:
+                    self.samples += 1
+                    self.L.drift_sample(*sample)
+                self.step()
+            except Exception as e:
+                self.P.E.write_error({'value':'drift worker: %s'%(e),'lvl':2})
+                self.outstanding = True
+                self.next_step = time.time() + self.retry
+
+    def step(self):
+        """ Take one rate limited step toward the drift correction, if allowed."""
+        now = time.time()
+        if now < self.next_step:
+            self.outstanding = True
+            return
+        if not self.L.motor_lock.acquire(blocking=False):
+            self.skipped += 1
+            self.outstanding = True
+            self.next_step = now + self.interval
+            return
+        try:
+            if not self.enabled: # time control is off, leave the phase alone
+                self.skipped += 1
+                self.outstanding = True
+                self.next_step = now + self.retry
+                return
+            moved, self.outstanding = self.L.step_drift(self.max_step)
+        finally:
+            self.L.motor_lock.release()
+        if moved:
+            self.steps += 1
+            self.next_step = now + self.interval
+
+    def dump(self):
+        """ Return a one-line summary of the worker's activity."""
+        return 'drift worker: %d samples, %d superseded, %d steps, %d skipped'%(
+            self.samples, self.superseded, self.steps, self.skipped)
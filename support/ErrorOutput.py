@@ -14,16 +14,20 @@ class error_output():
     also inherits imported epics support.
     """
 
-    def __init__(self, pv, epicsLogLvl=0,localLogLvl=0):
+    def __init__(self, pv, epicsLogLvl=0,localLogLvl=0,writer=None):
         """ Configure output for error messages.
         
         Arguments: 
             pv : the pv in the control system to write to 
             epicsLogLvl : selector for what severity to report to the epics pv 
             localLogLvl : selector for what severity to report to the commandline
+            writer : optional AsyncWriter; if given, pv writes are queued
+                rather than made in the caller's thread
         """
 
         self.pv = pv  # Local connection to error reporting pv
+        self.writer = writer
+        self.sequence = 0 # number of messages queued on the writer
         self.pv.put(value= 'OK', timeout=1.0)
         self.maxlen = 25 # maxumum error string length
         # The following set how much reporting to do either locally or to epics
@@ -49,5 +53,11 @@ class error_output():
             if error['lvl'] <= self.epicsLogLvl:
                 if n > self.maxlen:
                     error['value'] = error['value'][0:self.maxlen]
-                self.pv.put(value = error['value'], timeout = 1.0)
+                if self.writer is not None:
+                    # each message gets a key of its own, so that messages are
+                    # written in turn rather than replacing each other
+                    self.sequence += 1
+                    self.writer.submit((self.pv.pvname, self.sequence), self.pv.put, error['value'])
+                else:
+                    self.pv.put(value = error['value'], timeout = 1.0)
         
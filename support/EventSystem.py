@@ -1,4 +1,4 @@
-from epics.pv import PV as Pv
+from support.backend.PVBackend import create_backend
 
 class EventSystem(object):
     """ Validator object for the state of the LCLS-II event system.
@@ -14,29 +14,42 @@ class EventSystem(object):
     Justin May
     """
     
-    def __init__(self):
-        pass
+    def __init__(self, backend=None):
+        """ Arguments:
+            backend : pv backend to read through, normally the locker's
+                P.config.backend; a channel access backend if None
+        """
+
+        self.backend = backend if backend is not None else create_backend()
+
+    def read(self, pvname):
+        """ Read a pv through the backend, releasing the channel afterwards."""
+        pv = self.backend.channel(pvname)
+        try:
+            return pv.get()
+        finally:
+            self.backend.release(pv)
 
     def validateBeamMode(self):
         """ Check current Beam Mode."""
-        checkPV = Pv("TPG:SYS0:1:MOD")
-        if checkPV.value == 'SC11':
+        checkPV = self.read("TPG:SYS0:1:MOD")
+        if checkPV == 'SC11':
             return True
         else:
             return False
 
     def validateTriggerMode(self):
         """ Check current trigger mode."""
-        checkPV = Pv("TPG:SYS0:1:PATTERN_TYPE")
-        if checkPV.value == 'Continuous Mode':
+        checkPV = self.read("TPG:SYS0:1:PATTERN_TYPE")
+        if checkPV == 'Continuous Mode':
             return True
         else:
             return False
 
     def validateMPSSumm(self):
         """ Check the summary MPS status. """
-        checkPV = Pv("EVNT:MPSLNKSC:1:STATSUMY")
-        if checkPV.value == 0:
+        checkPV = self.read("EVNT:MPSLNKSC:1:STATSUMY")
+        if checkPV == 0:
             return True
         else:
             return False
@@ -52,12 +65,12 @@ class EventSystem(object):
             "TPG:SYS0:1:DST05:REQRATE"]
         allowed = [1,10,100]
         notallowed = [0]
-        checkVal = checkVal & (Pv(pvStrings[0]).value in allowed)
-        checkVal = checkVal & (Pv(pvStrings[1]).value in allowed)
-        checkVal = checkVal & (Pv(pvStrings[2]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[3]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[4]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[5]).value in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[0]) in allowed)
+        checkVal = checkVal & (self.read(pvStrings[1]) in allowed)
+        checkVal = checkVal & (self.read(pvStrings[2]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[3]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[4]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[5]) in notallowed)
         return checkVal
 
     def validateRates(self):
@@ -71,12 +84,12 @@ class EventSystem(object):
             "TPG:SYS0:1:DST05:RATE"]
         allowed = [1,10,100]
         notallowed = [0]
-        checkVal = checkVal & (Pv(pvStrings[0]).value in allowed)
-        checkVal = checkVal & (Pv(pvStrings[1]).value in allowed)
-        checkVal = checkVal & (Pv(pvStrings[2]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[3]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[4]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[5]).value in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[0]) in allowed)
+        checkVal = checkVal & (self.read(pvStrings[1]) in allowed)
+        checkVal = checkVal & (self.read(pvStrings[2]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[3]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[4]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[5]) in notallowed)
         return checkVal
 
     def validateMPSBCrb(self):
@@ -90,12 +103,12 @@ class EventSystem(object):
             "TPG:SYS0:1:DST05:MPS_BC_RBV"]
         allowed = [1,10,100]
         notallowed = [0]
-        checkVal = checkVal & (Pv(pvStrings[0]).value in allowed)
-        checkVal = checkVal & (Pv(pvStrings[1]).value in allowed)
-        checkVal = checkVal & (Pv(pvStrings[2]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[3]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[4]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[5]).value in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[0]) in allowed)
+        checkVal = checkVal & (self.read(pvStrings[1]) in allowed)
+        checkVal = checkVal & (self.read(pvStrings[2]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[3]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[4]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[5]) in notallowed)
         return checkVal
 
     def validateTPGBCrb(self):
@@ -109,12 +122,12 @@ class EventSystem(object):
             "TPG:SYS0:1:DST05:TPG_BC_RBV"]
         allowed = [1,10,100]
         notallowed = [0]
-        checkVal = checkVal & (Pv(pvStrings[0]).value in allowed)
-        checkVal = checkVal & (Pv(pvStrings[1]).value in allowed)
-        checkVal = checkVal & (Pv(pvStrings[2]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[3]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[4]).value in notallowed)
-        checkVal = checkVal & (Pv(pvStrings[5]).value in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[0]) in allowed)
+        checkVal = checkVal & (self.read(pvStrings[1]) in allowed)
+        checkVal = checkVal & (self.read(pvStrings[2]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[3]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[4]) in notallowed)
+        checkVal = checkVal & (self.read(pvStrings[5]) in notallowed)
         return checkVal
  
     def validate(self):
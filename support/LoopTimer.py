@@ -0,0 +1,91 @@
+""" Timing of the phases of the femto.py main loop. Each phase (watchdog check,
+locker status, jump check and so on) is timed on every run, and the most recent
+runs are kept so that p50/p99/max reflect current behaviour rather than the
+whole life of the process.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy
+
+class LoopTimer(object):
+    """ Rolling run times of named loop phases."""
+
+    def __init__(self, window=1000, interval=60.0):
+        """ Arguments:
+            window : number of recent runs kept per phase
+            interval : minimum seconds between writes of the summary pv
+        """
+
+        self.window = window
+        self.interval = interval
+        self.samples = {} # phase name -> deque of seconds, in order of first use
+        self.lock = threading.Lock() # the async engine times from several threads
+        self.published = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        """ Time the enclosed block as a run of the named phase."""
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - t0)
+
+    def record(self, name, dt):
+        """ Record one run of a phase.
+
+        Arguments:
+            name : phase name
+            dt : seconds the run took
+        """
+
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(dt)
+
+    def percentiles(self, name):
+        """ Return (runs, p50, p99, max) in seconds over the window for a phase."""
+        with self.lock:
+            data = numpy.array(self.samples.get(name, []))
+        if len(data) == 0:
+            return 0, 0.0, 0.0, 0.0
+        p50, p99 = numpy.percentile(data, [50, 99])
+        return len(data), p50, p99, data.max()
+
+    def dump(self):
+        """ Return a table of p50/p99/max run times for every phase."""
+        lines = ['%-12s %6s %9s %9s %9s'%('phase', 'runs', 'p50 ms', 'p99 ms', 'max ms')]
+        for name in list(self.samples.keys()):
+            n, p50, p99, top = self.percentiles(name)
+            lines.append('%-12s %6d %9.2f %9.2f %9.2f'%(name, n, 1e3*p50, 1e3*p99, 1e3*top))
+        return '\n'.join(lines)
+
+    def summary(self):
+        """ Return a one-line summary: p50/p99/max in ms for every phase."""
+        parts = []
+        for name in list(self.samples.keys()):
+            n, p50, p99, top = self.percentiles(name)
+            parts.append('%s %.1f/%.1f/%.1f'%(name, 1e3*p50, 1e3*p99, 1e3*top))
+        return 'ms p50/p99/max: ' + ', '.join(parts)
+
+    def publish(self, P):
+        """ Write the summary to the loop_stats pv, at most once per interval.
+
+        Does nothing unless "loop_stats_pv" is configured.
+
+        Arguments:
+            P : PVS object
+        """
+
+        if 'loop_stats' not in P.config.pvlist:
+            return
+        now = time.time()
+        if now - self.published < self.interval:
+            return
+        self.published = now
+        P.put('loop_stats', self.summary())
@@ -0,0 +1,144 @@
+""" Per-channel access policy for PVS: timeout, retries with backoff, and a
+circuit breaker. A channel whose IOC has gone away would otherwise cost its
+full timeout on every pass of the control loop; once the breaker trips, the
+channel fails immediately until a trial access after the reset interval finds
+it working again.
+
+Policies are set by config name under the "pv_policy" key of add_config, eg.
+
+    "pv_policy" : {
+        "default" : {"timeout" : 10.0},
+        "secondary_calibration" : {"timeout" : 1.0, "trip_after" : 3}
+    }
+
+Names without an entry use the "default" entry, which itself defaults to the
+original behaviour: a 10 s timeout, no retries and no breaker.
+"""
+
+import threading
+import time
+
+class ChannelPolicy(object):
+    """ Access policy and circuit breaker state for one channel."""
+
+    def __init__(self, timeout=10.0, retries=0, backoff=0.1, trip_after=0, reset_after=30.0):
+        """ Set the policy.
+
+        Arguments:
+            timeout : seconds to wait for each get or put
+            retries : extra attempts made after a failed get
+            backoff : seconds before the first retry, doubling for each one after
+            trip_after : consecutive failures that open the breaker, 0 for never
+            reset_after : seconds an open breaker waits before allowing a trial access
+        """
+
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.trip_after = trip_after
+        self.reset_after = reset_after
+        self.state = 'closed' # 'closed', 'open' or 'half-open'
+        self.failures = 0 # consecutive failed accesses
+        self.opened = 0.0 # time the breaker last opened
+        self.trial = 0.0 # time the trial access of a half-open breaker was let through
+        self.trips = 0 # number of times the breaker has opened
+
+    def allow(self, now):
+        """ Return True if an access may be attempted at time now.
+
+        A half-open breaker lets a single trial through, and refuses other
+        accesses until the trial succeeds or fails; a trial that never
+        reports back is replaced after another reset interval.
+        """
+
+        if self.state == 'open' and now - self.opened >= self.reset_after:
+            self.state = 'half-open'
+            self.trial = now
+            return True
+        if self.state == 'half-open' and now - self.trial >= self.reset_after:
+            self.trial = now # the last trial was lost, allow another
+            return True
+        return self.state == 'closed'
+
+    def success(self):
+        """ Record a successful access, return True if this closed the breaker."""
+        self.failures = 0
+        reopened = self.state != 'closed'
+        self.state = 'closed'
+        return reopened
+
+    def failure(self, now):
+        """ Record a failed access, return True if this opened the breaker."""
+        self.failures += 1
+        if not self.trip_after:
+            return False
+        if self.state == 'half-open':
+            self.state = 'open' # trial failed, wait another interval
+            self.opened = now
+            return False
+        if self.state == 'closed' and self.failures >= self.trip_after:
+            self.state = 'open'
+            self.opened = now
+            self.trips += 1
+            return True
+        return False
+
+class PVPolicies(object):
+    """ ChannelPolicy objects keyed by config name, built from the configuration."""
+
+    def __init__(self, config=None):
+        """ Parse the "pv_policy" configuration.
+
+        Arguments:
+            config : dictionary of config name -> policy settings, with an
+                optional "default" entry applied to every other name
+        """
+
+        config = dict(config or {})
+        self.default = config.pop("default", {})
+        self.overrides = config
+        self.policies = {}
+        self.lock = threading.Lock() # puts may be recorded from the writer thread
+
+    def get(self, name):
+        """ Return the ChannelPolicy for a config name, creating it on first use."""
+        with self.lock:
+            if name not in self.policies:
+                settings = dict(self.default)
+                settings.update(self.overrides.get(name, {}))
+                self.policies[name] = ChannelPolicy(**settings)
+            return self.policies[name]
+
+    def allow(self, name):
+        """ Return True if an access to name may be attempted now."""
+        policy = self.get(name)
+        with self.lock:
+            return policy.allow(time.time())
+
+    def success(self, name):
+        """ Record a successful access, return True if it closed the breaker."""
+        policy = self.get(name)
+        with self.lock:
+            return policy.success()
+
+    def failure(self, name):
+        """ Record a failed access, return True if it opened the breaker."""
+        policy = self.get(name)
+        with self.lock:
+            return policy.failure(time.time())
+
+    def open_names(self):
+        """ Return the config names whose breaker is not closed."""
+        with self.lock:
+            return sorted([k for k, p in self.policies.items() if p.state != 'closed'])
+
+    def dump(self):
+        """ Return a table of the channels whose breaker has ever opened."""
+        with self.lock:
+            items = sorted([(k, p) for k, p in self.policies.items() if p.trips])
+            lines = ['%-28s %-9s %6s %8s %8s'%('pv', 'breaker', 'trips', 'fails', 'open s')]
+            now = time.time()
+            for name, p in items:
+                open_for = now - p.opened if p.state != 'closed' else 0.0
+                lines.append('%-28s %-9s %6d %8d %8.1f'%(name, p.state, p.trips, p.failures, open_for))
+        return '\n'.join(lines)
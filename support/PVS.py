@@ -15,10 +15,19 @@ try:
     # print('using epics.pv')
 except ModuleNotFoundError:
     print('no epics pv support located within environment')
+import threading
+import time
+
 from numpy import log
 
 from support.femtoconfig import Config
 from support.ErrorOutput import error_output
+from support.AsyncWriter import AsyncWriter
+from support.PVStats import PVStats
+from support.PVPolicy import PVPolicies
+
+# pvs the HLA can't run without; if one of these doesn't connect, OK is 0
+REQUIRED_PVS = ['watchdog', 'time', 'enable', 'phase_motor', 'laser_trigger', 'counter']
 
 class PVS():   # creates pvs
     """ Base PV class.
@@ -27,7 +36,7 @@ class PVS():   # creates pvs
     It has been propagated forward to use the external configuration object.
     """
 
-    def __init__(self, configfpath='femto_config.json', epicsdebug=False,localdebug=False):
+    def __init__(self, configfpath='femto_config.json', epicsdebug=False,localdebug=False,use_monitors=None,backend=None):
         """ Initiate connections to PVs based on config.
         
         This function calls the various functions in femtoconfig.py to expand a
@@ -37,6 +46,10 @@ class PVS():   # creates pvs
             configfpath : path to a configuration file, provided at launch of femto.py
             epicsdebug : boolean value for whether to write errors to epics  
             localdebug : boolean value for whether to print errors to local
+            use_monitors : serve get() from a monitor-updated cache; if None, the
+                "use_pv_monitors" key in add_config decides (default off)
+            backend : pv backend to build channels with (see
+                backend/PVBackend.py); if None, chosen by the configuration
         """
 
         self.localLogLvl = 0
@@ -45,13 +58,54 @@ class PVS():   # creates pvs
         self.epicsLogLvl = 0
         if epicsdebug:
             self.epicsLogLvl = 1
-        self.config = Config()
+        self.startup_times = [] # (step, seconds) in order of execution
+        t_step = time.time()
+        self.config = Config(backend)
         self.config.readConfig(configfpath)
-        self.config.expandPVs()
+        self.config.expandPVs() # creates all channels, connections start here
+        t_step = self.mark_startup('config and channel creation', t_step)
         timeout = self.config.timeout
+        add_config = self.config.config.get("add_config", {})
+        if use_monitors is None:
+            use_monitors = add_config.get("use_pv_monitors", False)
+        self.use_monitors = use_monitors
+        # Staleness bound (seconds) on cached values; either a single number or
+        # a dictionary of config name -> seconds with an optional "default" entry
+        max_age = add_config.get("pv_max_age", 5.0)
+        if isinstance(max_age, dict):
+            self.max_age = dict(max_age)
+            self.default_max_age = self.max_age.pop("default", 5.0)
+        else:
+            self.max_age = {}
+            self.default_max_age = max_age
+        self.cache = {} # config name -> (value, time of last update)
+        self.monitor_index = {} # config name -> index of our monitor callback
+        self.watch_index = {} # config name -> index of our wake-up callback
+        self.event = threading.Event() # set when a watched pv changes
+        self.changes = {} # config name -> number of updates seen for a watched pv
+        self.closed = False
+        # Write coalescing: skip puts that repeat the last confirmed value of
+        # an HLA-owned status pv, refreshing at least every put_refresh_interval
+        coalesce = add_config.get("coalesce_puts", False)
+        if coalesce is True:
+            coalesce = ['busy', 'ok', 'bucket_error', 'unfixed_error']
+        self.coalesce_names = set(coalesce or [])
+        self.put_refresh_interval = add_config.get("put_refresh_interval", 5.0)
+        self.last_put = {} # config name -> (value, time of last confirmed write)
+        self.stats = PVStats() # per-channel latency histograms and failure counts
+        self.stats_interval = add_config.get("pv_stats_interval", 60.0)
+        self.stats_published = 0.0
+        # Per-channel timeout, retry and circuit breaker settings (see PVPolicy.py)
+        self.policies = PVPolicies(add_config.get("pv_policy"))
+        # Asynchronous writes: puts go on a bounded queue drained by a writer
+        # thread, so that a slow IOC can't stall the control loop
+        self.writer = None
+        if add_config.get("async_puts", False):
+            self.writer = AsyncWriter(add_config.get("async_put_depth", 64), on_error=self._on_write_error)
         self.error_pv = self.config.error_pv
         self.error_pv.connect(timeout)
-        self.E = error_output(self.error_pv,self.epicsLogLvl,self.localLogLvl)
+        self.E = error_output(self.error_pv,self.epicsLogLvl,self.localLogLvl,writer=self.writer)
+        t_step = self.mark_startup('error pv', t_step)
         self.E.write_error({'value':'Watchdog 141126a','lvl':2})
         self.version = self.config.version
         self.name = self.config.name
@@ -75,36 +129,323 @@ class PVS():   # creates pvs
         #     pv.disconnect() # done with precision field
         #     self.pvlist[k]=Pv(pvname) # add pv  to list - this is where matlab woudl overwrite ioc pvs. 
         self.OK = 1   
-        for k, v in iter(self.config.pvlist.items()):  # now loop over all pvs to initialize
-            try:
-                v.connect(timeout) # connect to pv
-                v.get(with_ctrlvars=False, timeout=1.0) # get data
-            except: # for now just fake it
-                self.E.write_error({'value':'could not open '+v.__str__(),'lvl':2})
-                self.E.write_error({'value':k,'lvl':2})
-                self.OK = 0 # some error with setting up PVs, can't run, will exit  
+        self.failed_pvs = self.connect_all(timeout) # wait on all channels together
+        for k in self.failed_pvs:
+            self.E.write_error({'value':'could not connect '+self.config.pvlist[k].pvname,'lvl':2})
+            self.E.write_error({'value':k,'lvl':2})
+            if k in REQUIRED_PVS:
+                self.OK = 0 # can't run without it, will exit
+        t_step = self.mark_startup('bulk connect', t_step)
+        if add_config.get("fast_start", False):
+            # one batched round trip instead of one per pv
+            names = [k for k in self.config.pvlist.keys() if k not in self.failed_pvs]
+            values = self.config.backend.get_many([self.config.pvlist[k] for k in names], timeout)
+            for k, value in zip(names, values):
+                if value is None:
+                    self.E.write_error({'value':'could not open '+self.config.pvlist[k].__str__(),'lvl':2})
+                    self.E.write_error({'value':k,'lvl':2})
+                    if k in REQUIRED_PVS:
+                        self.OK = 0
+        else:
+            for k, v in iter(self.config.pvlist.items()):  # now loop over all pvs to initialize
+                if k in self.failed_pvs:
+                    continue # already reported, don't wait on it a second time
+                try:
+                    v.get(with_ctrlvars=False, timeout=1.0) # get data
+                except: # for now just fake it
+                    self.E.write_error({'value':'could not open '+v.__str__(),'lvl':2})
+                    self.E.write_error({'value':k,'lvl':2})
+                    self.OK = 0 # some error with setting up PVs, can't run, will exit  
+        t_step = self.mark_startup('initial reads', t_step)
         self.E.write_error({'value':'finished initial pv creation and connection','lvl':2})
+        if self.use_monitors:
+            self.start_monitors()
         self.version_pv = self.config.version_pv
         self.version_pv.connect(timeout)
         self.version_pv.put(self.version, timeout = 10.0)
+        t_step = self.mark_startup('monitors and version pv', t_step)
+        self.E.write_error({'value':self.startup_report(),'lvl':2})
+
+    def connect_all(self, timeout):
+        """ Wait for every configured pv to connect, sharing one timeout.
+
+        Channels are created (and their searches started) in
+        Config.expandPVs, so they all connect concurrently; this only waits
+        for them against a common deadline, rather than paying the timeout
+        once per unreachable pv.
+
+        Arguments:
+            timeout : total seconds to wait for the whole set
+
+        Returns a list of config names that did not connect.
+        """
+
+        deadline = time.time() + timeout
+        failed = []
+        for k, v in iter(self.config.pvlist.items()):
+            if not v.wait_for_connection(timeout=max(deadline - time.time(), 0.0)):
+                failed.append(k)
+        return failed
+
+    def reconnect(self, timeout=None):
+        """ Wait for dropped channels to come back, leaving connected ones alone.
+
+        Channel access re-establishes a dropped channel by itself once its
+        IOC is reachable, and the channel objects (with their monitor
+        callbacks) survive the outage, so recovery only needs to wait on the
+        channels that are currently down, against one shared deadline.
+
+        Arguments:
+            timeout : seconds to wait; the configuration timeout if None
+
+        Returns a list of config names that are still disconnected.
+        """
+
+        if timeout is None:
+            timeout = self.config.timeout
+        deadline = time.time() + timeout
+        failed = []
+        for k, v in iter(self.config.pvlist.items()):
+            if v.connected:
+                continue
+            if not v.wait_for_connection(timeout=max(deadline - time.time(), 0.0)):
+                failed.append(k)
+        for k in failed:
+            self.E.write_error({'value':'pv still disconnected','lvl':2})
+            self.E.write_error({'value':k,'lvl':2})
+        return failed
+
+    def mark_startup(self, step, t_start):
+        """ Record the duration of a startup step and return the current time.
+
+        Arguments:
+            step : description of the step
+            t_start : time.time() at the beginning of the step
+        """
+
+        now = time.time()
+        self.startup_times.append((step, now - t_start))
+        return now
+
+    def startup_report(self):
+        """ Return a printable breakdown of the time spent starting up."""
+        total = sum([dt for step, dt in self.startup_times])
+        lines = ['PVS startup: %.3f s, %d pvs, %d failed'%(total, len(self.config.pvlist), len(self.failed_pvs))]
+        for step, dt in self.startup_times:
+            lines.append('  %-26s %8.3f s'%(step, dt))
+        return '\n'.join(lines)
        
+    def start_monitors(self):
+        """ Subscribe the value cache to monitor updates for every pv.
+
+        Seeds the cache with the value fetched during connection, then
+        registers a callback on each pv so that later updates from the IOC
+        refresh the cache without a channel access round trip.
+        """
+
+        now = time.time()
+        for k, v in iter(self.config.pvlist.items()):
+            if v.connected and v.value is not None:
+                self.cache[k] = (v.value, now)
+            self.monitor_index[k] = v.add_callback(self._on_monitor, with_ctrlvars=False, name=k)
+
+    def watch(self, names):
+        """ Wake wait_event() whenever one of the named pvs changes.
+
+        Names that are not configured, or already watched, are skipped.
+
+        Arguments:
+            names : list of names of pvs created in femtoconfig
+        """
+
+        for k in names:
+            if k in self.watch_index or k not in self.config.pvlist:
+                continue
+            self.changes[k] = 0
+            self.watch_index[k] = self.config.pvlist[k].add_callback(self._on_watch, with_ctrlvars=False, name=k)
+
+    def _on_watch(self, name=None, **kw):
+        """ Monitor callback for watched pvs."""
+        self.changes[name] = self.changes.get(name, 0) + 1
+        self.event.set()
+
+    def wait_event(self, timeout):
+        """ Block until a watched pv changes or timeout seconds pass.
+
+        Changes arriving while the caller was busy are not lost: the next
+        call returns immediately.
+
+        Arguments:
+            timeout : maximum seconds to wait
+
+        Returns True if woken by a change.
+        """
+
+        woken = self.event.wait(timeout)
+        self.event.clear()
+        return woken
+
+    def _on_monitor(self, name=None, value=None, **kw):
+        """ Monitor callback, stores the new value for a config name."""
+        self.cache[name] = (value, time.time())
+
+    def max_age_for(self, name):
+        """ Return the staleness bound in seconds for a config name."""
+        return self.max_age.get(name, self.default_max_age)
+
+    def get_cached(self, name):
+        """ Return (value, time) from the monitor cache if it is usable.
+
+        Returns None when monitors are off, or the entry is missing, stale or
+        its pv is disconnected.
+
+        Arguments:
+            name : name of the pv created in femtoconfig
+        """
+
+        if not self.use_monitors:
+            return None
+        entry = self.cache.get(name)
+        if entry is None or (time.time() - entry[1]) > self.max_age_for(name):
+            return None
+        if not self.config.pvlist[name].connected:
+            return None
+        return entry
+
+    def get_pending(self, name):
+        """ Return (value,) for a write to name that has not completed yet.
+
+        With asynchronous writes, reads of a pv with a queued write return
+        the value being written, so the caller sees its own writes.
+
+        Arguments:
+            name : name of the pv created in femtoconfig
+        """
+
+        if self.writer is None:
+            return None
+        args = self.writer.pending_args(name)
+        if args is None:
+            return None
+        return (args[1],)
+
     def get(self, name):
         """ Epics get the requested pv by config name.
         
         This fetches a value from the supplied PV and returns it or an error.
+        When monitors are in use, a cached value no older than the staleness
+        bound for the name is returned without a channel access call; stale
+        or missing entries fall back to an explicit get.
         
         Arguments:
             name : name of the pv created in femtoconfig
         """
 
-        try:
-            self.config.pvlist[name].get(with_ctrlvars=False, timeout=10.0)
-            return self.config.pvlist[name].value                      
-        except:
+        pending = self.get_pending(name)
+        if pending is not None:
+            return pending[0]
+        entry = self.get_cached(name)
+        if entry is not None:
+            return entry[0]
+        pv = self.config.pvlist[name]
+        if not self.policies.allow(name): # circuit open, fail fast
+            self.stats.record(name, 'get', 0.0, 'rejected')
+            return self.last_or_zero(name)
+        policy = self.policies.get(name)
+        for attempt in range(policy.retries + 1):
+            if attempt:
+                time.sleep(policy.backoff * 2**(attempt - 1))
+            t0 = time.time()
+            try:
+                # in monitor mode the fallback must go to the IOC, not the
+                # pyepics copy of the last monitor
+                fetched = pv.get(with_ctrlvars=False, timeout=policy.timeout, use_monitor=not self.use_monitors)
+                value = pv.value
+            except Exception as e:
+                self.stats.record(name, 'get', time.time() - t0, 'error', repr(e))
+                status = 'error'
+                continue
+            if fetched is None: # timed out or disconnected, value is the last one seen
+                self.stats.record(name, 'get', time.time() - t0, 'timeout')
+                status = 'timeout'
+                continue
+            self.stats.record(name, 'get', time.time() - t0)
+            self.channel_ok(name)
+            if self.use_monitors:
+                self.cache[name] = (value, time.time())
+            return value
+        self.channel_failed(name)
+        if status == 'error':
             self.E.write_error({'value':'PV READ ERROR','lvl':2})
             self.E.write_error({'value':name,'lvl':2})
             return 0
+        self.E.write_error({'value':'PV READ TIMEOUT','lvl':2})
+        self.E.write_error({'value':name,'lvl':2})
+        return self.last_or_zero(name)
                          
+    def get_many(self, names, timeout=None):
+        """ Epics get a batch of pvs by config name in a single round trip.
+
+        The batch is handed to the pv backend, which issues all requests
+        before waiting on any reply, so it costs one round trip instead of
+        one per pv. Names served from the monitor cache are not requested at
+        all, and names whose circuit breaker is open return their last value
+        without being requested. Timeouts are reported per name, and, as in
+        get(), a timed out read returns the last value seen. Batched reads
+        are not retried.
+
+        Arguments:
+            names : list of names of pvs created in femtoconfig
+            timeout : seconds to wait for the whole batch; if None, the
+                longest policy timeout of the pvs requested
+
+        Returns a list of values in the order of names.
+        """
+
+        values = {}
+        timed_out = set()
+        pending = []
+        for name in names:
+            entry = self.get_pending(name) or self.get_cached(name)
+            if entry is not None:
+                values[name] = entry[0]
+                continue
+            if not self.policies.allow(name): # circuit open, fail fast
+                self.stats.record(name, 'get', 0.0, 'rejected')
+                values[name] = self.last_or_zero(name)
+                continue
+            pending.append(name)
+        if pending:
+            if timeout is None:
+                timeout = max([self.policies.get(name).timeout for name in pending])
+            t0 = time.time()
+            fetched = self.config.backend.get_many([self.config.pvlist[name] for name in pending], timeout)
+            dt = time.time() - t0 # each pv is charged the batch round trip
+            for name, value in zip(pending, fetched):
+                values[name] = value
+                if value is None:
+                    self.stats.record(name, 'get', dt, 'timeout')
+                    self.channel_failed(name)
+                    timed_out.add(name)
+                    continue
+                self.stats.record(name, 'get', dt)
+                self.channel_ok(name)
+                if self.use_monitors:
+                    self.cache[name] = (value, time.time())
+        out = []
+        for name in names:
+            if name in timed_out:
+                self.E.write_error({'value':'PV READ TIMEOUT','lvl':2})
+                self.E.write_error({'value':name,'lvl':2})
+                out.append(self.last_or_zero(name)) # as get()
+            elif values[name] is None:
+                self.E.write_error({'value':'PV READ ERROR','lvl':2})
+                self.E.write_error({'value':name,'lvl':2})
+                out.append(0)
+            else:
+                out.append(values[name])
+        return out
+
     def get_last(self, name):
         """ Return the most recent fetched value for a PV name
 
@@ -115,36 +456,280 @@ class PVS():   # creates pvs
             name : name of the pv created in femtoconfig
         """
 
-        return self.config.pvlist[name].value                
-                
-    def put(self, name, x):
+        return self.config.pvlist[name].value
+
+    def last_or_zero(self, name):
+        """ Return the last value seen for a failed or rejected read, 0 if the
+        pv was never read, so callers always get something they can compute with.
+
+        Arguments:
+            name : name of the pv created in femtoconfig
+        """
+
+        value = self.config.pvlist[name].value
+        return 0 if value is None else value
+
+    def get_timestamp(self, name):
+        """ Return the IOC timestamp of the most recent value for a PV name
+
+        The timestamp belongs to the value last fetched or received by
+        monitor, so it follows a get() of the same name.
+
+        Arguments:
+            name : name of the pv created in femtoconfig
+        """
+
+        return self.config.pvlist[name].timestamp
+
+    def is_redundant_put(self, name, x):
+        """ Return True if writing x to name can be skipped.
+
+        A write is redundant when the name is coalesced, the last confirmed
+        write had the same value, it is younger than the refresh interval, and
+        (with monitors on) the IOC has not since reported a different value.
+        While a write to the name is queued or in flight, it is that write,
+        not the last confirmed one, that decides what the IOC ends up with.
+
+        Arguments:
+            name : name of the pv created in femtoconfig
+            x : value that would be written
+        """
+
+        if name not in self.coalesce_names:
+            return False
+        if self.writer is not None:
+            pending = self.writer.pending_args(name)
+            if pending is not None:
+                try:
+                    return bool(pending[1] == x) # (name, value) of write_confirmed
+                except:
+                    return False
+        last = self.last_put.get(name)
+        if last is None or (time.time() - last[1]) > self.put_refresh_interval:
+            return False
+        try:
+            if not last[0] == x:
+                return False
+            entry = self.get_cached(name)
+            if entry is not None and not entry[0] == x: # changed behind our back
+                return False
+        except: # values that can't be compared are always written
+            return False
+        return True
+
+    def put(self, name, x, force=False):
         """ Write a value to a pv by femtoconfig name
         
         This function will issue a channel access call to write a value to a pv
-        based on the name as defined in femtoconfig.
+        based on the name as defined in femtoconfig. Writes to coalesced names
+        that repeat the last confirmed value are skipped unless forced.
         
         Arguments:
             name : name of the pv created in femtoconfig
             x : value to write to pv in string format
+            force : write even if the value is unchanged
         """
 
+        if not force and self.is_redundant_put(name, x):
+            return
+        if self.writer is not None:
+            self.queue_put(name, x)
+            return
+        if not self.policies.allow(name): # circuit open, fail fast
+            self.stats.record(name, 'put', 0.0, 'rejected')
+            return
+        t0 = time.time()
         try:
-            self.config.pvlist[name].put(x, timeout = 10.0) # long timeout           
-        except:
+            self.config.pvlist[name].put(x, timeout = self.policies.get(name).timeout)
+            self.put_done(name, x)
+            self.stats.record(name, 'put', time.time() - t0)
+            self.channel_ok(name)
+        except Exception as e:
+            self.stats.record(name, 'put', time.time() - t0, 'error', repr(e))
+            self.channel_failed(name)
+            self.last_put.pop(name, None)
             self.E.write_error({'value':'UNABLE TO WRITE PV','lvl':2})
             self.E.write_error({'value':name,'lvl':2})
             self.E.write_error({'value':str(x),'lvl':2})
                 
+    def put_many(self, values, force=False):
+        """ Write a batch of values to pvs by femtoconfig name.
+
+        The writes are issued back to back without waiting on completion, so
+        a batch is not held up by any single pv. Write errors are reported
+        per name and redundant writes are skipped as in put().
+
+        Arguments:
+            values : dictionary of config name -> value to write
+            force : write even if values are unchanged
+        """
+
+        for name, x in iter(values.items()):
+            if not force and self.is_redundant_put(name, x):
+                continue
+            if self.writer is not None:
+                self.queue_put(name, x)
+                continue
+            if not self.policies.allow(name): # circuit open, fail fast
+                self.stats.record(name, 'put', 0.0, 'rejected')
+                continue
+            t0 = time.time()
+            try:
+                self.config.pvlist[name].put(x, wait=False)
+                self.put_done(name, x)
+                self.stats.record(name, 'put', time.time() - t0)
+                self.channel_ok(name)
+            except Exception as e:
+                self.stats.record(name, 'put', time.time() - t0, 'error', repr(e))
+                self.channel_failed(name)
+                self.last_put.pop(name, None)
+                self.E.write_error({'value':'UNABLE TO WRITE PV','lvl':2})
+                self.E.write_error({'value':name,'lvl':2})
+                self.E.write_error({'value':str(x),'lvl':2})
+
+    def queue_put(self, name, x):
+        """ Hand a write to the writer thread, reporting if it is dropped."""
+        if not self.writer.submit(name, self.write_confirmed, name, x):
+            self.E.write_error({'value':'PV WRITE QUEUE FULL','lvl':2})
+            self.E.write_error({'value':name,'lvl':2})
+
+    def write_confirmed(self, name, x):
+        """ Blocking write used by the writer thread.
+
+        Waits for the IOC to complete the put, so that flush() is a true
+        barrier, and raises if it does not. Writes to a pv whose circuit
+        breaker is open are dropped.
+
+        Arguments:
+            name : name of the pv created in femtoconfig
+            x : value to write
+        """
+
+        if not self.policies.allow(name):
+            self.stats.record(name, 'put', 0.0, 'rejected')
+            return
+        t0 = time.time()
+        try:
+            ret = self.config.pvlist[name].put(x, wait=True, timeout=self.policies.get(name).timeout)
+        except Exception as e:
+            self.stats.record(name, 'put', time.time() - t0, 'error', repr(e))
+            self.channel_failed(name)
+            raise
+        if ret is None or ret < 0:
+            self.stats.record(name, 'put', time.time() - t0, 'timeout')
+            self.channel_failed(name)
+            raise IOError('put to %s not completed'%(name))
+        self.stats.record(name, 'put', time.time() - t0)
+        self.channel_ok(name)
+        self.put_done(name, x)
+
+    def put_done(self, name, x):
+        """ Record a successful write of x to name.
+
+        Keeps the value for coalescing and, with monitors on, writes it into
+        the cache, so that a get() straight after the put does not return the
+        old value until the monitor event arrives.
+        """
+
+        now = time.time()
+        self.last_put[name] = (x, now)
+        if self.use_monitors:
+            self.cache[name] = (x, now)
+
+    def channel_ok(self, name):
+        """ Record a successful access for the circuit breaker of name."""
+        if self.policies.success(name):
+            self.E.write_error({'value':'PV CIRCUIT CLOSED','lvl':2})
+            self.E.write_error({'value':name,'lvl':2})
+
+    def channel_failed(self, name):
+        """ Record a failed access for the circuit breaker of name."""
+        if self.policies.failure(name):
+            self.E.write_error({'value':'PV CIRCUIT OPEN','lvl':2})
+            self.E.write_error({'value':name,'lvl':2})
+
+    def _on_write_error(self, key, args):
+        """ Writer thread error callback, reports like a failed put."""
+        if key not in self.config.pvlist:
+            print('UNABLE TO WRITE PV %s'%(key)) # the error pv itself, don't recurse
+            return
+        self.last_put.pop(key, None)
+        self.E.write_error({'value':'UNABLE TO WRITE PV','lvl':2})
+        self.E.write_error({'value':key,'lvl':2})
+        self.E.write_error({'value':str(args[1]),'lvl':2})
+
+    def flush(self, timeout=None):
+        """ Wait for all queued writes to complete.
+
+        A no-op with synchronous writes. Use between writes whose order on
+        the IOC matters.
+
+        Arguments:
+            timeout : maximum seconds to wait, None to wait indefinitely
+        """
+
+        if self.writer is not None:
+            self.writer.flush(timeout)
+
+    def dump_stats(self):
+        """ Return a table of access latency and failure counts for every pv,
+        followed by the circuit breaker state of channels that have tripped."""
+        return self.stats.dump() + '\n\n' + self.policies.dump()
+
+    def publish_stats(self):
+        """ Write the statistics summary to the pv_stats pv, at most once per interval.
+
+        Does nothing unless "pv_stats_pv" is configured. Called from the
+        main loop; the interval is set with "pv_stats_interval".
+        """
+
+        if 'pv_stats' not in self.config.pvlist:
+            return
+        now = time.time()
+        if now - self.stats_published < self.stats_interval:
+            return
+        self.stats_published = now
+        summary = self.stats.summary()
+        tripped = self.policies.open_names()
+        if tripped:
+            summary += '; open %s'%(', '.join(tripped))
+        self.put('pv_stats', summary)
+
+    def close(self):
+        """ Clear connections to pvs
+
+        Channels are shared through the backend with any other locker in
+        the process, so our monitor callbacks are removed and each channel
+        is released, which disconnects it only once no one else uses it.
+        Safe to call more than once.
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+        self.E.write_error({'value':'closing all PV connections','lvl':2})
+        if self.writer is not None:
+            self.writer.stop(10.0) # write out anything still queued
+        backend = self.config.backend
+        for k, index in iter(self.monitor_index.items()):
+            self.config.pvlist[k].remove_callback(index)
+        for k, index in iter(self.watch_index.items()):
+            self.config.pvlist[k].remove_callback(index)
+        for v in iter(self.config.pvlist.values()):
+            backend.release(v)
+        backend.release(self.version_pv)
+        backend.release(self.error_pv)
+
     def __del__ (self):
         """ Clear connections to pvs
         
         This function is reimplemented from the original HLA, but is not used as
         much now, in part because it never really worked that well before, so
         the original version of femto.py had written much of this out. It works
-        now, using the mechanism built into our standard epics support.
+        now, using the mechanism built into our standard epics support. With
+        monitors on, the callbacks keep the object alive, so call close()
+        explicitly.
         """
 
-        for v in iter(self.config.pvlist.values()):
-            v.disconnect()  
-        self.error_pv.disconnect()    
-        self.E.write_error({'value':'closed all PV connections','lvl':2})
+        if hasattr(self, 'version_pv'): # fully constructed
+            self.close()
@@ -0,0 +1,115 @@
+""" Per-channel access statistics for PVS. Every get and put made through PVS
+is timed and counted by config name, so that slow IOCs and hot channels can be
+found from the HLA itself. Latencies are kept as fixed-bin histograms, which
+keeps the cost of recording constant no matter how long the HLA runs.
+"""
+
+import bisect
+import threading
+
+# Upper bin edges of the latency histogram, in seconds; the last bin is open
+LATENCY_EDGES = [1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1.0, 3.0, 10.0]
+
+class ChannelStats(object):
+    """ Latency histogram and failure counts for one channel and operation."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_EDGES) + 1)
+        self.n = 0 # number of operations
+        self.total = 0.0 # total seconds spent
+        self.max = 0.0
+        self.timeouts = 0
+        self.errors = 0
+        self.rejected = 0 # accesses refused by an open circuit breaker
+        self.last_error = ''
+
+    def record(self, dt, status='ok', error=''):
+        """ Record one operation.
+
+        Arguments:
+            dt : seconds the operation took
+            status : 'ok', 'timeout', 'error' or 'rejected'
+            error : description of the error, if any
+        """
+
+        if status == 'rejected': # never reached the IOC, keep it out of the latencies
+            self.rejected += 1
+            return
+        self.counts[bisect.bisect_left(LATENCY_EDGES, dt)] += 1
+        self.n += 1
+        self.total += dt
+        self.max = max(self.max, dt)
+        if status == 'timeout':
+            self.timeouts += 1
+        elif status == 'error':
+            self.errors += 1
+            self.last_error = error
+
+    def percentile(self, q):
+        """ Return the upper bin edge below which a fraction q of operations fell.
+
+        Arguments:
+            q : fraction between 0 and 1
+        """
+
+        if self.n == 0:
+            return 0.0
+        target = q * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                if i < len(LATENCY_EDGES):
+                    return min(LATENCY_EDGES[i], self.max)
+                return self.max
+        return self.max
+
+class PVStats(object):
+    """ Collection of ChannelStats keyed by (config name, operation)."""
+
+    def __init__(self):
+        self.channels = {}
+        self.lock = threading.Lock() # puts may be recorded from the writer thread
+
+    def record(self, name, op, dt, status='ok', error=''):
+        """ Record one operation on a channel.
+
+        Arguments:
+            name : config name of the pv
+            op : 'get' or 'put'
+            dt : seconds the operation took
+            status : 'ok', 'timeout', 'error' or 'rejected'
+            error : description of the error, if any
+        """
+
+        with self.lock:
+            key = (name, op)
+            if key not in self.channels:
+                self.channels[key] = ChannelStats()
+            self.channels[key].record(dt, status, error)
+
+    def dump(self):
+        """ Return a table of all channels, slowest (by total time) first."""
+        with self.lock:
+            items = sorted(self.channels.items(), key=lambda kv: -kv[1].total)
+            lines = ['%-28s %-3s %8s %9s %9s %9s %6s %6s %6s'%('pv', 'op', 'n', 'p50 ms', 'p99 ms', 'max ms', 'tmo', 'err', 'rej')]
+            for (name, op), c in items:
+                lines.append('%-28s %-3s %8d %9.2f %9.2f %9.2f %6d %6d %6d'%(name, op, c.n,
+                    1e3*c.percentile(0.5), 1e3*c.percentile(0.99), 1e3*c.max, c.timeouts, c.errors, c.rejected))
+                if c.last_error:
+                    lines.append('    last error: %s'%(c.last_error))
+        return '\n'.join(lines)
+
+    def summary(self, count=3):
+        """ Return a one-line summary: the slowest channels by p99 and failure totals.
+
+        Arguments:
+            count : number of channels to list
+        """
+
+        with self.lock:
+            items = sorted(self.channels.items(), key=lambda kv: -kv[1].percentile(0.99))
+            parts = ['%s %.0fms'%(name, 1e3*c.percentile(0.99)) for (name, op), c in items[:count]]
+            timeouts = sum([c.timeouts for c in self.channels.values()])
+            errors = sum([c.errors for c in self.channels.values()])
+        return 'p99 %s; tmo %d err %d'%(', '.join(parts), timeouts, errors)
@@ -4,7 +4,6 @@ Justin May
 """
 
 import time
-import pdb
 
 class PhaseMotor(object):
     """ Object to communicate with phase motors.
@@ -31,6 +30,16 @@ class PhaseMotor(object):
         self.prev_pos = self.position
         self.wait_for_stop()  # wait until it stops moving
 
+    def refresh(self):
+        """ Re-read the requested position, without waiting for the motor.
+
+        For a motor object kept between operations, since the setpoint may
+        have been changed from outside the HLA in the meantime.
+        """
+
+        self.position = self.P.get('phase_motor') * self.scale
+        self.prev_pos = self.position
+
     def wait_for_stop(self):
         """ Hold execution until a move is not underway.
         
@@ -37,3 +37,43 @@ class Sawtooth(object):
         self.t = t0 + offset + nlaser * period
         tr = self.t - trig_out
         self.r = (0.5 + np.copysign(.5, tr - 0.2 * period)) * (0.5 + np.copysign(.5, .8 * period - tr))
+
+def fit_offset(tctrl, tout, counter_good, t_trig, delay, period, ns=10000, chunk=1000, refine=0):
+    """ Find the calibration offset that best matches the sawtooth to the sweep.
+
+    Tries ns offsets evenly spaced over one period, as the original loop
+    did, but evaluates chunk candidates at a time as one broadcast Sawtooth
+    rather than one Sawtooth per candidate. The result matches the loop.
+    If refine is non zero, a second pass tries that many offsets between the
+    neighbours of the best one.
+
+    Arguments:
+        tctrl : phase control values of the sweep
+        tout : measured times
+        counter_good : 1 where the measurement is good, 0 otherwise
+        t_trig : trigger time
+        delay : cable delay after the trigger
+        period : laser period
+        ns : number of candidate offsets
+        chunk : candidates evaluated at once, bounds memory use
+        refine : candidates in the refining pass, 0 for none
+
+    Returns (offset, summed squared error).
+    """
+
+    def search(offset):
+        err = np.empty(len(offset))
+        for i in range(0, len(offset), chunk):
+            S = Sawtooth(tctrl[np.newaxis, :], t_trig, delay, offset[i:i+chunk, np.newaxis], period)
+            err[i:i+chunk] = np.sum(counter_good*S.r * (S.t - tout)**2, axis=1)
+        idx = np.argmin(err) # index of minimum of error
+        return idx, err
+    offset = np.linspace(0, period, ns)  # array of offsets to try
+    idx, err = search(offset)
+    best, best_err = offset[idx], err[idx]
+    if refine:
+        fine = np.linspace(offset[max(idx-1, 0)], offset[min(idx+1, ns-1)], refine)
+        fidx, ferr = search(fine)
+        if ferr[fidx] < best_err:
+            best, best_err = fine[fidx], ferr[fidx]
+    return best, best_err
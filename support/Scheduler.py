@@ -0,0 +1,111 @@
+""" A multi-rate scheduler for the duties of the main loop. Each duty runs on
+its own period, and optionally also as soon as a trigger condition (such as a
+new counter sample) is met, so that slow housekeeping doesn't hold up the
+duties that follow operator requests. Deadlines advance by whole periods, so
+a duty keeps its rate rather than drifting by its own run time, and starts
+later than a full period past the deadline are counted as overruns.
+"""
+
+import time
+
+class Task(object):
+    """ A duty of the main loop and its timing statistics."""
+
+    def __init__(self, name, func, period, trigger=None, when=None):
+        """ Define the duty.
+
+        Arguments:
+            name : name used in reports
+            func : called with no arguments to carry out the duty
+            period : seconds between runs; 0 runs only on the trigger
+            trigger : called with no arguments, returns True if the duty
+                should run now regardless of its period
+            when : called with no arguments, returns False while the duty
+                must not run (it stays due)
+        """
+
+        self.name = name
+        self.func = func
+        self.period = period
+        self.trigger = trigger
+        self.when = when
+        self.deadline = 0.0 # run on the first tick
+        self.runs = 0
+        self.triggered = 0 # runs caused by the trigger rather than the period
+        self.overruns = 0 # starts more than one period late
+        self.max_late = 0.0
+        self.total = 0.0 # seconds spent running
+        self.max = 0.0
+
+    def due(self, now):
+        """ Return 'period', 'trigger' or None."""
+        if self.when is not None and not self.when():
+            return None
+        triggered = self.trigger is not None and self.trigger() # always consume the trigger
+        if self.period > 0 and now >= self.deadline:
+            return 'period'
+        if triggered:
+            return 'trigger'
+        return None
+
+    def run(self, now, reason):
+        """ Run the duty, then advance its deadline and statistics."""
+        if reason == 'period':
+            if not self.runs:
+                self.deadline = now # first run, count from here
+            late = now - self.deadline
+            self.max_late = max(self.max_late, late)
+            if late > self.period:
+                self.overruns += 1
+                self.deadline = now # skip the missed deadlines
+            self.deadline += self.period
+        else:
+            self.triggered += 1
+            if self.period > 0:
+                self.deadline = now + self.period
+        self.runs += 1
+        t0 = time.time()
+        try:
+            self.func()
+        finally:
+            dt = time.time() - t0
+            self.total += dt
+            self.max = max(self.max, dt)
+
+class Scheduler(object):
+    """ Runs a list of Tasks, in order, as they fall due."""
+
+    def __init__(self, tasks):
+        """ Arguments:
+            tasks : list of Task, in the order they run within a tick
+        """
+
+        self.tasks = tasks
+
+    def tick(self):
+        """ Run every task that is due, returning the number run."""
+        count = 0
+        for task in self.tasks:
+            now = time.time()
+            reason = task.due(now)
+            if reason is not None:
+                task.run(now, reason)
+                count += 1
+        return count
+
+    def time_to_next(self, max_wait=1.0):
+        """ Return seconds until the next period deadline, at most max_wait."""
+        now = time.time()
+        wait = max_wait
+        for task in self.tasks:
+            if task.period > 0:
+                wait = min(wait, task.deadline - now)
+        return max(wait, 0.0)
+
+    def dump(self):
+        """ Return a table of run counts and timing for every task."""
+        lines = ['%-10s %8s %8s %8s %9s %9s %9s'%('task', 'period', 'runs', 'trig', 'overrun', 'late ms', 'max ms')]
+        for task in self.tasks:
+            lines.append('%-10s %8.2f %8d %8d %9d %9.1f %9.1f'%(task.name, task.period, task.runs,
+                task.triggered, task.overruns, 1e3*task.max_late, 1e3*task.max))
+        return '\n'.join(lines)
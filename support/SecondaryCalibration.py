@@ -0,0 +1,173 @@
+""" Model and fits for the secondary calibration of Gen 1 lockers, which
+measures the residual phase error of the oscillator against a second timing
+reference as a sine and cosine of the phase, at the frequency of the
+correction that set_time applies with the result.
+
+The model is linear in its amplitudes, so after each sample the fit is a
+small least squares solve, and the confidence interval of the amplitudes
+comes from its covariance. The dedicated sweep (SineFit) can then stop as
+soon as the amplitudes are known well enough rather than after a fixed number
+of samples, and the online estimator (RecursiveSineFit) can follow them with
+recursive least squares from the phase moves of normal operation.
+"""
+
+import numpy
+
+W_CORRECTION = 3.808*2*numpy.pi # angular frequency of the correction applied by set_time, rad/ns
+
+def fitres(param, tin, tout):
+    """ Compute error in calibration fit.
+
+    Arguments:
+    tin -- is input time
+    tout -- measured
+    param -- parameters for fit
+    """
+    sa,ca = param  # sine and cosine amplitudes
+    err= tout - ffun(tin, sa, ca)
+    return err
+
+def ffun( x, a, b):
+    """ Support function for fitres.
+
+    Arguments:
+    x -- phase control times, ns
+    a -- sine amplitude
+    b -- cosine amplitude
+    """
+    out = a*numpy.sin(x * W_CORRECTION) + b * numpy.cos(x*W_CORRECTION)
+    return out
+
+class SineFit(object):
+    """ Streaming least squares fit of a constant plus ffun to (set, read) samples."""
+
+    def __init__(self, capacity, confidence=0.95, w=W_CORRECTION):
+        """ Arguments:
+            capacity : maximum number of samples
+            confidence : level of the confidence intervals
+            w : angular frequency of the model, rad/ns
+        """
+
+        self.tset = numpy.empty(capacity) # preallocated, filled up to n
+        self.tread = numpy.empty(capacity)
+        self.n = 0
+        self.confidence = confidence
+        self.w = w
+        self.param = (0.0, 0.0) # sine and cosine amplitudes
+        self.halfwidth = (numpy.inf, numpy.inf) # confidence interval half widths
+        self.rms = 0.0
+
+    def add(self, tset, tread):
+        """ Add a sample and refit.
+
+        Arguments:
+            tset : phase control time set, ns
+            tread : time read from the secondary reference, ns
+        """
+
+        self.tset[self.n] = tset
+        self.tread[self.n] = tread
+        self.n += 1
+        self.fit()
+
+    def fit(self):
+        """ Fit the samples so far, updating param, halfwidth and rms."""
+        n = self.n
+        x = self.tset[:n]
+        y = self.tread[:n] - x # the constant absorbs the mean difference
+        A = numpy.column_stack([numpy.ones(n), numpy.sin(x * self.w), numpy.cos(x * self.w)])
+        coef = numpy.linalg.lstsq(A, y, rcond=None)[0]
+        self.param = (coef[1], coef[2])
+        res = y - A.dot(coef)
+        self.rms = numpy.sqrt(numpy.mean(res**2))
+        dof = n - 3
+        if dof < 1:
+            return
+        from scipy.stats import t as student_t
+        try:
+            cov = numpy.linalg.inv(A.T.dot(A)) * numpy.sum(res**2) / dof
+        except numpy.linalg.LinAlgError: # phases too close together so far
+            return
+        q = student_t.ppf(0.5 + self.confidence / 2.0, dof)
+        self.halfwidth = (q * numpy.sqrt(cov[1, 1]), q * numpy.sqrt(cov[2, 2]))
+
+    def converged(self, tolerance, min_samples=6):
+        """ Return True once both amplitudes are known to within tolerance.
+
+        Arguments:
+            tolerance : confidence interval half width needed, ns
+            min_samples : samples needed before the interval is trusted
+        """
+
+        return self.n >= min_samples and max(self.halfwidth) <= tolerance
+
+class RecursiveSineFit(object):
+    """ Recursive least squares fit of a constant plus a sine and cosine at
+    the set_time correction frequency, one sample at a time."""
+
+    def __init__(self, forgetting=0.999, initial=100.0, w=W_CORRECTION):
+        """ Arguments:
+            forgetting : weight kept by the previous samples at each update,
+                1 to never forget
+            initial : prior variance of each parameter, ns^2
+            w : angular frequency of the model, rad/ns
+        """
+
+        self.forgetting = forgetting
+        self.initial = initial
+        self.w = w
+        self.theta = numpy.zeros(3) # constant, sine and cosine amplitudes
+        self.cov = numpy.eye(3) * initial
+        self.rss = 0.0
+        self.weight = 0.0
+        self.n = 0
+
+    def update(self, tset, tread):
+        """ Add a sample.
+
+        Arguments:
+            tset : phase control time, ns
+            tread : time read from the secondary reference, ns
+        """
+
+        phi = numpy.array([1.0, numpy.sin(tset * self.w), numpy.cos(tset * self.w)])
+        cphi = self.cov.dot(phi)
+        gain = cphi / (self.forgetting + phi.dot(cphi))
+        prior = tread - tset - phi.dot(self.theta)
+        self.theta = self.theta + gain * prior
+        self.cov = self.cov - numpy.outer(gain, cphi)
+        if numpy.trace(self.cov) < 3 * self.initial: # no wind up while the phase stays put
+            self.cov = self.cov / self.forgetting
+        self.n += 1
+        # weighted residual sum of squares, and the weight of the samples behind it
+        self.rss = self.forgetting * self.rss + prior * (tread - tset - phi.dot(self.theta))
+        self.weight = self.forgetting * self.weight + 1.0
+
+    def reset_offset(self):
+        """ Forget the constant, eg. when the target time changes, keeping the amplitudes."""
+        self.cov[0, :] = 0.0
+        self.cov[:, 0] = 0.0
+        self.cov[0, 0] = self.initial
+
+    @property
+    def param(self):
+        """ Sine and cosine amplitudes."""
+        return self.theta[1], self.theta[2]
+
+    @property
+    def halfwidth(self):
+        """ Approximate 95% confidence interval half widths of the amplitudes."""
+        if self.weight <= 3.0:
+            return numpy.inf, numpy.inf
+        noise = self.rss / (self.weight - 3.0) # residual variance, ns^2
+        return tuple(2.0 * numpy.sqrt(noise * numpy.diag(self.cov)[1:]))
+
+    def converged(self, tolerance, min_samples=6):
+        """ Return True once both amplitudes are known to within tolerance.
+
+        Arguments:
+            tolerance : confidence interval half width needed, ns
+            min_samples : samples needed before the interval is trusted
+        """
+
+        return self.n >= min_samples and max(self.halfwidth) <= tolerance
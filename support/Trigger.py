@@ -27,6 +27,10 @@ class Trigger(object):
             self.scale = 1 # trigger is in ns units, covers TPR systems
         self.time = self.scale * self.P.get('laser_trigger')    
    
+    def refresh(self):
+        """ Re-read TDES, returning it in ns."""
+        return self.get_ns()
+
     def get_ns(self):
         """ Retrieve TDES."""
         tmp = self.P.get('laser_trigger')
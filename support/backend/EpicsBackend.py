@@ -0,0 +1,81 @@
+""" Channel access backend using pyepics. This is the default backend and
+matches the behavior of femto.py before backends were introduced.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    from epics.pv import PV as Pv
+    from epics import ca
+except ModuleNotFoundError:
+    print('no epics pv support located within environment')
+
+from support.backend.PVBackend import PVBackend
+
+class EpicsBackend(PVBackend):
+    """ Backend creating pyepics PV objects."""
+
+    def __init__(self, max_readers=16):
+        """ Arguments:
+            max_readers : most reads of one get_many batch in flight at once
+        """
+
+        PVBackend.__init__(self)
+        self.max_readers = max_readers
+        self.readers = None # get_many reader threads, started on first use
+
+    def create_pv(self, pvname):
+        """ Return a pyepics PV; its connection search starts immediately.
+
+        Arguments:
+            pvname : full pv name
+        """
+
+        return Pv(pvname)
+
+    def attach_thread(self):
+        """ Attach the calling thread to the initial channel access context.
+
+        Otherwise pyepics creates a new context for each thread that uses
+        channel access, and channels could not be shared between lockers.
+        """
+
+        ca.use_initial_context()
+
+    def get_many(self, pvs, timeout=10.0):
+        """ Read a list of channels in a single round trip.
+
+        Each read goes through the public PV.get_with_metadata, which stores
+        the value and timestamp on the PV object as a get() would, and the
+        reads are issued from a pool of reader threads so that every request
+        is on the wire before any reply is awaited. Disconnected channels
+        are not requested and return None, as do reads not completed by the
+        deadline.
+
+        Arguments:
+            pvs : list of pyepics PV objects
+            timeout : seconds to wait for the whole batch
+        """
+
+        if self.readers is None:
+            self.readers = ThreadPoolExecutor(max_workers=self.max_readers,
+                thread_name_prefix='pv-reader', initializer=ca.use_initial_context)
+        deadline = time.time() + timeout
+        def read(pv):
+            return pv.get_with_metadata(with_ctrlvars=False, use_monitor=False,
+                timeout=max(deadline - time.time(), 0.001))
+        futures = []
+        for pv in pvs:
+            if not pv.connected:
+                futures.append(None) # don't block the batch on a dead channel
+                continue
+            futures.append(self.readers.submit(read, pv))
+        wait([f for f in futures if f is not None], timeout=timeout)
+        values = []
+        for f in futures:
+            if f is None or not f.done() or f.exception() is not None or f.result() is None:
+                values.append(None)
+                continue
+            values.append(f.result()['value'])
+        return values
@@ -0,0 +1,115 @@
+""" Base definition of a pv backend. A backend is the factory through which
+femtoconfig and PVS build their channels, so that the HLA can run against
+either the control system (EpicsBackend) or an in-process simulation of the
+locker IOC (SimulatedBackend).
+
+Channels are shared: channel() hands out one object per pv name, counting
+references, so lockers hosted in the same process (and config names that
+resolve to the same pv) don't open duplicate channels. release() disconnects
+a channel once its last user is done with it.
+
+Channel objects returned by a backend follow the subset of the pyepics PV
+interface used by the HLA: pvname, connected, value, timestamp, connect(),
+wait_for_connection(), get(), put(), add_callback(), remove_callback(),
+reconnect() and disconnect().
+"""
+
+import threading
+
+class PVBackend(object):
+    """ Generalized pv backend. Concrete backends inherit from this class."""
+
+    def __init__(self):
+        self.channels = {} # pv name -> shared channel object
+        self.refs = {} # pv name -> number of users of the channel
+        self.lock = threading.Lock()
+
+    def configure(self, config):
+        """ Give the backend a look at the configuration before channels are built.
+
+        Arguments:
+            config : the configuration dictionary read by femtoconfig
+        """
+        pass
+
+    def create_pv(self, pvname):
+        """ Return a channel object for a pv name.
+
+        Arguments:
+            pvname : full pv name
+        """
+        raise NotImplementedError
+
+    def channel(self, pvname):
+        """ Return the shared channel for a pv name, creating it on first use.
+
+        Arguments:
+            pvname : full pv name
+        """
+
+        with self.lock:
+            if pvname not in self.channels:
+                self.channels[pvname] = self.create_pv(pvname)
+                self.refs[pvname] = 0
+            self.refs[pvname] += 1
+            return self.channels[pvname]
+
+    def release(self, pv):
+        """ Give up one reference to a shared channel, disconnecting it after the last.
+
+        Arguments:
+            pv : channel object returned by channel()
+        """
+
+        with self.lock:
+            if self.channels.get(pv.pvname) is not pv:
+                last = True # not shared, owned by the caller alone
+            else:
+                self.refs[pv.pvname] -= 1
+                last = self.refs[pv.pvname] <= 0
+                if last:
+                    del self.channels[pv.pvname]
+                    del self.refs[pv.pvname]
+        if last:
+            pv.disconnect()
+
+    def attach_thread(self):
+        """ Prepare the calling thread to use this backend's channels.
+
+        Called at the start of each locker thread in host mode.
+        """
+        pass
+
+    def get_many(self, pvs, timeout=10.0):
+        """ Read a list of channels, returning a list of values (None on failure).
+
+        The default reads them one at a time; backends that can overlap
+        requests override this.
+
+        Arguments:
+            pvs : list of channel objects created by this backend
+            timeout : seconds to wait for the whole batch
+        """
+
+        values = []
+        for pv in pvs:
+            try:
+                values.append(pv.get(timeout=timeout, use_monitor=False))
+            except:
+                values.append(None)
+        return values
+
+def create_backend(name='epics', options=None):
+    """ Build a backend by name.
+
+    Arguments:
+        name : "epics" (default) or "sim"
+        options : dictionary of keyword options for the backend
+    """
+
+    options = options or {}
+    if name == 'sim':
+        from support.backend.SimulatedBackend import SimulatedBackend
+        return SimulatedBackend(**options)
+    from support.backend.EpicsBackend import EpicsBackend
+    return EpicsBackend(**options)
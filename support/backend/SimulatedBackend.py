@@ -0,0 +1,433 @@
+""" In-process simulation of a laser locker IOC. The simulated backend builds
+channels that talk to a SimulatedIOC instead of channel access, so that
+femto.py can be exercised, tested and profiled without a control system.
+
+The IOC models the FS_* records as plain memory, a phase motor with finite
+velocity (VAL, .RBV and .DMOV), the laser trigger TDES, and a time interval
+counter whose reading follows the calibration sawtooth of the phase motor
+position and trigger time, with gaussian noise and a fixed sample rate. Every
+channel access operation can be given a latency to model a busy IOC.
+
+Several lockers can share one IOC (host mode): each configuration adds its
+own motor, trigger and counter loop, and records already laid out by an
+earlier configuration are kept.
+"""
+
+import random
+import threading
+import time
+
+from support.backend.PVBackend import PVBackend
+from support.Sawtooth import Sawtooth
+
+class SimulatedLoop(object):
+    """ The phase motor, trigger and counter records of one locker."""
+
+    def __init__(self, motor, trigger, counter, period, trigger_scale=1.0):
+        """ Arguments:
+            motor : phase motor VAL pv name
+            trigger : laser trigger pv name
+            counter : time interval counter pv name
+            period : laser period, ns
+            trigger_scale : ns per trigger unit
+        """
+
+        self.motor = motor
+        self.trigger = trigger
+        self.counter = counter
+        self.period = period
+        self.trigger_scale = trigger_scale
+        self.motion = None # (start, target, start time) of a motor move
+        self.sample = None # index of the last counter sample
+
+class SimulatedIOC(object):
+    """ Memory-backed model of the records a laser locker uses."""
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, counter_noise=0.002,
+            counter_rate=10.0, motor_velocity=50000.0, delay=10.0, offset=3.0,
+            period=None, phase_scale=1.0, update_rate=20.0, offline_delay=0.0,
+            initial=None, seed=None):
+        """ Create an unconfigured IOC; records are laid out by configure().
+
+        Arguments:
+            latency : seconds added to every blocking get or put
+            latency_jitter : additional uniformly distributed latency, seconds
+            counter_noise : standard deviation of counter readings, ns
+            counter_rate : counter samples per second
+            motor_velocity : phase motor speed in motor units (ps) per second
+            delay : true trigger to counter cable delay, ns
+            offset : true laser phase offset, ns
+            period : laser period in ns; derived from each locker type if None
+            phase_scale : ns of laser phase per ns of phase motor position
+            update_rate : Hz at which motor motion and counter samples are
+                advanced and published to monitors; 0 to only update on access
+            offline_delay : seconds a read of an offline channel takes to fail
+            initial : dictionary of pv name -> value overriding defaults
+            seed : seed for the noise generator
+        """
+
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.counter_noise = counter_noise
+        self.counter_rate = counter_rate
+        self.motor_velocity = motor_velocity
+        self.delay = delay
+        self.offset = offset
+        self.fixed_period = period
+        self.phase_scale = phase_scale
+        self.update_rate = update_rate
+        self.offline_delay = offline_delay
+        self.initial = initial or {}
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.records = {} # pv name -> value
+        self.stamps = {} # pv name -> time of last change
+        self.subscribers = {} # pv name -> list of SimulatedPV with callbacks
+        self.offline = set() # pv names that currently don't connect
+        self.loops = [] # SimulatedLoop of each configured locker
+        self.running = False
+        self.thread = None
+
+    def configure(self, config):
+        """ Lay out records for the pvs described by a femto configuration.
+
+        Records that already exist, laid out for another locker or written
+        since, keep their values.
+
+        Arguments:
+            config : configuration dictionary as read by femtoconfig
+        """
+
+        c = config["config"]
+        a = config.get("add_config", {})
+        dev = c["dev_base"]
+        is_atca = c["type"] == "ATCA"
+        period = self.fixed_period
+        if period is None:
+            if is_atca:
+                period = 1/(1.3/196.0*7/50.0) # pulse picker period
+            else:
+                period = 1/(0.476/56.0*(56.0/7)) # 68 MHz oscillator
+        if c["reverse_counter"]:
+            counter = c["counter_base"]+"GetOffsetInvMeasMean"
+        else:
+            counter = c["counter_base"]+"GetMeasMean"
+        loop = SimulatedLoop(c["phase_motor"], c["laser_trigger"], counter, period,
+            1000.0/119.0 if c["trig_in_ticks"] else 1.0)
+        if is_atca:
+            status_base = a["atca_base"]
+        else:
+            status_base = dev+"CH1_"
+        defaults = {
+            dev+"FS_WATCHDOG": 0,
+            dev+"FS_OSC_TGT_FREQ": 68000000.0,
+            dev+"FREQ_SP": 68000000.0,
+            dev+"FS_TGT_TIME": 0.0,
+            dev+"FS_TGT_TIME.HIHI": 10000.0,
+            dev+"FS_TGT_TIME.LOLO": -10000.0,
+            dev+"GetMeasJitter": 2e-12,
+            dev+"GetMeasJitter.HIGH": 1e-10,
+            status_base+"RF_PWR": 0.5,
+            status_base+"RF_PWR.LOLO": 0.0,
+            status_base+"RF_PWR.HIHI": 1.0,
+            status_base+"DIODE_PWR": 0.5,
+            status_base+"DIODE_PWR.LOLO": 0.0,
+            status_base+"DIODE_PWR.HIHI": 1.0,
+            loop.counter+".LOW": -1.0,
+            loop.counter+".HIGH": 1.0,
+            loop.motor: 0.0,
+            loop.motor+".RBV": 0.0,
+            loop.motor+".DMOV": 1,
+            loop.trigger: 0.0,
+            c["error_pv_name"]: '',
+            c["version_pv_name"]: '',
+        }
+        if is_atca:
+            defaults[a["atca_base"]+"PHASE_LOCKED"] = 1
+            defaults[a["atca_base"]+"RF_LOCK_ENABLE"] = 1
+            if "laser_trigger_width" in a:
+                defaults[a["laser_trigger_width"]] = 400.0
+        else:
+            defaults[dev+"PHASE_LOCKED"] = 1
+            defaults[dev+"RF_LOCK_ENABLE"] = 1
+        defaults.update(self.initial)
+        now = time.time()
+        with self.lock:
+            for k, v in iter(defaults.items()):
+                if k not in self.records:
+                    self.records[k] = v
+                    self.stamps[k] = now
+            if self.loop_for(loop.motor) is None: # not a locker configured before
+                self.loops.append(loop)
+            self.update(now)
+        if self.update_rate > 0 and self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name='sim-ioc')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        """ Ticker thread: advance the model so monitors see motion and samples."""
+        while self.running:
+            self.update()
+            time.sleep(1.0/self.update_rate)
+
+    def stop(self):
+        """ Stop the ticker thread."""
+        self.running = False
+
+    def wait_latency(self):
+        """ Sleep for one simulated channel access round trip."""
+        dt = self.latency + self.random.random()*self.latency_jitter
+        if dt > 0:
+            time.sleep(dt)
+
+    def loop_for(self, motor):
+        """ Return the SimulatedLoop of a phase motor pv name, None if unknown."""
+        for loop in self.loops:
+            if loop.motor == motor:
+                return loop
+        return None
+
+    @property
+    def counter(self):
+        """ Counter pv name of the first configured locker."""
+        return self.loops[0].counter if self.loops else None
+
+    @property
+    def period(self):
+        """ Laser period (ns) of the first configured locker."""
+        return self.loops[0].period if self.loops else self.fixed_period
+
+    def laser_time(self, loop=None):
+        """ Return the noiseless counter time (ns) for the current motor and
+        trigger of a locker, by default the first configured."""
+        if loop is None:
+            loop = self.loops[0]
+        pc = self.records.get(loop.motor+".RBV", 0.0) * 0.001 * self.phase_scale
+        t_trig = self.records.get(loop.trigger, 0.0) * loop.trigger_scale
+        S = Sawtooth(pc, t_trig, self.delay, self.offset, loop.period)
+        return float(S.t)
+
+    def update(self, now=None):
+        """ Advance motor motion and the counter to the current time."""
+        if now is None:
+            now = time.time()
+        changed = []
+        with self.lock:
+            for loop in self.loops:
+                if loop.motion is not None:
+                    start, target, t0 = loop.motion
+                    travel = self.motor_velocity * (now - t0)
+                    if travel >= abs(target - start):
+                        loop.motion = None
+                        self.set_record(loop.motor+".RBV", target, now, changed)
+                        self.set_record(loop.motor+".DMOV", 1, now, changed)
+                    elif target > start:
+                        self.set_record(loop.motor+".RBV", start + travel, now, changed)
+                    else:
+                        self.set_record(loop.motor+".RBV", start - travel, now, changed)
+                if self.counter_rate > 0:
+                    sample = int(now * self.counter_rate)
+                    if sample != loop.sample:
+                        loop.sample = sample
+                        t = self.laser_time(loop) + self.random.gauss(0.0, self.counter_noise)
+                        self.set_record(loop.counter, t * 1e-9, sample/self.counter_rate, changed)
+        self.notify(changed)
+
+    def set_record(self, pvname, value, stamp, changed):
+        """ Store a record value, noting it for monitor delivery if it changed."""
+        if self.records.get(pvname) != value:
+            changed.append(pvname)
+        self.records[pvname] = value
+        self.stamps[pvname] = stamp
+
+    def notify(self, pvnames):
+        """ Deliver monitor updates for the given records (outside the lock)."""
+        for pvname in pvnames:
+            with self.lock:
+                subscribers = list(self.subscribers.get(pvname, []))
+                value = self.records.get(pvname)
+                stamp = self.stamps.get(pvname)
+            for pv in subscribers:
+                pv.on_update(value, stamp)
+
+    def read(self, pvname):
+        """ Return (value, timestamp) for a record, advancing the model first."""
+        self.update()
+        with self.lock:
+            if pvname not in self.records: # unknown records read back as zero
+                self.records[pvname] = 0
+                self.stamps[pvname] = time.time()
+            return self.records[pvname], self.stamps[pvname]
+
+    def write(self, pvname, value):
+        """ Write a record. Writing the motor VAL starts a move."""
+        now = time.time()
+        self.update(now)
+        changed = []
+        with self.lock:
+            self.set_record(pvname, value, now, changed)
+            loop = self.loop_for(pvname)
+            if loop is not None:
+                start = self.records.get(loop.motor+".RBV", 0.0)
+                if value != start:
+                    loop.motion = (start, value, now)
+                    self.set_record(loop.motor+".DMOV", 0, now, changed)
+        self.notify(changed)
+
+    def subscribe(self, pv):
+        """ Register a channel for monitor updates."""
+        with self.lock:
+            subscribers = self.subscribers.setdefault(pv.pvname, [])
+            if pv not in subscribers:
+                subscribers.append(pv)
+
+    def unsubscribe(self, pv):
+        """ Remove a channel from monitor updates."""
+        with self.lock:
+            if pv in self.subscribers.get(pv.pvname, []):
+                self.subscribers[pv.pvname].remove(pv)
+
+    def set_offline(self, pvname, offline=True):
+        """ Simulate a record becoming unreachable (or reachable again).
+
+        Arguments:
+            pvname : full pv name
+            offline : True to drop the channel, False to restore it
+        """
+
+        if offline:
+            self.offline.add(pvname)
+        else:
+            self.offline.discard(pvname)
+
+class SimulatedPV(object):
+    """ Channel to a SimulatedIOC record with the pyepics PV interface used by
+    the HLA. Like a pyepics PV without auto-monitoring, every get() costs a
+    round trip; monitor callbacks are delivered once one is added."""
+
+    def __init__(self, ioc, pvname):
+        """ Create the channel.
+
+        Arguments:
+            ioc : SimulatedIOC holding the record
+            pvname : full pv name
+        """
+
+        self.ioc = ioc
+        self.pvname = pvname
+        self.value = None
+        self.timestamp = None
+        self.callbacks = {}
+
+    def __repr__(self):
+        return "<SimulatedPV '%s'>"%(self.pvname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.disconnect()
+
+    @property
+    def connected(self):
+        return self.pvname not in self.ioc.offline
+
+    def connect(self, timeout=None):
+        return self.connected
+
+    def wait_for_connection(self, timeout=None):
+        return self.connected
+
+    def reconnect(self):
+        return self.connected
+
+    def get(self, count=None, as_string=False, as_numpy=True, timeout=None,
+            with_ctrlvars=False, use_monitor=True):
+        """ Read the record, paying the simulated latency."""
+        if not self.connected:
+            if self.ioc.offline_delay > 0:
+                time.sleep(min(self.ioc.offline_delay, timeout or self.ioc.offline_delay))
+            return None
+        self.ioc.wait_latency()
+        self.value, self.timestamp = self.ioc.read(self.pvname)
+        return self.value
+
+    def put(self, value, wait=False, timeout=30.0, use_complete=False,
+            callback=None, callback_data=None):
+        """ Write the record; only a waiting put pays the simulated latency."""
+        if not self.connected:
+            return None
+        if wait:
+            self.ioc.wait_latency()
+        self.ioc.write(self.pvname, value)
+        return 1
+
+    def add_callback(self, callback=None, index=None, run_now=False,
+            with_ctrlvars=True, **kw):
+        """ Add a monitor callback, called with pvname, value and timestamp."""
+        if index is None:
+            index = 1 + max(list(self.callbacks.keys()) + [0])
+        self.callbacks[index] = (callback, kw)
+        self.ioc.subscribe(self)
+        if run_now and self.connected:
+            self.value, self.timestamp = self.ioc.read(self.pvname)
+            self.run_callback(index)
+        return index
+
+    def remove_callback(self, index=None):
+        self.callbacks.pop(index, None)
+        if not self.callbacks:
+            self.ioc.unsubscribe(self)
+
+    def clear_callbacks(self):
+        self.callbacks = {}
+        self.ioc.unsubscribe(self)
+
+    def run_callback(self, index):
+        callback, kw = self.callbacks[index]
+        callback(pvname=self.pvname, value=self.value, timestamp=self.timestamp, **kw)
+
+    def on_update(self, value, stamp):
+        """ Monitor delivery from the IOC."""
+        if not self.connected:
+            return
+        self.value = value
+        self.timestamp = stamp
+        for index in list(self.callbacks.keys()):
+            self.run_callback(index)
+
+    def disconnect(self):
+        self.clear_callbacks()
+
+class SimulatedBackend(PVBackend):
+    """ Backend whose channels are served by an in-process SimulatedIOC."""
+
+    def __init__(self, **options):
+        """ Create the backend and its IOC.
+
+        Arguments:
+            options : keyword options for SimulatedIOC
+        """
+
+        PVBackend.__init__(self)
+        self.ioc = SimulatedIOC(**options)
+
+    def configure(self, config):
+        self.ioc.configure(config)
+
+    def create_pv(self, pvname):
+        return SimulatedPV(self.ioc, pvname)
+
+    def get_many(self, pvs, timeout=10.0):
+        """ Read a list of channels for the price of one round trip."""
+        self.ioc.wait_latency()
+        values = []
+        for pv in pvs:
+            if not pv.connected:
+                values.append(None)
+                continue
+            pv.value, pv.timestamp = self.ioc.read(pv.pvname)
+            values.append(pv.value)
+        return values
@@ -11,7 +11,7 @@ import pathlib
 import json
 import re
 
-from epics import PV as Pv
+from support.backend.PVBackend import create_backend
 
 class Config(object):
     """The base config class encapsulates the logic for reading and validating
@@ -19,12 +19,17 @@ class Config(object):
     described in 'femto_config.json description.md' and 'template_femto_config.json'.
     """
 
-    def __init__(self):
+    def __init__(self, backend=None):
         """ Construct a Config object with dictionaries and strings
         
         Init's a Config object which is backwards compatible with early femto.py
         structures.
         
+        Arguments:
+        backend -- pv backend used to build channels (see backend/PVBackend.py);
+            if None, one is chosen from the "pv_backend" key in add_config when
+            the pvs are expanded, defaulting to epics
+
         Contents:
         self.config -- source configuration data 
         self.pvlist -- constructed pv list from configuration
@@ -34,8 +39,16 @@ class Config(object):
         self.version = ""
         self.name = ""
         self.pvlist = {}
+        self.backend = backend
         pass
 
+    def getBackend(self):
+        """ Return the pv backend, creating it from the configuration if needed."""
+        if self.backend is None:
+            add_config = self.config.get("add_config", {})
+            self.backend = create_backend(add_config.get("pv_backend", "epics"), add_config.get("pv_backend_options"))
+        return self.backend
+
     def readConfig(self,filename):
         """Reads in a configuration file.
         
@@ -92,7 +105,7 @@ class Config(object):
         for pvstring in self.config['config']:
             pvtestset = []
             pvtestset.append(self.config["base"])
-            with Pv(pvstring) as testpv:
+            with self.getBackend().create_pv(pvstring) as testpv:
                 if not testpv.connect(timeout=0.5):
                     print("Connection failed: %s"%(pvstring))
                     err = True
@@ -132,6 +145,8 @@ class Config(object):
         Expanded descriptions of these fields are available in system documentation.
         """
 
+        backend = self.getBackend()
+        backend.configure(self.config)
         pvvals = []
         pvvals.append(("freq_counter",self.config["config"]["freq_counter"]))
         pvvals.append(("phase_motor",self.config["config"]["phase_motor"]))
@@ -222,6 +237,11 @@ class Config(object):
             if "find_beam_ctl" in self.config["add_config"]:
                 pvvals.append(("find_beam_ctl",self.config["add_config"]["find_beam_ctl"]))
         
+        if "pv_stats_pv" in self.config["add_config"]:
+            pvvals.append(("pv_stats",self.config["add_config"]["pv_stats_pv"]))
+        if "loop_stats_pv" in self.config["add_config"]:
+            pvvals.append(("loop_stats",self.config["add_config"]["loop_stats_pv"]))
+
         self.matlab_pv_digits = self.config["config"]["matlab_pv_digits"]
         self.reverse_counter = self.config["config"]["reverse_counter"]
         self.timeout = self.config["config"]["timeout"]
@@ -230,12 +250,14 @@ class Config(object):
         self.use_dither = self.config["config"]["use_dither"]
         self.use_drift_correction = self.config["config"]["use_drift_correction"]
         self.version_pv_name = self.config["config"]["version_pv_name"]
-        self.version_pv = Pv(self.config["config"]["version_pv_name"])
-        self.error_pv = Pv(self.config["config"]["error_pv_name"])
-        pvvals.append(("phase_motor_dmov",self.config["config"]["phase_motor"]+".DMOV"))
-
-        for entry in pvvals:
-            self.pvlist[entry[0]]=Pv(entry[1])
+        self.version_pv = backend.channel(self.config["config"]["version_pv_name"])
+        self.error_pv = backend.channel(self.config["config"]["error_pv_name"])
+
+        # Later entries replace earlier ones of the same name (eg. the ATCA
+        # status pvs), so resolve names before creating any channel; pvs
+        # shared with other names or lockers get a single channel
+        for name, pvname in iter(dict(pvvals).items()):
+            self.pvlist[name]=backend.channel(pvname)
 
     def printDefs(self):
         """ Print the contents of a configuration by data type.
@@ -1,9 +1,10 @@
 """ Concrete subclass of the laser locker object implementing logic appropriate
 to Gen1 laser locker versions."""
 
+import threading
 import time
 import math
-import pdb
+from collections import deque
 
 import numpy as np
 
@@ -12,7 +13,64 @@ from ..tic.TimeIntervalCounter import TimeIntervalCounter
 from ..tic.Keysight import Keysight
 from ..Trigger import Trigger
 from ..PhaseMotor import PhaseMotor
-from ..Sawtooth import Sawtooth
+from ..Sawtooth import Sawtooth, fit_offset
+from ..SecondaryCalibration import SineFit, RecursiveSineFit, W_CORRECTION
+from ..DriftEstimator import create_drift_estimator
+from ..DriftWorker import DriftWorker
+
+def adaptive_sweep(measure, span, period, coarse=8, tolerance=0.05, budget=50):
+    """ Sample a calibration sweep coarsely, then bisect towards each edge.
+
+    Between two neighbouring good points on different pulses, the measured
+    time less the phase drops by a period. Each such pair brackets an edge of
+    the sawtooth; the widest bracket is halved with a new point until every
+    bracket is within tolerance or the budget of points is spent. A bracket
+    whose midpoint reads bad is not refined further.
+
+    Arguments:
+        measure : called with a phase, returns (time, good), or None to abandon
+            the sweep
+        span : phase range of the sweep, from 0
+        period : laser period
+        coarse : number of evenly spaced first points
+        tolerance : bracket width at which an edge is found
+        budget : maximum number of points
+
+    Returns (phases, times, good, widest bracket) sorted by phase, or None if
+    the sweep was abandoned.
+    """
+
+    points = {}
+    for x in np.linspace(0, span, coarse):
+        points[x] = measure(x)
+        if points[x] is None:
+            return None
+
+    def edge_between(a, b):
+        return (points[b][0] - b) - (points[a][0] - a) < -period / 2.0
+
+    good = sorted([x for x in points if points[x][1]])
+    brackets = [(a, b) for a, b in zip(good[:-1], good[1:]) if edge_between(a, b)]
+    done = [] # brackets that can't be refined
+    while brackets and len(points) < budget:
+        a, b = max(brackets, key=lambda ab: ab[1] - ab[0])
+        if b - a <= tolerance:
+            break
+        brackets.remove((a, b))
+        m = (a + b) / 2.0
+        points[m] = measure(m)
+        if points[m] is None:
+            return None
+        if not points[m][1]:
+            done.append((a, b))
+        elif edge_between(a, m):
+            brackets.append((a, m))
+        else:
+            brackets.append((m, b))
+    widths = [b - a for a, b in brackets + done]
+    xs = sorted(points)
+    return (np.array(xs), np.array([points[x][0] for x in xs]), np.array([points[x][1] for x in xs], dtype=float),
+        max(widths) if widths else 0.0)
 
 class LaserLocker(LaserLocker):
     """Gen 1 Laser locker object, inheriting from generalized LaserLocker object."""
@@ -43,6 +101,21 @@ class LaserLocker(LaserLocker):
         self.delay_offset = 0  # kludge to avoide running near sawtooth edge
         self.drift_last= 0; # used for drift correction when activated
         self.drift_initialized = False # will be true after first cycle
+        add_config = self.P.config.config["add_config"]
+        self.drift = create_drift_estimator(add_config.get("drift_estimator", "exponential"),
+            add_config.get("drift_estimator_options"))
+        self.drift_stamp = None # timestamp of the last timetool sample taken
+        self.drift_lock = threading.Lock() # the drift worker takes samples too
+        self.drift_outside = None # drift_correction_value written from outside, not yet taken
+        self.drift_written = deque(maxlen=8) # recent drift_correction_value writes of our own
+        if self.P.config.use_drift_correction:
+            self.P.config.pvlist['drift_correction_value'].add_callback(self.on_drift_value, with_ctrlvars=False)
+        self.drift_applied = None # drift included in the commanded phase, ns
+        self.drift_gain = None # drift_correction_gain as last read
+        self.secondary = None # online secondary calibration estimator, when enabled
+        self.secondary_stamp = None # timestamp of the last secondary reading used
+        self.secondary_time = None # target time when the estimator last took a sample
+        self.last_move = 0.0 # time of the last phase move by set_time
         if "tic_type" in self.P.config.config["add_config"]:
             if self.P.config.config["add_config"]["tic_type"] == "keysight":
                 self.C = Keysight(self.P)
@@ -59,28 +132,26 @@ class LaserLocker(LaserLocker):
         self.setpoint_ok = 1
         self.lock_ok = 1
         self.message = 'OK' # output error message, OK means no trouble found    
-        rfpwr = self.P.get('rf_pwr')  # check RF level
-        rfpwrhihi = self.P.get('rf_pwr_hihi')
-        rfpwrlolo = self.P.get('rf_pwr_lolo')
+        (rfpwr, rfpwrhihi, rfpwrlolo, dpwr, dpwrhihi, dpwrlolo, freqsp, oscf,
+            locked) = self.P.get_many(['rf_pwr', 'rf_pwr_hihi', 'rf_pwr_lolo',
+            'diode_pwr', 'diode_pwr_hihi', 'diode_pwr_lolo', 'freq_sp',
+            'oscillator_f', 'laser_locked']) # one round trip for all status pvs
         if (rfpwr > rfpwrhihi) | (rfpwr < rfpwrlolo):
             self.message = 'RF power out of range\n'
             self.laser_ok = 0
             self.rf_ok = 0
 
-        dpwr = self.P.get('diode_pwr') # check diode level
-        dpwrhihi = self.P.get('diode_pwr_hihi')
-        dpwrlolo = self.P.get('diode_pwr_lolo')
         if (dpwr > dpwrhihi) | (dpwr < dpwrlolo):
             self.message = 'diode power out of range\n'
             self.laser_ok = 0
             self.rf_diode_ok = 0
         
-        if abs(self.P.get('freq_sp') - self.P.get('oscillator_f')) > self.max_frequency_error:  # oscillator set point wrong
+        if abs(freqsp - oscf) > self.max_frequency_error:  # oscillator set point wrong
             self.laser_ok = 0
             self.frequency_ok = 0
             self.frequency_ok = 0
             self.message = 'frequency set point out of range\n'
-        if not self.P.get('laser_locked'):
+        if not locked:
             self.message = 'laser not indicating locked\n'
             self.lock_ok = 0
             self.laser_ok = 0
@@ -94,9 +165,9 @@ class LaserLocker(LaserLocker):
         """ Gen1 implementation of checking whether there is a bucket jump."""
         
         print('jump detect') 
-        T = Trigger(self.P) # trigger class
+        T = self.T # trigger class
         print('setup phase motor')
-        M = PhaseMotor(self.P) # phase motor     
+        M = self.motor() # phase motor     
         print('self.C.get_time')
         t = self.C.get_time()
         if t > -900000.0:      
@@ -150,7 +221,8 @@ class LaserLocker(LaserLocker):
             self.P.E.write_error({'value':'non-integer bucket error, cant fix','lvl':1})
             return
         self.P.E.write_error({'value':'Fixing Jump','lvl':1})
-        M = PhaseMotor(self.P) #phase control motor
+        M = self.motor() #phase control motor
+        self.last_pc = None # the phase leaves what set_time commanded
         M.wait_for_stop()  # just ot be sure
         old_pc = M.get_position()
         new_pc = old_pc  - self.exact_error # new time for phase control
@@ -162,6 +234,7 @@ class LaserLocker(LaserLocker):
         new_offset = self.d['offset'] - (new_pc_fix - old_pc)
         self.d['offset'] = new_offset
         self.P.put('offset', new_offset)
+        self.P.flush() # offset must land before the correction count moves
         self.P.E.write_error({'value':'Done Fixing Jump','lvl':1})
         bc = self.P.get('bucket_counter') # previous number of jumps
         self.P.put('bucket_counter', bc + 1)  # write incremented number
@@ -172,21 +245,19 @@ class LaserLocker(LaserLocker):
         
         This function is the core move command for the laser locker, used by higher level functions.
         """
-        t = self.P.get('time')
+        t, t_high, t_low = self.P.get_many(['time', 'time_hihi', 'time_lolo'])
         if math.isnan(t):
             self.P.E.write_error('desired time is NaN')
             return
         if t < self.min_time or t > self.max_time:
             self.P.E.write_error('need to move TIC trigger')
             return
-        t_high = self.P.get('time_hihi')
-        t_low = self.P.get('time_lolo')
         if t > t_high:
             t = t_high
         if t < t_low:
             t = t_low
-        T = Trigger(self.P) # set up trigger
-        M = PhaseMotor(self.P)
+        T = self.T # set up trigger
+        M = self.motor()
         laser_t = t - self.d['offset']  # Just copy workign matlab, don't think!
         nlaser = np.floor(laser_t * self.laser_f)
         pc = t - (self.d['offset'] + nlaser / self.laser_f)
@@ -196,37 +267,17 @@ class LaserLocker(LaserLocker):
         trig = ntrig / self.trigger_f
 
         if self.P.config.use_drift_correction:
-            dc = self.P.get('drift_correction_signal')*1.0e-6 # TODO need to convert this to a configuration/control parameter
-            do = self.P.get('drift_correction_offset') 
-            dg = self.P.get('drift_correction_gain')
-            ds = self.P.get('drift_correction_smoothing')
-            self.drift_last = self.P.get('drift_correction_value')
-            accum = self.P.get('drift_correction_accum')
-            # modified to not use drift_correction_offset or drift_correction_multiplier:
-            de  = (dc-do)  # (hopefully) fresh pix value from TT script
-            if ( self.drift_initialized ):
-                if ( dc != self.dc_last ):           
-                    if ( accum == 1 ): # if drift correction accumulation is enabled
-                        #TODO: Pull these limits from the associated matlab PV
-                        self.drift_last = self.drift_last + (de- self.drift_last) / ds; # smoothing
-                        self.drift_last = max(-.015, self.drift_last) # floor at 15ps
-                        self.drift_last = min(.015, self.drift_last)#
-                        self.P.put('drift_correction_value', self.drift_last)
-                        self.dc_last = dc
-            else:
-                self.drift_last = de # initialize to most recent reading
-                # TODO I needed to comment these to get the live code working, but if the units are scaled correctly, shouldn't be a problem
-                #self.drift_last = max(-.015, self.drift_last) # floor at 15ps
-                #self.drift_last = min(.015, self.drift_last)#
-                self.dc_last = dc
-                self.drift_initialized = True # will average next time (ugly)    
-
-            pc = pc - dg * self.drift_last; # fix phase control. 
+            self.update_drift()
+            dg = self.drift_gain = self.P.get('drift_correction_gain')
+            drift = self.drift_last
+            if self.drift_worker is not None and self.drift_applied is not None:
+                drift = self.drift_applied # the worker steps toward the rest
+            pc = pc - dg * drift; # fix phase control. 
 
         if self.P.config.use_secondary_calibration: # make small corrections based on another calibration
             sa = self.P.get('secondary_calibration_s')
             ca = self.P.get('secondary_calibration_c')
-            pc = pc - sa * np.sin(pc * 3.808*2*np.pi) - ca * np.cos(pc * 3.808*2*np.pi) # fix phase
+            pc = pc - sa * np.sin(pc * W_CORRECTION) - ca * np.cos(pc * W_CORRECTION) # fix phase
 
         if self.P.config.use_dither:
             dx = self.P.get('dither_level') 
@@ -235,10 +286,152 @@ class LaserLocker(LaserLocker):
         if self.P.get('enable_trig'): # Full routine when trigger can move
             if T.get_ns() != trig:   # need to move
                 T.set_ns(trig) # sets the trigger
+                self.last_trig = trig
 
         pc_diff = M.get_position() - pc  # difference between current phase motor and desired time        
         if abs(pc_diff) > 1e-6:
             M.move(pc) # moves the phase motor
+        if abs(pc_diff) > 1e-6 or self.last_pc is None: # or the phase was moved elsewhere since
+            self.last_pc = pc
+            self.last_move = time.time()
+        if self.P.config.use_drift_correction:
+            self.drift_applied = drift
+
+    def update_drift(self):
+        """ Read the timetool signal and feed it to the drift estimator."""
+        signal = self.P.get('drift_correction_signal')
+        self.drift_sample(signal, self.P.get_timestamp('drift_correction_signal'))
+
+    def drift_sample(self, signal, stamp):
+        """ Update the drift correction from a timetool reading.
+
+        Only a new sample (one whose timestamp changed, or, without
+        timestamps, its value) is fed to the drift estimator, and only then
+        are the drift correction pvs read; while accumulation is disabled, new
+        samples are passed over. A write to drift_correction_value from
+        outside, caught by its monitor (see on_drift_value), restarts the
+        estimate at the value written on the next call, sample or not.
+
+        Arguments:
+            signal : drift_correction_signal value
+            stamp : its IOC timestamp, None if unknown
+        """
+
+        with self.drift_lock:
+            dc = signal*1.0e-6 # TODO need to convert this to a configuration/control parameter
+            new = stamp != self.drift_stamp if stamp is not None else dc != self.dc_last
+            outside, self.drift_outside = self.drift_outside, None
+            if self.drift_initialized:
+                if outside is not None: # set from outside
+                    self.drift_last = self.drift.reset(outside)
+                elif not self.drift.initialized: # restored state
+                    self.drift_last = self.drift.reset(self.drift_last)
+                if not new:
+                    return
+            (do, ds, accum, self.drift_gain) = self.P.get_many(['drift_correction_offset',
+                'drift_correction_smoothing', 'drift_correction_accum', 'drift_correction_gain'])
+            # modified to not use drift_correction_offset or drift_correction_multiplier:
+            de  = (dc-do)  # (hopefully) fresh pix value from TT script
+            self.dc_last = dc
+            self.drift_stamp = stamp
+            if not self.drift_initialized:
+                self.drift_last = self.drift.reset(de, stamp) # initialize to most recent reading
+                self.drift_initialized = True # will average next time (ugly)
+                return
+            if accum != 1: # accumulation disabled
+                return
+            self.drift_last = self.drift.update(de, stamp, ds)
+            self.drift_written.append(self.drift_last)
+            self.P.put('drift_correction_value', self.drift_last)
+
+    def on_drift_value(self, value=None, **kw):
+        """ Monitor callback for drift_correction_value: note a value written
+        from outside, for drift_sample to restart the estimate at. The values
+        this locker wrote itself, including ones whose monitor events arrive
+        late, are recognized and ignored."""
+        if value is None:
+            return
+        for x in self.drift_written:
+            if abs(value - x) <= 1e-9:
+                return
+        self.drift_outside = value
+
+    def step_drift(self, max_step):
+        """ Move the phase by at most max_step toward the drift correction
+        that set_time has not yet applied, without waiting for the motor.
+
+        Called by the drift worker while it holds motor_lock.
+
+        Arguments:
+            max_step : largest phase step, ns
+
+        Returns (moved, outstanding): whether the phase was stepped, and
+        whether some correction is still left to apply.
+        """
+
+        if self.drift_applied is None or self.M is None: # set_time hasn't set a phase yet
+            return False, False
+        dg = self.drift_gain # read with the sample, no round trip here
+        error = -dg * (self.drift_last - self.drift_applied) # phase move still due
+        if abs(error) <= 1e-6: # as set_time, too small to move for
+            return False, False
+        step = max(-max_step, min(max_step, error))
+        M = self.M
+        self.P.put('phase_motor', (M.position + step) / M.scale)
+        M.position += step
+        self.last_pc = M.position
+        self.last_move = time.time()
+        self.drift_applied -= step / dg
+        return True, abs(error - step) > 1e-6
+
+    def start_drift_worker(self):
+        """ Start the drift correction worker, when the locker uses drift
+        correction and "drift_worker" is set in add_config. set_time then
+        folds in only the drift the worker has applied, and leaves the rest
+        to the worker's steps."""
+
+        add_config = self.P.config.config["add_config"]
+        if not self.P.config.use_drift_correction or not add_config.get("drift_worker", False):
+            return
+        if self.drift_worker is None:
+            self.drift_worker = DriftWorker(self, add_config.get("drift_worker_max_step", 0.0005),
+                add_config.get("drift_worker_interval", 0.1))
+            self.drift_worker.start()
+
+    def update_secondary_calibration(self):
+        """ Update the secondary calibration from the phase moves of normal operation.
+
+        Does nothing unless the locker uses secondary calibration and
+        "secondary_online" is set in add_config. Each secondary reading taken
+        at least secondary_online_settle seconds after the last phase move is
+        a sample of the error at that phase; the sine and cosine amplitudes
+        are followed by recursive least squares, and written to
+        secondary_calibration_s and _c whenever both are known to within
+        secondary_calib_tolerance. Readings taken while the phase stays put
+        cannot separate the amplitudes, so nothing is written until the
+        normal moves have spread the phase.
+        """
+
+        add_config = self.P.config.config["add_config"]
+        if not self.P.config.use_secondary_calibration or not add_config.get("secondary_online", False):
+            return
+        if self.last_pc is None or time.time() - self.last_move < add_config.get("secondary_online_settle", 30.0):
+            return
+        if self.secondary is None:
+            self.secondary = RecursiveSineFit(add_config.get("secondary_online_forgetting", 0.999))
+        tr = 1e9 * self.P.get('secondary_calibration')
+        stamp = self.P.get_timestamp('secondary_calibration')
+        if stamp is None or stamp == self.secondary_stamp:
+            return # not a new reading
+        self.secondary_stamp = stamp
+        t = self.P.get('time')
+        if t != self.secondary_time: # a new target moves the constant, not the amplitudes
+            self.secondary.reset_offset()
+            self.secondary_time = t
+        self.secondary.update(self.last_pc, tr)
+        if self.secondary.converged(add_config.get("secondary_calib_tolerance", 0.002)):
+            sa, ca = self.secondary.param
+            self.P.put_many({'secondary_calibration_s':sa, 'secondary_calibration_c':ca})
 
     def calibrate(self,report=True):
         """ Sweep fine resolution laser phase to detect the edges of timing system triggers.
@@ -254,53 +447,36 @@ class LaserLocker(LaserLocker):
             report : boolean indicating whether the results of the calibration should be reported
         """
         
-        M = PhaseMotor(self.P)  # creates a phase motor control object (PVs were initialized earlier)
-        T = Trigger(self.P)  # trigger class
-        ns = 10000 # number of different times to try for fit - INEFFICIENT - should do Newton's method but too lazy
+        M = self.motor()  # the locker's phase motor control object (PVs were initialized earlier)
+        T = self.T  # trigger class
+        ns = 10000 # number of different times to try for fit
+        add_config = self.P.config.config["add_config"]
+        settle = add_config.get("calib_settle", 1.0)
         self.P.put('busy', 1) # set busy flag
-        tctrl = np.linspace(0, self.calib_range, self.calib_points) # control values to use
-        tout = np.array([]) # array to hold measured time data
-        counter_good = np.array([]) # array to hold array of errors
+        self.last_pc = None # the phase leaves what set_time commanded
         t_trig = T.get_ns() # trigger time in nanoseconds
         M.move(0)  # move to zero to start 
         M.wait_for_stop()
-        for x in tctrl:  #loop over input array 
-            print('calib start')
-
-            self.W.check() # check watchdog
-            print('post watchdog')
-
-            if self.W.error:
-                return    
-            if not self.P.get('calibrate'):
-                return   # canceled calibration
-            print('move motor')
-
-            M.move(x)  # move motor
-            print('wait for stop')
-
-            M.wait_for_stop()
-            print('sleep')
-
-            time.sleep(1.0)  #Don't know why this is needed
-            t_tmp = 0 # to check if we ever get a good reading
-            print('get read')
-
-            for n in range (0, 25): # try to see if we can get a good reading
-                 t_tmp = self.C.get_time()  # read time
-                 if t_tmp != 0: # have a new reading
-                     break # break out of loop
-            tout = np.append(tout, t_tmp) # read timing and put in array
-            print('end of loop')
-
-            print(t_tmp)
-            print(self.C.good)
-            #pdb.set_trace()
-            counter_good = np.append(counter_good, self.C.good) # will use to filter data
-            if not self.C.good:
-                print('bad counter data')
-
-                self.E.write_error({'value':'timer error, bad data - continuing to calibrate','lvl':2} ) # just for testing
+        executor = self.calib_executor(M)
+        if add_config.get("calib_adaptive", False):
+            sweep = adaptive_sweep(lambda x: self.calib_point(M, x, settle, executor), self.calib_range, 1/self.laser_f,
+                add_config.get("calib_coarse_points", 8), add_config.get("calib_tolerance", 0.05), self.calib_points)
+            if sweep is None:
+                return # watchdog stopped or calibration canceled
+            tctrl, tout, counter_good, width = sweep
+            self.P.E.write_error({'value':'Calibration: %d points, edge within %.3f ns'%(len(tctrl), width),'lvl':2})
+        else:
+            tctrl = np.linspace(0, self.calib_range, self.calib_points) # control values to use
+            tout = np.array([]) # array to hold measured time data
+            counter_good = np.array([]) # array to hold array of errors
+            for x in tctrl:  #loop over input array 
+                point = self.calib_point(M, x, settle, executor)
+                if point is None:
+                    return # watchdog stopped or calibration canceled
+                tout = np.append(tout, point[0]) # read timing and put in array
+                counter_good = np.append(counter_good, point[1]) # will use to filter data
+        if executor is not None:
+            self.P.E.write_error({'value':executor.report(settle),'lvl':2})
         M.move(tctrl[0])  # return to original position    
         minv = min(tout[np.nonzero(counter_good)])+ self.delay_offset
 
@@ -309,23 +485,17 @@ class LaserLocker(LaserLocker):
         print(minv)
         period = 1/self.laser_f # just defining things needed in sawtooth -  UGLY
         delay = minv - t_trig # more code cleanup neded in teh future.
-        err = np.array([]) # will hold array of errors
-        offset = np.linspace(0, period, ns)  # array of offsets to try
-        for x in offset:  # here we blindly try different offsets to see what works
-            S = Sawtooth(tctrl, t_trig, delay, x, period) # sawtooth sim
-            err = np.append(err, sum(counter_good*S.r * (S.t - tout)**2))  # total error
-        idx = np.argmin(err) # index of minimum of error
+        offset, err = fit_offset(tctrl, tout, counter_good, t_trig, delay, period, ns,
+            refine=self.P.config.config["add_config"].get("calib_refine_points", 0))
         print('offset, delay  trig_time')
 
-        print(offset[idx])
+        print(offset)
         print(delay)
         print(t_trig)
-        S = Sawtooth(tctrl, t_trig, delay, offset[idx], period)
-        self.P.put('calib_error', np.sqrt(err[idx]/ self.calib_points))
+        S = Sawtooth(tctrl, t_trig, delay, offset, period)
         self.d['delay'] = delay
-        self.d['offset'] = offset[idx]
-        self.P.put('delay', delay)
-        self.P.put('offset', offset[idx])
+        self.d['offset'] = offset
+        self.P.put_many({'calib_error':np.sqrt(err/ len(tctrl)), 'delay':delay, 'offset':offset})
         #print('PLOTTING CALIBRATION')
 
         #plot(tctrl, tout, 'bx', tctrl, S.r * S.t, 'r-') # plot to compare
@@ -335,6 +505,56 @@ class LaserLocker(LaserLocker):
         M.wait_for_stop() # wait for motor to stop moving before exit
         self.P.put('busy', 0)
 
+    def calib_point(self, M, x, settle=1.0, executor=None):
+        """ Move the phase and read the counter for one calibration point.
+
+        Arguments:
+            M : phase motor
+            x : phase control value
+            settle : seconds to wait after the move before reading
+            executor : CalibrationExecutor taking the point, if pipelined
+
+        Returns (time, good), or None if the watchdog has stopped the locker
+        or the calibration was canceled.
+        """
+
+        print('calib start')
+
+        self.W.check() # check watchdog
+        print('post watchdog')
+
+        if self.W.error:
+            return None
+        if not self.P.get('calibrate'):
+            return None  # canceled calibration
+        if executor is not None:
+            return executor.measure(x)
+        print('move motor')
+
+        M.move(x)  # move motor
+        print('wait for stop')
+
+        M.wait_for_stop()
+        print('sleep')
+
+        time.sleep(settle)  #Don't know why this is needed
+        t_tmp = 0 # to check if we ever get a good reading
+        print('get read')
+
+        for n in range (0, 25): # try to see if we can get a good reading
+             t_tmp = self.C.get_time()  # read time
+             if t_tmp != 0: # have a new reading
+                 break # break out of loop
+        print('end of loop')
+
+        print(t_tmp)
+        print(self.C.good)
+        if not self.C.good:
+            print('bad counter data')
+
+            self.E.write_error({'value':'timer error, bad data - continuing to calibrate','lvl':2} ) # just for testing
+        return t_tmp, self.C.good
+
     def second_calibrate(self):
         """ Secondary Calibration function
         
@@ -345,42 +565,32 @@ class LaserLocker(LaserLocker):
 
         print('starting second calibration - new test')
 
-        M = PhaseMotor(self.P)  # create phase motor object
-        ptime = 30 # seconds between cycles
+        M = self.motor()  # phase motor object
+        self.last_pc = None # the phase leaves what set_time commanded
+        add_config = self.P.config.config["add_config"]
+        ptime = add_config.get("secondary_calib_wait", 30) # seconds between cycles
+        tolerance = add_config.get("secondary_calib_tolerance", 0.002) # ns, 95% interval on each amplitude
         tneg = 0.5 # nanoseconds range below current  -2 ok
         tpos = -0.5 # nanoseconds range above current 12 ok
         cycles = 30
         t0 = M.get_position() # current motor position
-        tset = np.array([]) # holds target times
-        tread = np.array([]) # holds readback times
+        F = SineFit(cycles - 1) # refit after each cycle
         for n in range(0,cycles-1):  # loop
             t = t0 + tneg + np.random.random()*(tpos - tneg) # random number in range
-            tset = np.append(tset, t)  # collect list of times
             M.move(t) # move to new position
             time.sleep(ptime)# long wait for now
             tr = 1e9 * self.P.get('secondary_calibration')
-            tread = np.append(tread, tr)
+            F.add(t, tr)
             print(n)
             print(t)
             print(tr)
+            if F.converged(tolerance):
+                break
         M.move(t0) # put motor back    
         print('done motor move')
-        sa = 0.01;
-        ca = 0.01;
-        param0 = sa,ca
-        tdiff = tread - tset - (np.mean(tread-tset))
-        print('start leastsq')
-
-        fout = np.leastsq(np.fitres, param0, args=(tset, tdiff))    
-        print('end leastsq, param =')
-
-        param = fout[0];
-        print(param)
-        sa,ca = param
-        ttest = np.array([])
-        for nx in range(0,200):
-            ttest = np.append(ttest, t0 + tneg + (nx/200.0)*(tpos-tneg))
-        #fitout = ffun(ttest, sa, ca)
+        sa,ca = F.param
+        self.P.E.write_error({'value':'Secondary calibration: %d cycles, s %.4f +/- %.4f, c %.4f +/- %.4f, rms %.4f ns'%(
+            F.n, sa, F.halfwidth[0], ca, F.halfwidth[1], F.rms),'lvl':2})
         self.P.put('secondary_calibration_s', sa)
         self.P.put('secondary_calibration_c', ca)
         #print('PLOTTING SECONDARY CALIBRATION')
@@ -4,12 +4,9 @@ primarily Amplitude Tangerine lasers running ATCA hardware.
 
 import time
 import math
-import pdb
 from collections import *
 
 import numpy as np
-from scipy import optimize
-import scipy
 
 from support.laserlockerversions.LaserLocker import LaserLocker
 from ..tic.TimeIntervalCounter import TimeIntervalCounter
@@ -22,16 +19,51 @@ def err(inputs,x,times,trig):
     """ Error function for fitting.
     
     Arguments:
-        inputs : effectively a lambda function argument
-        x : array index data
-        times : 
-        trig :
+        inputs : effectively a lambda function argument, (delay, offset, period)
+        x : array index data, the phase control values
+        times : measured times
+        trig : trigger time
     """
 
     S = Sawtooth(x,trig,inputs[0],inputs[1],inputs[2])
     res = sum((S.t - times)**2.0)
     return res
 
+def fit_sawtooth(x, times, trig, period):
+    """ Fit delay, offset and period of the sawtooth to a calibration sweep.
+
+    The seed is computed directly from the data. Along the sweep the measured
+    time less the phase drops by a period at each edge, which numbers the
+    pulse each point belongs to; offset and period then follow by linear
+    least squares, and the delay centres the edges between the points
+    either side of them. err() is then minimized from the seed with Nelder-Mead.
+
+    Arguments:
+        x : phase control values of the good points, in sweep order
+        times : measured times of the good points
+        trig : trigger time
+        period : nominal laser period
+
+    Returns (delay, offset, period, rms residual).
+    """
+
+    from scipy.optimize import minimize
+    u = times - x
+    drops = -np.diff(u) > period / 2.0 # an edge between these points and the next
+    n = np.sum(drops) - np.concatenate([[0], np.cumsum(drops)])
+    if np.any(drops):
+        offset, period = np.linalg.lstsq(np.column_stack([np.ones(len(x)), n]), u, rcond=None)[0]
+    else:
+        offset = np.mean(u) # no edge in the sweep, keep the nominal period
+    # the pulse of each point bounds the last edge to (x + (n-1)*period, x + n*period]
+    edge = (max(x + (n - 1) * period) + min(x + n * period)) / 2.0
+    seed = np.array([edge + offset - trig, offset, period])
+    simplex = [seed, seed + [period / 100.0, 0, 0], seed + [0, period / 1000.0, 0], seed + [0, 0, period / 10000.0]]
+    fit = minimize(err, seed, args=(x, times, trig), method='Nelder-Mead',
+        options={'initial_simplex' : simplex, 'xatol' : period * 1e-7, 'fatol' : 1e-9})
+    delay, offset, period = fit.x
+    return delay, offset, period, np.sqrt(fit.fun / len(x))
+
 class LaserLocker(LaserLocker):
     """Gen 2 Laser locker object, inheriting from generalized LaserLocker object."""
     def __init__(self,errorLog,pvs,watchdog):
@@ -46,7 +78,6 @@ class LaserLocker(LaserLocker):
         self.locking_f = self.laser_f
         self.trigger_n = self.rmin / 4.0  # trigger frequency rati
         self.trigger_f = 1.0
-        self.calib_points = 120  # number of points to use in calibration cycle
         self.calib_range = 1200  # nanoseconds for calibration sweep, 1.4x PulsePicker period
         self.jump_tol = 0.150  # nanoseconds error to be considered a phase jump
         self.max_jump_error = 22.0 # nanoseconds too large to be a phase jump
@@ -56,7 +87,7 @@ class LaserLocker(LaserLocker):
         self.max_time = 20000.0 # maximum time that can be set (ns)
         self.locker_file_name = 'locker_data_' + self.P.name + '.pkl'
         self.timing_buffer = 0.0  # nanoseconds, how close to edge we can go in ns
-        T = Trigger(self.P)
+        T = self.T
         self.initTPR = T.get_ns()
         self.d = dict()
         self.d['delay'] =  self.P.get('delay')
@@ -77,28 +108,26 @@ class LaserLocker(LaserLocker):
         self.setpoint_ok = 1
         self.lock_ok = 1
         self.message = 'OK' # output error message, OK means no trouble found    
-        rfpwr = self.P.get('rf_pwr')  # check RF level
-        rfpwrhihi = self.P.get('rf_pwr_hihi')
-        rfpwrlolo = self.P.get('rf_pwr_lolo')
+        (rfpwr, rfpwrhihi, rfpwrlolo, dpwr, dpwrhihi, dpwrlolo, freqsp, oscf,
+            locked) = self.P.get_many(['rf_pwr', 'rf_pwr_hihi', 'rf_pwr_lolo',
+            'diode_pwr', 'diode_pwr_hihi', 'diode_pwr_lolo', 'freq_sp',
+            'oscillator_f', 'laser_locked']) # one round trip for all status pvs
         if (rfpwr > rfpwrhihi) | (rfpwr < rfpwrlolo):
             self.message = 'RF power out of range\n'
             self.laser_ok = 0
             self.rf_ok = 0
 
-        dpwr = self.P.get('diode_pwr') # check diode level
-        dpwrhihi = self.P.get('diode_pwr_hihi')
-        dpwrlolo = self.P.get('diode_pwr_lolo')
         if (dpwr > dpwrhihi) | (dpwr < dpwrlolo):
             self.message = 'diode power out of range\n'
             self.laser_ok = 0
             self.rf_diode_ok = 0
         
-        if abs(self.P.get('freq_sp') - self.P.get('oscillator_f')) > self.max_frequency_error:  # oscillator set point wrong
+        if abs(freqsp - oscf) > self.max_frequency_error:  # oscillator set point wrong
             self.laser_ok = 0
             self.frequency_ok = 0
             self.frequency_ok = 0
             self.message = 'frequency set point out of range\n'
-        if not self.P.get('laser_locked'):
+        if not locked:
             self.message = 'laser not indicating locked\n'
             self.lock_ok = 0
             self.laser_ok = 0
@@ -114,7 +143,7 @@ class LaserLocker(LaserLocker):
         This function is the core move command for the laser locker, used by higher level functions.
         """
         #pdb.set_trace()
-        targetTime = self.P.get('time') # FS_TGT_TIME
+        targetTime, t_high, t_low = self.P.get_many(['time', 'time_hihi', 'time_lolo']) # FS_TGT_TIME
         if math.isnan(targetTime):
             # A holdover from the matlab days, in for backwards compat.
             self.P.E.write_error({"value":'desired time is NaN',"lvl":2})
@@ -122,10 +151,8 @@ class LaserLocker(LaserLocker):
         if targetTime < self.min_time or targetTime > self.max_time:
             self.P.E.write_error({"value":'need to move TIC trigger',"lvl":2})
             return
-        t_high = self.P.get('time_hihi')
-        t_low = self.P.get('time_lolo')
-        T = Trigger(self.P) # set up trigger
-        M = PhaseMotor(self.P)
+        T = self.T # set up trigger
+        M = self.motor()
         laser_tdes = targetTime - self.d['delay']-100.0 # might need to be + delay
         nlaser = np.floor(targetTime/self.ppPeriod) # chop off the nanoseconds first
         pc = self.wrapOscillator(targetTime - self.d['offset'])
@@ -135,6 +162,7 @@ class LaserLocker(LaserLocker):
       
         if self.P.get('enable_trig'): # Full routine when trigger can move
             T.set_ns(laser_tdes)
+            self.last_trig = laser_tdes
             self.P.E.write_error({'value':"moving Trigger: %f"%(laser_tdes),"lvl":2})
 
         pc_diff = M.get_position() - pc  # difference between current phase motor and desired time        
@@ -142,6 +170,7 @@ class LaserLocker(LaserLocker):
             self.P.E.write_error({'value':"proposed phase: %f"%(pc),"lvl":2})
             print("proposed phase: %f"%(pc))
             M.move(pc) # moves the phase motor
+            self.last_pc = pc
 
     def calibrate(self,report=True):
         """ Sweep fine resolution laser phase to detect the edges of pulse
@@ -153,53 +182,86 @@ class LaserLocker(LaserLocker):
             report : boolean to control whether output from calibration is presented
         """
 
-        #pdb.set_trace()
-        eventSystem = EventSystem()
+        eventSystem = EventSystem(self.P.config.backend)
         accStatusCheck = eventSystem.validate()
         if not accStatusCheck:
             self.P.E.write_error({"value":'Calibration: Machine Invalid',"lvl":2})
             self.P.put('find_beam_ctl',-1)
             return
         self.P.E.write_error({"value":'Calibration: Machine config valid; increasing TWID',"lvl":2})
-        M = PhaseMotor(self.P)  # phase motor reference
-        T = Trigger(self.P)  # trigger config reference
+        M = self.motor()  # phase motor reference
+        T = self.T  # trigger config reference
         T.set_width(1200)
-        ns = 10000 # number of different times to try for fit - INEFFICIENT - should do Newton's method but too lazy
+        add_config = self.P.config.config["add_config"]
+        points = add_config.get("calib_sweep_points", 16) # a short sweep is enough for the fit
+        settle = add_config.get("calib_settle", 0.5) # seconds after each move before reading
         self.P.put('busy', 1) # set busy flag
-        tctrl = np.linspace(0, self.calib_range, self.calib_points) # control values to use
-        tout = np.array([]) # array to hold measured time data
-        counter_good = np.array([]) # array to hold array of errors
+        tctrl = np.linspace(0, self.calib_range, points) # control values to use
+        tout = np.zeros(points) # measured times
+        counter_good = np.zeros(points) # 1 where the reading is good
         t_trig = T.get_ns() # trigger time in nanoseconds
-        M.move(0)  # 1. move to zero to start 
-        stability_wait = deque([],4)
-        print(self.C.get_time())
-        stability_wait.append(self.C.get_time())
-        time.sleep(2.0)
-        stable_pass = False
-        while not stable_pass:
-            t_check = self.C.get_time()
-            stab_mean = np.average(stability_wait) # boxcar average by virtue of deque
-            print("%f,%f"%(stab_mean,stability_wait[0]))
-            if (stab_mean -t_check)/stab_mean <= 0.1: # hand-wave value for now
-                stable_pass = True
-            stability_wait.append(t_check)
-            time.sleep(2.0)
+        executor = self.calib_executor(M)
+        for n, x in enumerate(tctrl):
+            self.W.check() # check watchdog
+            if self.W.error or not self.P.get('calibrate'):
+                T.set_width(400)
+                self.P.put('busy', 0)
+                return # watchdog stopped or calibration canceled
+            if executor is not None:
+                tout[n], counter_good[n] = executor.measure(x)
+                continue
+            M.move(x)
+            M.wait_for_stop()
+            time.sleep(settle)
+            for k in range(25): # try to get a new good reading
+                tout[n] = self.C.get_time()
+                if tout[n] != 0:
+                    break
+                time.sleep(0.1)
+            counter_good[n] = self.C.good
+        if executor is not None:
+            self.P.E.write_error({"value":executor.report(settle),"lvl":2})
+        M.move(tctrl[0])  # return to original position
+        good = np.nonzero(counter_good)[0]
+        if len(good) < 4:
+            self.P.E.write_error({"value":'Calibration: too few good counter readings (%d)'%(len(good)),"lvl":1})
+            T.set_width(400)
+            self.P.put('busy', 0)
+            return
+        self.d['delay'], self.d['offset'], period, rms = self.fit_calibration(tctrl[good], tout[good], t_trig)
+        self.P.put_many({'calib_error':rms, 'delay':self.d['delay'], 'offset':self.d['offset']})
+        if report:
+            self.P.E.write_error({"value":'Calibration: %d of %d points, rms residual %.4f ns, period %.4f ns (nominal %.4f)'%(
+                len(good), points, rms, period, 1/self.laser_f),"lvl":2})
         M.wait_for_stop()
-        time_ZeroPhi_afterTrig = self.C.get_time()
-        delay_val = time_ZeroPhi_afterTrig - T.get_ns()
-        # pdb.set_trace()
-        self.d['delay'] = delay_val
-        self.P.put('delay', delay_val)
-        self.d['offset'] = time_ZeroPhi_afterTrig
-        self.P.put('offset', time_ZeroPhi_afterTrig)
         T.set_width(400)
+        self.P.put('busy', 0)
+
+    def fit_calibration(self, tctrl, tout, t_trig):
+        """ Fit a calibration sweep.
+
+        The sweep is in phase motor units, and the laser phase moves
+        phasescale times as far (see set_time). delay and offset keep their
+        Gen 2 meaning, from the counter time at zero phase.
+
+        Arguments:
+            tctrl : phase motor positions of the good points, in sweep order
+            tout : measured times of the good points
+            t_trig : trigger time
+
+        Returns (delay, offset, period, rms residual).
+        """
+
+        delay, offset, period, rms = fit_sawtooth(tctrl * self.phasescale, tout, t_trig, 1/self.laser_f)
+        time_ZeroPhi_afterTrig = Sawtooth(0.0, t_trig, delay, offset, period).t
+        return time_ZeroPhi_afterTrig - t_trig, time_ZeroPhi_afterTrig, period, rms
 
     def check_jump(self):
         """ Gen 2 implementation of bucket jump detection."""
         self.P.E.write_error({'value':'jump detect',"lvl":2})
-        T = Trigger(self.P) # trigger class
+        T = self.T # trigger class
         self.P.E.write_error({'value':'setup phase motor',"lvl":2})
-        M = PhaseMotor(self.P) # phase motor
+        M = self.motor() # phase motor
         self.P.E.write_error({'value':'counter time',"lvl":2})  
         t = self.C.get_time()
         if t > -900000.0:      
@@ -260,7 +322,7 @@ class LaserLocker(LaserLocker):
         #     return
         self.P.E.write_error({'value':"Fixing Jump...","lvl":2})
         # print('fixing jump')
-        M = PhaseMotor(self.P) #phase control motor
+        M = self.motor() #phase control motor
         M.wait_for_stop()  # just ot be sure
         old_pc = M.get_position()
         new_pc = old_pc - self.exact_error # new time for phase control
@@ -275,7 +337,8 @@ class LaserLocker(LaserLocker):
         new_offset = self.d['offset'] - (wrapped_pc - old_pc)
         self.d['offset'] = new_offset
         self.P.put('offset', new_offset)
-        T = Trigger(self.P) # set up trigger
+        self.P.flush() # offset must land before the correction count moves
+        T = self.T # set up trigger
         t = T.get_ns()
         laser_t = t - self.d['offset'] - self.d['delay'] - 64.0
         T.set_ns(laser_t)
@@ -343,12 +406,12 @@ class LaserLocker(LaserLocker):
         """
 
         beamFindState = self.P.get("find_beam_ctl")
-        T = Trigger(self.P)
+        T = self.T
         if beamFindState == 1:
             self.P.E.write_error({"value":'Beam Find Requested...',"lvl":2})
             self.P.put("find_beam_ctl",1)
             #Check logic conditions for whether proceeding is okay
-            eventSystem = EventSystem()
+            eventSystem = EventSystem(self.P.config.backend)
             accStatusCheck = eventSystem.validate()
             if not accStatusCheck:
                 self.P.E.write_error({"value":'Beam Find: Machine Invalid',"lvl":2})
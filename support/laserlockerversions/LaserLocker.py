@@ -1,5 +1,18 @@
+import os
+import pickle
+import threading
+import time
+
 from ..tic.TimeIntervalCounter import TimeIntervalCounter
 from ..tic.Keysight import Keysight
+from ..Trigger import Trigger
+from ..PhaseMotor import PhaseMotor
+from ..CalibrationExecutor import CalibrationExecutor
+
+STATE_VERSION = 1 # bump when the layout of the persisted state changes
+# runtime attributes carried over a restart, where the generation defines them
+STATE_ATTRIBUTES = ['drift_last', 'dc_last', 'drift_initialized', 'terror',
+    'buckets', 'bucket_error', 'exact_error', 'last_pc', 'last_trig']
 
 class LaserLocker(object):
     """Generalized LaserLocker class. Hardware-specific implementations inherit
@@ -16,8 +29,160 @@ class LaserLocker(object):
         self.E = errorLog
         self.P = pvs
         self.W = watchdog
+        self.last_pc = None # last commanded phase control, ns
+        self.last_trig = None # last commanded trigger, ns
+        self.state_saved = 0.0 # time the runtime state was last persisted
+        self.T = Trigger(self.P) # long lived trigger, get_ns() always reads the pv
+        self.M = None # long lived phase motor, created on first use (see motor())
+        self.motor_lock = threading.RLock() # held by whoever is commanding the phase motor
+        self.drift_worker = None # drift correction worker thread, when running
         pass
+
+    def motor(self, refresh=False):
+        """ Return the locker's phase motor.
+
+        The motor object is created once and tracks the position the HLA
+        requests, so later calls cost no channel access. get_position()
+        re-reads the setpoint anyway, which is where a move from outside the
+        HLA is picked up.
+
+        Arguments:
+            refresh : re-read the setpoint now (one get, no wait for the motor)
+        """
+
+        if self.M is None:
+            self.M = PhaseMotor(self.P)
+        elif refresh:
+            self.M.refresh()
+        return self.M
+
+    def get_state(self):
+        """ Return the runtime state worth carrying over a restart.
+
+        This is the counter history, drift correction state, bucket history
+        and last commands; calibration results are re-read from their pvs.
+        """
+
+        state = {}
+        for k in STATE_ATTRIBUTES:
+            if hasattr(self, k):
+                state[k] = getattr(self, k)
+        C = getattr(self, 'C', None)
+        for k in ['rt', 'rj']: # counter time and jitter rings
+            r = getattr(C, k, None)
+            if r is not None:
+                state[k] = (r.a.copy(), r.ptr, r.full)
+        return state
+
+    def set_state(self, state):
+        """ Apply runtime state returned by get_state.
+
+        Arguments:
+            state : dictionary from get_state
+        """
+
+        for k in STATE_ATTRIBUTES:
+            if k in state:
+                setattr(self, k, state[k])
+        C = getattr(self, 'C', None)
+        for k in ['rt', 'rj']:
+            r = getattr(C, k, None)
+            if r is not None and k in state and len(state[k][0]) == r.sz:
+                r.a, r.ptr, r.full = state[k]
+
+    def save_state(self, force=False):
+        """ Persist the runtime state to locker_file_name, at a bounded rate.
+
+        Does nothing unless "warm_restart" is set in add_config. The file is
+        replaced atomically, so a crash mid-write leaves the previous state.
+
+        Arguments:
+            force : write even if the last write was recent
+        """
+
+        add_config = self.P.config.config["add_config"]
+        if not add_config.get("warm_restart", False):
+            return
+        now = time.time()
+        if not force and now - self.state_saved < add_config.get("state_save_interval", 10.0):
+            return
+        self.state_saved = now
+        fname = self.state_file_name()
+        try:
+            with open(fname + '.tmp', 'wb') as fp:
+                pickle.dump({'version':STATE_VERSION, 'name':self.P.name, 'time':now,
+                    'state':self.get_state()}, fp)
+            os.replace(fname + '.tmp', fname)
+        except Exception as e:
+            self.E.write_error({'value':'could not save locker state: %s'%(e),'lvl':2})
+
+    def restore_state(self):
+        """ Restore persisted runtime state if it is recent enough.
+
+        Does nothing unless "warm_restart" is set in add_config. State older
+        than "state_max_age" seconds, or written for another locker or by an
+        incompatible version, is ignored.
+
+        Returns the age of the restored state in seconds, or None.
+        """
+
+        add_config = self.P.config.config["add_config"]
+        if not add_config.get("warm_restart", False):
+            return None
+        fname = self.state_file_name()
+        if not os.path.exists(fname):
+            return None
+        try:
+            with open(fname, 'rb') as fp:
+                saved = pickle.load(fp)
+        except Exception as e:
+            self.E.write_error({'value':'could not read locker state: %s'%(e),'lvl':2})
+            return None
+        age = time.time() - saved.get('time', 0)
+        if saved.get('version') != STATE_VERSION or saved.get('name') != self.P.name:
+            return None
+        if age > add_config.get("state_max_age", 300.0) or age < 0:
+            return None
+        self.set_state(saved['state'])
+        self.E.write_error({'value':'restored locker state from %.0f s ago'%(age),'lvl':2})
+        return age
+
+    def state_file_name(self):
+        """ Return the path of the persisted state file."""
+        add_config = self.P.config.config["add_config"]
+        return os.path.join(add_config.get("state_dir", ""), self.locker_file_name)
     
+    def calib_executor(self, M):
+        """ Return a CalibrationExecutor for a sweep, or None to sweep sequentially.
+
+        Only with "calib_pipelined" set in add_config.
+
+        Arguments:
+            M : phase motor used for the sweep
+        """
+
+        add_config = self.P.config.config["add_config"]
+        if not add_config.get("calib_pipelined", False):
+            return None
+        return CalibrationExecutor(self.P, M, self.C, add_config.get("calib_margin", 0.2),
+            add_config.get("calib_point_timeout", 10.0))
+
+    def update_secondary_calibration(self):
+        """ Feed the online secondary calibration estimator. Implemented by
+        lockers that apply a secondary calibration; a no-op otherwise."""
+        pass
+
+    def start_drift_worker(self):
+        """ Start a worker thread applying drift correction as samples arrive.
+        Implemented by lockers that apply drift correction; a no-op otherwise."""
+        pass
+
+    def stop_drift_worker(self):
+        """ Stop the drift correction worker, if one is running."""
+        if self.drift_worker is not None:
+            self.drift_worker.stop(timeout=5.0)
+            self.drift_worker = None
+
     def Calibrate(self,report=False):
         """Calibrate a laser locker to determine the relationship between the
         oscillator phase and the coarse event timing. If report is True,
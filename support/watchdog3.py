@@ -2,18 +2,18 @@
 
 This is a convenience function implementing a watchdog timer with indirect loop
 control via inspection of provided PVs. This is used throughout the fstiming
-codebase. This tool is not currently asynchronous.
+codebase. check() may be called from more than one thread (eg. the asyncio
+heartbeat and a calibration in progress), so it is serialized by a lock.
 
 Dependencies:
-- pyepics
+- a pv object from the configured pv backend (pyepics by default)
 
 Justin May
 """
 
+import threading
 import time  #includes sleep command to wait for other users
 
-import epics
-
 class watchdog():
     """ Watchdog object to monitor code execution."""
     def __init__(self, pv):
@@ -28,6 +28,7 @@ class watchdog():
 
         self.pv = pv
         self.counter = 0;
+        self.lock = threading.Lock() # one read-compare-increment at a time
         try:
             self.pv.get( timeout=1.0)
             self.value = self.pv.value
@@ -61,7 +62,12 @@ class watchdog():
         control state for requesting a graceful termination of the process, is
         handled externally in femto.py.
         """
-        
+
+        with self.lock:
+            self._check()
+
+    def _check(self):
+        """ Body of check(), run with the lock held."""
         try:
             self.pv.get(timeout=1.0)
         except:
@@ -78,4 +84,5 @@ class watchdog():
             return
         self.error = 0
         self.value = self.pv.value+1
-        self.pv.put(value = self.value, timeout=1.0) # write new number to increment
+        # wait for the write, so the next check, from whichever thread, reads it back
+        self.pv.put(value = self.value, wait=True, timeout=1.0) # write new number to increment
@@ -0,0 +1,229 @@
+"""Calibration fit tests
+
+Run directly to benchmark the offset search against the original loop.
+"""
+
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from support.CalibrationExecutor import CalibrationExecutor
+from support.PVS import PVS
+from support.PhaseMotor import PhaseMotor
+from support.Sawtooth import Sawtooth, fit_offset
+from support.SecondaryCalibration import SineFit, RecursiveSineFit, W_CORRECTION, ffun
+from support.tic.TimeIntervalCounter import TimeIntervalCounter
+from support.watchdog3 import watchdog
+from support.laserlockerversions.Gen1LaserLocker import adaptive_sweep
+from support.laserlockerversions.Gen2LaserLocker import fit_sawtooth, LaserLocker as Gen2LaserLocker
+from simbackend_test import write_sim_config
+
+def loop_fit_offset(tctrl, tout, counter_good, t_trig, delay, period, ns=10000):
+    """ The offset search as calibrate originally did it, one Sawtooth per offset."""
+    err = np.array([])
+    offset = np.linspace(0, period, ns)
+    for x in offset:
+        S = Sawtooth(tctrl, t_trig, delay, x, period)
+        err = np.append(err, sum(counter_good*S.r * (S.t - tout)**2))
+    idx = np.argmin(err)
+    return offset[idx], err[idx]
+
+def sweep(seed=0, points=50):
+    """ Return a simulated calibration sweep and its (t_trig, delay, period)."""
+    rng = np.random.RandomState(seed)
+    period = 1/68e6
+    t_trig = 1e-6
+    delay = 5e-9
+    tctrl = np.linspace(0, 1e-6, points)
+    S = Sawtooth(tctrl, t_trig, delay, 0.37*period, period)
+    tout = S.t + 2e-12*rng.randn(points)
+    counter_good = np.ones(points)
+    counter_good[rng.randint(points)] = 0
+    return tctrl, tout, counter_good, t_trig, delay, period
+
+class test_fitOffset(unittest.TestCase):
+    def test_matches_loop(self):
+        for seed in range(3):
+            args = sweep(seed)
+            offset, err = fit_offset(*args)
+            loop_offset, loop_err = loop_fit_offset(*args)
+            self.assertEqual(offset, loop_offset)
+            self.assertAlmostEqual(err / loop_err, 1.0, places=9)
+
+    def test_chunk_size(self):
+        args = sweep()
+        self.assertEqual(fit_offset(*args, chunk=7), fit_offset(*args))
+
+    def test_refine(self):
+        args = sweep()
+        offset, err = fit_offset(*args)
+        fine_offset, fine_err = fit_offset(*args, refine=200)
+        self.assertLessEqual(fine_err, err)
+        self.assertLessEqual(abs(fine_offset - offset), args[-1] / 9999)
+
+class test_adaptiveSweep(unittest.TestCase):
+    def test_finds_edges(self):
+        rng = np.random.RandomState(2)
+        period = 1/(0.476/56*8) # Gen 1 laser period, ns
+        t_trig = 1000.0
+        for delay, offset in [(3.0, 2.0), (11.0, 9.5), (17.5, 14.0)]:
+            def measure(x):
+                return Sawtooth(x, t_trig, delay, offset, period).t + 0.002*rng.randn(), 1
+            x, tout, good, width = adaptive_sweep(measure, 30, period)
+            self.assertLess(len(x), 50)
+            self.assertLessEqual(width, 0.05)
+            self.assertAlmostEqual(min(tout) - t_trig, delay, delta=0.05)
+            fit, e = fit_offset(x, tout, good, t_trig, min(tout) - t_trig, period)
+            self.assertAlmostEqual(np.mod(fit - offset + period/2, period), period/2, delta=0.01)
+
+    def test_abandoned(self):
+        self.assertIsNone(adaptive_sweep(lambda x: None, 30, 14.7))
+
+class test_fitSawtooth(unittest.TestCase):
+    def test_recovers_sweep(self):
+        rng = np.random.RandomState(1)
+        nominal = 1/(1.3/196*7/50) # Gen 2 laser period, ns
+        period = nominal * 1.0002
+        t_trig = 800000.0
+        tctrl = np.linspace(0, 1200, 16)
+        for delay, offset in [(40.0, 300.0), (-120.0, 10.0), (500.0, 1000.0)]:
+            S = Sawtooth(tctrl, t_trig, delay, offset, period)
+            tout = S.t + 0.02*rng.randn(len(tctrl))
+            fdelay, foffset, fperiod, rms = fit_sawtooth(tctrl, tout, t_trig, nominal)
+            self.assertLess(rms, 0.05)
+            self.assertAlmostEqual(fperiod, period, delta=0.05)
+            t_zero = Sawtooth(0.0, t_trig, delay, offset, period).t
+            self.assertAlmostEqual(Sawtooth(0.0, t_trig, fdelay, foffset, fperiod).t, t_zero, delta=0.05)
+
+    def test_phase_scale(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            P = PVS(write_sim_config(dirname, locker_type="ATCA"))
+            L = Gen2LaserLocker(P.E, P, None)
+        self.assertNotEqual(L.phasescale, 1.0)
+        rng = np.random.RandomState(2)
+        period = 1/L.laser_f
+        t_trig = 800000.0
+        tctrl = np.linspace(0, L.calib_range, 16) # motor units
+        S = Sawtooth(tctrl * L.phasescale, t_trig, 40.0, 300.0, period)
+        tout = S.t + 0.02*rng.randn(len(tctrl))
+        delay, offset, fperiod, rms = L.fit_calibration(tctrl, tout, t_trig)
+        self.assertLess(rms, 0.05)
+        self.assertAlmostEqual(fperiod, period, delta=0.05)
+        self.assertAlmostEqual(offset, Sawtooth(0.0, t_trig, 40.0, 300.0, period).t, delta=0.05)
+        self.assertAlmostEqual(delay, offset - t_trig)
+
+    def test_calibrate_on_simulated_ioc(self):
+        phasescale = 2856.0/2600.0
+        with tempfile.TemporaryDirectory() as dirname:
+            P = PVS(write_sim_config(dirname, {"calib_settle" : 0.05, "calib_sweep_points" : 6,
+                "pv_backend_options" : {"counter_rate" : 50.0, "update_rate" : 100.0,
+                "motor_velocity" : 1e8, "phase_scale" : phasescale}}, locker_type="ATCA"))
+        L = Gen2LaserLocker(P.E, P, None)
+        L.W = watchdog(P.config.pvlist['watchdog'])
+        P.put('calibrate', 1)
+        L.calibrate(report=False)
+        ioc = P.config.backend.ioc
+        self.assertLess(P.get('calib_error'), 0.05)
+        self.assertAlmostEqual(L.d['offset'], Sawtooth(0.0, 0.0, ioc.delay, ioc.offset, ioc.period).t, delta=0.05)
+        self.assertEqual(P.get('busy'), 0)
+
+class test_sineFit(unittest.TestCase):
+    def test_stops_when_known(self):
+        rng = np.random.RandomState(3)
+        F = SineFit(29)
+        for n in range(29):
+            t = 100.0 + rng.uniform(-0.5, 0.5)
+            F.add(t, t + 0.7 + ffun(t, 0.02, -0.01) + 0.001*rng.randn())
+            if F.converged(0.002):
+                break
+        self.assertLess(F.n, 29)
+        self.assertAlmostEqual(F.param[0], 0.02, delta=F.halfwidth[0])
+        self.assertAlmostEqual(F.param[1], -0.01, delta=F.halfwidth[1])
+
+    def test_noisy_runs_to_capacity(self):
+        rng = np.random.RandomState(4)
+        F = SineFit(29)
+        for n in range(29):
+            t = rng.uniform(-0.5, 0.5)
+            F.add(t, t + 0.1*rng.randn())
+        self.assertFalse(F.converged(0.002))
+
+class test_recursiveSineFit(unittest.TestCase):
+    def sample(self, x, rng):
+        return x + 0.4 + 0.015*np.sin(W_CORRECTION*x) - 0.008*np.cos(W_CORRECTION*x) + 0.001*rng.randn()
+
+    def test_follows_natural_moves(self):
+        rng = np.random.RandomState(5)
+        R = RecursiveSineFit()
+        for n in range(200):
+            x = 5.0 + rng.uniform(-0.3, 0.3)
+            R.update(x, self.sample(x, rng))
+        self.assertTrue(R.converged(0.002))
+        self.assertAlmostEqual(R.param[0], 0.015, delta=0.002)
+        self.assertAlmostEqual(R.param[1], -0.008, delta=0.002)
+
+    def test_no_moves_no_estimate(self):
+        rng = np.random.RandomState(6)
+        R = RecursiveSineFit()
+        for n in range(500):
+            R.update(5.0, self.sample(5.0, rng))
+        self.assertFalse(R.converged(0.002))
+
+class test_calibrationExecutor(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_samples_after_move(self):
+        options = {"counter_noise" : 0.0, "motor_velocity" : 20000.0}
+        P = PVS(write_sim_config(self.tmpdir.name, {"pv_backend_options" : options}))
+        ioc = P.config.backend.ioc
+        E = CalibrationExecutor(P, PhaseMotor(P), TimeIntervalCounter(P))
+        for x in np.linspace(0, 30, 6):
+            t, good = E.measure(x)
+            self.assertEqual(good, 1)
+            self.assertAlmostEqual(t, ioc.laser_time(), places=6) # not a sample from mid-move
+        self.assertGreater(len(E.model.moves), 2)
+        self.assertIn('6 points', E.report(1.0))
+
+    def test_one_reading_per_point(self):
+        options = {"counter_noise" : 0.0, "motor_velocity" : 20000.0, "counter_rate" : 20.0}
+        P = PVS(write_sim_config(self.tmpdir.name, {"pv_backend_options" : options}))
+        C = TimeIntervalCounter(P)
+        E = CalibrationExecutor(P, PhaseMotor(P), C, poll=0.005)
+        readings = []
+        add = C.rt.add_element
+        C.rt.add_element = lambda x: (readings.append(x), add(x))
+        for n, x in enumerate([10.0, 20.0, 0.0]):
+            t, good = E.measure(x)
+            self.assertEqual(good, 1)
+            self.assertEqual(len(readings), n + 1) # no repeats of one sample
+
+    def test_counter_clock_skew(self):
+        options = {"counter_noise" : 0.0, "motor_velocity" : 20000.0}
+        P = PVS(write_sim_config(self.tmpdir.name, {"pv_backend_options" : options}))
+        ioc = P.config.backend.ioc
+        read = ioc.read
+        for skew in [-5.0, 5.0]: # counter IOC clock behind, then ahead of the motor's
+            def skewed(pvname):
+                value, stamp = read(pvname)
+                return value, stamp + skew if pvname == ioc.counter else stamp
+            ioc.read = skewed
+            E = CalibrationExecutor(P, PhaseMotor(P), TimeIntervalCounter(P), timeout=2.0)
+            for x in [10.0, 20.0, 0.0]:
+                t, good = E.measure(x)
+                self.assertEqual(good, 1)
+                self.assertAlmostEqual(t, ioc.laser_time(), places=6)
+
+if __name__ == '__main__':
+    args = sweep()
+    t0 = time.time()
+    loop_fit_offset(*args)
+    t1 = time.time()
+    fit_offset(*args)
+    t2 = time.time()
+    print('loop %.3f s, vectorized %.3f s, speedup %.0fx'%(t1-t0, t2-t1, (t1-t0)/(t2-t1)))
@@ -0,0 +1,160 @@
+"""Drift estimator tests"""
+
+import json
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from support.DriftEstimator import create_drift_estimator
+from support.PVS import PVS
+from support.laserlockerversions.Gen1LaserLocker import LaserLocker
+from simbackend_test import write_sim_config
+
+class test_driftEstimators(unittest.TestCase):
+    def test_exponential_matches_original(self):
+        E = create_drift_estimator('exponential', {'max_age' : 0})
+        drift_last = E.update(0.004, 100.0, 10.0)
+        for n, de in enumerate([0.006, 0.02, 0.02, -0.01]):
+            drift_last = drift_last + (de - drift_last) / 10.0
+            drift_last = min(.015, max(-.015, drift_last))
+            self.assertAlmostEqual(E.update(de, 101.0 + n, 10.0), drift_last)
+
+    def test_stale_and_missed(self):
+        E = create_drift_estimator('kalman', {'max_age' : 0})
+        for n in range(5):
+            E.update(0.001, 100.0 + n)
+        before = E.state()
+        self.assertEqual(E.update(0.01, 102.0), E.update(0.01, 104.0)) # not newer, ignored
+        self.assertEqual(E.stale, 2)
+        self.assertEqual(E.state()['drift'], before['drift'])
+        E.update(0.001, 110.0)
+        self.assertEqual(E.missed, 5)
+
+    def bias(self, name):
+        rng = np.random.RandomState(0)
+        E = create_drift_estimator(name, {'max_age' : 0})
+        errors = []
+        for n in range(400):
+            if 200 <= n < 230:
+                continue # timetool dropped out
+            d = E.update(3e-5*n + 0.001*rng.randn(), 1000.0 + n, 10.0)
+            if n > 100:
+                errors.append(d - 3e-5*n)
+        return np.mean(errors), E
+
+    def test_tracks_ramp(self):
+        lag, E = self.bias('exponential')
+        for name in ['alpha_beta', 'kalman']:
+            bias, E = self.bias(name)
+            self.assertLess(abs(bias), abs(lag) / 2, name)
+            self.assertAlmostEqual(E.rate, 3e-5, delta=1e-5)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, create_drift_estimator, 'median')
+
+def drift_locker(dirname, add_config=None):
+    """ Return a simulated Gen 1 locker using drift correction."""
+    fpath = write_sim_config(dirname, add_config)
+    with open(fpath) as fp:
+        config = json.load(fp)
+    config["config"]["use_drift_correction"] = True
+    with open(fpath, "w") as fp:
+        json.dump(config, fp)
+    P = PVS(fpath)
+    P.put_many({'enable' : 1, 'time' : 100.0, 'drift_correction_gain' : 1.0,
+        'drift_correction_smoothing' : 1.0, 'drift_correction_accum' : 1,
+        'drift_correction_offset' : 0.0, 'drift_correction_signal' : 0.0})
+    return LaserLocker(P.E, P, None)
+
+class test_driftCorrection(unittest.TestCase):
+    def test_outside_write_without_new_sample(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            L = drift_locker(dirname)
+            L.update_drift()
+            L.P.put('drift_correction_signal', 2000.0)
+            L.update_drift()
+            self.assertAlmostEqual(L.drift_last, 0.002)
+            L.P.put('drift_correction_value', 0.007)
+            L.update_drift() # no new timetool sample
+            self.assertEqual(L.drift_last, 0.007)
+
+    def test_no_reads_without_new_sample(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            L = drift_locker(dirname)
+            L.update_drift()
+            stats = L.P.stats.channels[('drift_correction_offset', 'get')]
+            n = stats.n
+            L.update_drift()
+            self.assertEqual(stats.n, n)
+
+    def test_own_writes_are_not_outside_writes(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            L = drift_locker(dirname, {"use_pv_monitors" : True, "drift_estimator" : "kalman"})
+            resets = []
+            reset = L.drift.reset
+            L.drift.reset = lambda value, stamp=None: (resets.append(value), reset(value, stamp))[1]
+            L.update_drift()
+            ioc = L.P.config.backend.ioc
+            for n in range(1, 6):
+                if n == 4: # our writes now fail
+                    ioc.set_offline(L.P.config.pvlist['drift_correction_value'].pvname)
+                time.sleep(0.01) # a new timestamp
+                L.P.put('drift_correction_signal', 1000.0 * n)
+                L.update_drift()
+            self.assertEqual(len(resets), 1) # the first sample only
+            self.assertNotEqual(L.drift.rate, 0.0)
+
+class test_driftWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.L = drift_locker(self.tmpdir.name, {"drift_worker" : True,
+            "drift_worker_max_step" : 0.001, "drift_worker_interval" : 0.02})
+        self.P = self.L.P
+        self.L.start_drift_worker()
+        with self.L.motor_lock:
+            self.L.set_time()
+        self.p0 = self.L.M.position
+
+    def tearDown(self):
+        self.L.stop_drift_worker()
+        self.tmpdir.cleanup()
+
+    def wait_for_phase(self, dx, timeout=2.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline and abs(self.L.M.position - self.p0 - dx) > 1e-9:
+            time.sleep(0.01)
+        return self.L.M.position - self.p0
+
+    def test_steps_to_correction(self):
+        self.P.put('drift_correction_signal', 5000.0) # 0.005 ns
+        self.assertAlmostEqual(self.wait_for_phase(-0.005), -0.005, places=9)
+        self.assertGreaterEqual(self.L.drift_worker.steps, 5) # no step above max_step
+        self.assertAlmostEqual(self.L.last_pc, self.L.M.position)
+        self.assertAlmostEqual(self.P.get('phase_motor') * self.L.M.scale - self.p0, -0.005, places=9)
+        last_move = self.L.last_move
+        with self.L.motor_lock:
+            self.L.set_time() # already applied, set_time leaves the phase alone
+        self.assertEqual(self.L.last_move, last_move)
+
+    def test_steps_without_reads(self):
+        gets = lambda: [self.P.stats.channels.get((name, 'get')) for name in ['enable', 'drift_correction_gain']]
+        counts = [0 if c is None else c.n for c in gets()]
+        self.P.put('drift_correction_signal', 5000.0)
+        self.assertAlmostEqual(self.wait_for_phase(-0.005), -0.005, places=9)
+        enable, gain = [0 if c is None else c.n for c in gets()]
+        self.assertEqual(enable, counts[0])
+        self.assertLessEqual(gain - counts[1], 1) # with the sample
+        self.P.put('enable', 0)
+        self.assertFalse(self.L.drift_worker.enabled)
+
+    def test_waits_for_motor(self):
+        with self.L.motor_lock:
+            self.P.put('drift_correction_signal', 5000.0)
+            time.sleep(0.2)
+            self.assertEqual(self.L.M.position, self.p0)
+            self.L.set_time() # leaves the outstanding correction to the worker
+            self.assertEqual(self.L.M.position, self.p0)
+        self.assertAlmostEqual(self.wait_for_phase(-0.005), -0.005, places=9)
+        self.assertGreater(self.L.drift_worker.skipped, 0)
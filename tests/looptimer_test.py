@@ -0,0 +1,27 @@
+"""Main loop phase timer tests"""
+
+import unittest
+
+from support.LoopTimer import LoopTimer
+
+class test_loopTimer(unittest.TestCase):
+    def test_rolling_percentiles(self):
+        timer = LoopTimer(window=100)
+        for i in range(200):
+            timer.record('set_time', 1.0 if i < 100 else 0.01) # older runs fall out of the window
+        n, p50, p99, top = timer.percentiles('set_time')
+        self.assertEqual(n, 100)
+        self.assertAlmostEqual(p50, 0.01)
+        self.assertAlmostEqual(top, 0.01)
+
+    def test_phase_context_records_on_error(self):
+        timer = LoopTimer()
+        with self.assertRaises(ValueError):
+            with timer.phase('check_jump'):
+                raise ValueError
+        self.assertEqual(timer.percentiles('check_jump')[0], 1)
+        self.assertIn('check_jump', timer.summary())
+        self.assertIn('check_jump', timer.dump())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Main loop scheduler tests"""
+
+import tempfile
+import threading
+import time
+import unittest
+
+import femto
+from support.Scheduler import Scheduler, Task
+from support.backend.SimulatedBackend import SimulatedBackend
+from simbackend_test import write_sim_config
+
+class test_scheduler(unittest.TestCase):
+    def test_period_and_trigger(self):
+        fired = {'slow' : 0, 'fast' : 0, 'flag' : False}
+        def trigger():
+            flag = fired['flag']
+            fired['flag'] = False
+            return flag
+        slow = Task('slow', lambda: fired.__setitem__('slow', fired['slow'] + 1), 10.0)
+        fast = Task('fast', lambda: fired.__setitem__('fast', fired['fast'] + 1), 10.0, trigger)
+        S = Scheduler([slow, fast])
+        self.assertEqual(S.tick(), 2) # everything runs on the first tick
+        self.assertEqual(S.tick(), 0)
+        fired['flag'] = True
+        self.assertEqual(S.tick(), 1)
+        self.assertEqual((fired['slow'], fired['fast'], fast.triggered), (1, 2, 1))
+        self.assertGreater(S.time_to_next(60.0), 9.0)
+
+    def test_overrun_is_counted(self):
+        task = Task('t', lambda: None, 0.01)
+        S = Scheduler([task])
+        S.tick()
+        time.sleep(0.05)
+        S.tick()
+        self.assertEqual(task.overruns, 1)
+        self.assertIn('t', S.dump())
+
+    def test_when_holds_task(self):
+        task = Task('t', lambda: None, 0.01, when=lambda: False)
+        S = Scheduler([task])
+        self.assertEqual(S.tick(), 0)
+
+class test_asyncEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.control_time = femto.control_time
+        self.run_degrees = femto.run_degrees
+
+    def tearDown(self):
+        femto.control_time = self.control_time
+        femto.run_degrees = self.run_degrees
+        self.tmpdir.cleanup()
+
+    def test_duties_overlap(self):
+        fpath = write_sim_config(self.tmpdir.name, {"engine" : "async", "heartbeat_period" : 0.1,
+            "max_idle" : 0.1, "schedule" : {"degrees" : 0.1}})
+        backend = SimulatedBackend()
+        ioc = backend.ioc
+        def slow(P, L, timer): # a set_time held up by the motor
+            time.sleep(1.0)
+            self.control_time(P, L, timer)
+        femto.control_time = slow
+        degrees = []
+        def count(D, timer):
+            degrees.append(time.time())
+            self.run_degrees(D, timer)
+        femto.run_degrees = count
+        thread = threading.Thread(target=femto.femto, args=(fpath, backend))
+        thread.daemon = True
+        thread.start()
+        time.sleep(2.0) # past the startup
+        watchdog = "SIM:LAS:FS_WATCHDOG"
+        count = (ioc.records[watchdog], len(degrees))
+        time.sleep(0.6) # mostly within a slow time duty
+        self.assertGreaterEqual(ioc.records[watchdog] - count[0], 3)
+        self.assertGreaterEqual(len(degrees) - count[1], 3)
+        ioc.write(watchdog, -1)
+        thread.join(5.0)
+        self.assertFalse(thread.is_alive())
+
+if __name__ == '__main__':
+    unittest.main()
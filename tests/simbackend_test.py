@@ -0,0 +1,301 @@
+"""Simulated pv backend and PVS tests"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from support.PVS import PVS
+from support.PVPolicy import ChannelPolicy
+from support.backend.SimulatedBackend import SimulatedBackend
+
+def write_sim_config(dirname, add_config=None, locker_type="SIM"):
+    """ Write a minimal configuration using the simulated backend, return its path."""
+    config = {
+        "config_meta" : {"author" : "test", "author_date" : "", "desc" : "simulated locker"},
+        "config" : {
+            "name" : "SIMTEST",
+            "type" : locker_type,
+            "genpv_base" : "SIM:LAS:",
+            "dev_base" : "SIM:LAS:",
+            "matlab_pv_base" : "SIM:LAS:matlab:",
+            "matlab_pv_offsets" : 1,
+            "matlab_pv_digits" : 2,
+            "counter_base" : "SIM:TIC:",
+            "freq_counter" : "SIM:FREQ",
+            "phase_motor" : "SIM:LAS:MMS:PH",
+            "error_pv_name" : "SIM:LAS:FS_ERROR",
+            "version_pv_name" : "SIM:LAS:FS_VERSION",
+            "laser_trigger" : "SIM:TRIG:TDES",
+            "trig_in_ticks" : False,
+            "reverse_counter" : 1,
+            "use_secondary_calibration" : False,
+            "use_drift_correction" : False,
+            "use_dither" : False,
+            "timeout" : 1.0,
+            "use_combined_counter" : False
+        },
+        "add_config" : {"pv_backend" : "sim", "atca_base" : "SIM:ATCA:"}
+    }
+    config["add_config"].update(add_config or {})
+    fpath = os.path.join(dirname, "sim_config.json")
+    with open(fpath, "w") as fp:
+        json.dump(config, fp)
+    return fpath
+
+class test_simulatedBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fpath = write_sim_config(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_pvs_connects(self):
+        P = PVS(self.fpath)
+        self.assertEqual(P.OK, 1)
+        self.assertEqual(P.failed_pvs, [])
+        self.assertIsInstance(P.config.backend, SimulatedBackend)
+
+    def test_required_pv_offline(self):
+        backend = SimulatedBackend()
+        backend.ioc.set_offline("SIM:LAS:FREQ_ERR")
+        self.assertEqual(PVS(self.fpath, backend=backend).OK, 1)
+        backend.ioc.set_offline("SIM:LAS:FS_WATCHDOG")
+        self.assertEqual(PVS(self.fpath, backend=backend).OK, 0)
+
+    def test_put_get_roundtrip(self):
+        P = PVS(self.fpath)
+        P.put('time', 12.5)
+        self.assertEqual(P.get('time'), 12.5)
+
+    def test_get_many_order(self):
+        P = PVS(self.fpath)
+        P.put('rf_pwr', 0.25)
+        P.put('laser_locked', 1)
+        self.assertEqual(P.get_many(['laser_locked', 'rf_pwr']), [1, 0.25])
+
+    def test_offline_pv_reports_failure(self):
+        P = PVS(self.fpath)
+        P.put('laser_locked', 1)
+        P.get('laser_locked')
+        P.config.backend.ioc.set_offline(P.config.pvlist['laser_locked'].pvname)
+        self.assertEqual(P.get_many(['laser_locked']), [1]) # the last value, as get()
+        self.assertEqual(P.get('laser_locked'), 1)
+
+    def test_never_read_pv_reads_zero(self):
+        backend = SimulatedBackend()
+        P = PVS(self.fpath, backend=backend)
+        pv = P.config.pvlist['laser_locked']
+        pv.value = None # never read
+        backend.ioc.set_offline(pv.pvname)
+        self.assertEqual(P.get_many(['laser_locked', 'time']), [0, P.get('time')])
+        self.assertEqual(P.get('laser_locked'), 0)
+
+    def test_get_many_timestamps(self):
+        P = PVS(self.fpath)
+        P.put('time', 3.0)
+        t0 = time.time()
+        P.get_many(['time', 'enable'])
+        self.assertEqual(P.get_last('time'), 3.0)
+        self.assertGreaterEqual(P.get_timestamp('time'), t0 - 1.0)
+
+    def test_motor_moves_at_finite_speed(self):
+        P = PVS(self.fpath)
+        P.config.backend.ioc.motor_velocity = 10000.0
+        P.put('phase_motor', 2000.0)
+        self.assertEqual(P.get('phase_motor_dmov'), 0)
+        time.sleep(0.3)
+        self.assertEqual(P.get('phase_motor_dmov'), 1)
+        self.assertEqual(P.get('phase_motor_rb'), 2000.0)
+
+    def test_counter_follows_sawtooth(self):
+        P = PVS(self.fpath)
+        ioc = P.config.backend.ioc
+        ioc.counter_noise = 0.0
+        P.put('laser_trigger', 100.0)
+        time.sleep(0.2) # wait for a fresh sample
+        t = P.get('counter') * 1e9
+        self.assertGreaterEqual(t, 100.0 + ioc.delay)
+        self.assertLess(t, 100.0 + ioc.delay + ioc.period)
+
+    def test_channel_statistics(self):
+        P = PVS(self.fpath)
+        P.config.backend.ioc.set_offline(P.config.pvlist['enable'].pvname)
+        P.get('time')
+        P.get('enable')
+        self.assertEqual(P.stats.channels[('time', 'get')].timeouts, 0)
+        self.assertEqual(P.stats.channels[('enable', 'get')].timeouts, 1)
+        self.assertIn('enable', P.dump_stats())
+        self.assertIn('tmo 1', P.stats.summary())
+
+    def test_reconnect_waits_for_dropped_channels(self):
+        P = PVS(self.fpath)
+        ioc = P.config.backend.ioc
+        pvname = P.config.pvlist['time'].pvname
+        ioc.set_offline(pvname)
+        self.assertEqual(P.reconnect(0.05), ['time'])
+        ioc.set_offline(pvname, False)
+        self.assertEqual(P.reconnect(0.05), [])
+
+    def test_watched_pv_wakes_loop(self):
+        P = PVS(self.fpath)
+        P.watch(['calibrate', 'not_a_pv'])
+        self.assertFalse(P.wait_event(0.01))
+        P.config.backend.ioc.write(P.config.pvlist['calibrate'].pvname, 1)
+        t0 = time.time()
+        self.assertTrue(P.wait_event(1.0))
+        self.assertLess(time.time() - t0, 0.1)
+
+class test_sharedChannels(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.backend = SimulatedBackend()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lockers_share_channels(self):
+        fpath = write_sim_config(self.tmpdir.name)
+        P1 = PVS(fpath, backend=self.backend)
+        P2 = PVS(fpath, backend=self.backend)
+        pv = P1.config.pvlist['time']
+        self.assertIs(pv, P2.config.pvlist['time'])
+        self.assertEqual(self.backend.refs[pv.pvname], 2)
+        P1.close()
+        self.assertEqual(self.backend.refs[pv.pvname], 1)
+        P2.close()
+        self.assertEqual(self.backend.channels, {})
+
+    def test_lockers_share_ioc(self):
+        P1 = PVS(write_sim_config(self.tmpdir.name), backend=self.backend)
+        P1.put('time', 5.0)
+        config = os.path.join(self.tmpdir.name, "second")
+        os.mkdir(config)
+        fpath = write_sim_config(config)
+        with open(fpath) as fp:
+            c = json.load(fp)
+        c["config"].update({"phase_motor" : "SIM2:LAS:MMS:PH", "counter_base" : "SIM2:TIC:",
+            "laser_trigger" : "SIM2:TRIG:TDES"}) # the FS_* records are shared
+        with open(fpath, "w") as fp:
+            json.dump(c, fp)
+        P2 = PVS(fpath, backend=self.backend)
+        self.assertEqual(P1.get('time'), 5.0) # not reset by the second locker
+        ioc = self.backend.ioc
+        ioc.counter_noise = 0.0
+        P1.put('laser_trigger', 100.0)
+        P2.put('laser_trigger', 300.0)
+        time.sleep(0.2) # wait for fresh samples
+        for P, t_trig in [(P1, 100.0), (P2, 300.0)]: # each counter follows its own trigger
+            t = P.get('counter') * 1e9
+            self.assertGreaterEqual(t, t_trig + ioc.delay)
+            self.assertLess(t, t_trig + ioc.delay + ioc.period)
+
+    def test_overridden_names_are_not_opened(self):
+        P = PVS(write_sim_config(self.tmpdir.name, locker_type="ATCA"), backend=self.backend)
+        self.assertEqual(P.config.pvlist['lock_enable'].pvname, "SIM:ATCA:RF_LOCK_ENABLE")
+        self.assertNotIn("SIM:LAS:RF_LOCK_ENABLE", self.backend.channels)
+        self.assertEqual(self.backend.refs["SIM:LAS:MMS:PH.DMOV"], 1)
+
+class test_pvsCaching(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_monitor_cache_tracks_writes(self):
+        P = PVS(write_sim_config(self.tmpdir.name, {"use_pv_monitors" : True}))
+        P.config.backend.ioc.write(P.config.pvlist['time'].pvname, 3.0)
+        self.assertEqual(P.get_cached('time')[0], 3.0)
+        self.assertEqual(P.get('time'), 3.0)
+
+    def test_put_updates_cache(self):
+        P = PVS(write_sim_config(self.tmpdir.name, {"use_pv_monitors" : True}))
+        for name in ['time', 'offset']: # hold back the monitor events
+            P.config.pvlist[name].remove_callback(P.monitor_index[name])
+        P.put('time', 4.0)
+        self.assertEqual(P.get_cached('time')[0], 4.0)
+        P.put_many({'offset' : 2.0})
+        self.assertEqual(P.get_cached('offset')[0], 2.0)
+
+    def test_stale_cache_entry_is_refetched(self):
+        P = PVS(write_sim_config(self.tmpdir.name, {"use_pv_monitors" : True, "pv_max_age" : {"default" : 5.0, "time" : 0.0}}))
+        time.sleep(0.01)
+        self.assertIsNone(P.get_cached('time'))
+        self.assertIsNotNone(P.get_cached('enable'))
+
+    def test_coalesced_put_is_skipped(self):
+        P = PVS(write_sim_config(self.tmpdir.name, {"coalesce_puts" : True}))
+        ioc = P.config.backend.ioc
+        pvname = P.config.pvlist['busy'].pvname
+        P.put('busy', 1)
+        stamp = ioc.stamps[pvname]
+        time.sleep(0.01)
+        P.put('busy', 1)
+        self.assertEqual(ioc.stamps[pvname], stamp)
+        P.put('busy', 1, force=True)
+        self.assertNotEqual(ioc.stamps[pvname], stamp)
+
+    def test_circuit_breaker_fails_fast(self):
+        P = PVS(write_sim_config(self.tmpdir.name, {"pv_policy" : {"counter_jitter" : {"timeout" : 0.05, "trip_after" : 2, "reset_after" : 0.1}}}))
+        ioc = P.config.backend.ioc
+        pvname = P.config.pvlist['counter_jitter'].pvname
+        ioc.set_offline(pvname)
+        P.get('counter_jitter')
+        P.get('counter_jitter')
+        self.assertEqual(P.policies.open_names(), ['counter_jitter'])
+        P.get('counter_jitter')
+        self.assertEqual(P.stats.channels[('counter_jitter', 'get')].rejected, 1)
+        ioc.set_offline(pvname, False)
+        time.sleep(0.15)
+        P.get('counter_jitter') # trial access closes the breaker
+        self.assertEqual(P.policies.open_names(), [])
+        self.assertIn('counter_jitter', P.dump_stats())
+
+    def test_half_open_breaker_allows_one_trial(self):
+        policy = ChannelPolicy(trip_after=1, reset_after=1.0)
+        policy.failure(100.0)
+        self.assertFalse(policy.allow(100.5))
+        self.assertTrue(policy.allow(101.0)) # the trial
+        self.assertFalse(policy.allow(101.1)) # others wait on it
+        policy.failure(101.2)
+        self.assertFalse(policy.allow(101.3))
+        self.assertTrue(policy.allow(102.2))
+        policy.success()
+        self.assertTrue(policy.allow(102.3))
+        self.assertTrue(policy.allow(102.3))
+
+    def test_async_put_flush(self):
+        P = PVS(write_sim_config(self.tmpdir.name, {"async_puts" : True, "pv_backend_options" : {"latency" : 0.02}}))
+        ioc = P.config.backend.ioc
+        P.put('offset', 1.0)
+        P.put('offset', 2.0)
+        self.assertEqual(P.get('offset'), 2.0) # reads see queued writes
+        P.flush()
+        self.assertEqual(ioc.records[P.config.pvlist['offset'].pvname], 2.0)
+
+    def test_coalescing_sees_queued_write(self):
+        P = PVS(write_sim_config(self.tmpdir.name, {"async_puts" : True, "coalesce_puts" : True,
+            "pv_backend_options" : {"latency" : 0.05}}))
+        ioc = P.config.backend.ioc
+        P.put('ok', 1)
+        P.flush()
+        P.put('ok', 0)
+        P.put('ok', 1) # the 0 is not confirmed yet, so this is not redundant
+        P.flush()
+        self.assertEqual(ioc.records[P.config.pvlist['ok'].pvname], 1)
+
+    def test_error_messages_are_not_collapsed(self):
+        P = PVS(write_sim_config(self.tmpdir.name, {"async_puts" : True, "pv_backend_options" : {"latency" : 0.02}}),
+            epicsdebug=True)
+        written = []
+        P.error_pv.add_callback(lambda value=None, **kw: written.append(value))
+        for n in range(3):
+            P.E.write_error({'value':'message %d'%(n),'lvl':1})
+        P.flush()
+        self.assertEqual(written[-3:], ['message 0', 'message 1', 'message 2'])
+
+if __name__ == '__main__':
+    unittest.main()
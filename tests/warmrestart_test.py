@@ -0,0 +1,58 @@
+"""Laser locker warm restart and hardware object tests"""
+
+import tempfile
+import unittest
+
+from support.PVS import PVS
+from support.laserlockerversions.Gen1LaserLocker import LaserLocker
+from simbackend_test import write_sim_config
+
+class test_warmRestart(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def locker(self, add_config):
+        add_config = dict(add_config, state_dir=self.tmpdir.name)
+        P = PVS(write_sim_config(self.tmpdir.name, add_config))
+        return LaserLocker(P.E, P, None)
+
+    def test_state_round_trip(self):
+        L = self.locker({"warm_restart" : True})
+        for x in range(12):
+            L.C.rt.add_element(1e-9 * x)
+        L.drift_last = 0.002
+        L.save_state(force=True)
+        L2 = self.locker({"warm_restart" : True})
+        self.assertIsNotNone(L2.restore_state())
+        self.assertTrue(L2.C.rt.full)
+        self.assertEqual(list(L2.C.rt.get_array()), list(L.C.rt.get_array()))
+        self.assertEqual(L2.drift_last, 0.002)
+
+    def test_stale_state_is_ignored(self):
+        L = self.locker({"warm_restart" : True})
+        L.save_state(force=True)
+        L2 = self.locker({"warm_restart" : True, "state_max_age" : -1})
+        self.assertIsNone(L2.restore_state())
+
+    def test_disabled_by_default(self):
+        L = self.locker({})
+        L.save_state(force=True)
+        self.assertIsNone(L.restore_state())
+
+class test_motorReuse(unittest.TestCase):
+    def test_one_setpoint_read_per_set_time(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            P = PVS(write_sim_config(dirname))
+        L = LaserLocker(P.E, P, None)
+        P.put_many({'enable' : 1, 'time' : 100.0})
+        L.set_time() # creates the motor
+        stats = P.stats.channels[('phase_motor', 'get')]
+        n = stats.n
+        L.set_time()
+        self.assertEqual(stats.n - n, 1) # get_position only
+
+if __name__ == '__main__':
+    unittest.main()